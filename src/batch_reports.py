@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from images import prepare_hero_image, PDF_PROFILES, DEFAULT_PDF_PROFILE
+from jobs import Job
+from report_model import DEFAULT_TEXTS, DEFAULT_KPIS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+SUMMARY_FILE = "summary.json"
+
+def headless_report_texts(job, user_notes, budget_notes, financial_data):
+    """
+    Generates the texts of a report with Gemini outside of a Streamlit session.
+    Returns the texts as accepted by `build_report_model` and the error messages.
+    """
+    from llm_handler import generate_report_texts
+    generated = generate_report_texts(job, user_notes, budget_notes, financial_data)
+    texts = {
+        'blockquote': generated['generated_blockquote'],
+        'summary': generated['generated_summary'],
+        'waterfall_explanation': generated['waterfall_explanation'],
+        'budget': generated['generated_budget'],
+    }
+    return texts, generated['generation_errors']
+
+def _read_text(path):
+    with open(path, encoding='utf-8') as text_file:
+        return text_file.read()
+
+def find_reports(input_dir):
+    """
+    Lists the reports in `input_dir`: one per .xlsx workbook, with the optional sidecar
+    files that share its name:
+
+        <name>.jpg/.jpeg/.png/.webp  hero image of the title page
+        <name>.notes.txt             notes for the summary
+        <name>.budget.txt            notes for the budget proposal
+        <name>.kpis.json             KPIs, e.g. {"leerstand": 2.5}
+    """
+    reports = []
+    for file_name in sorted(os.listdir(input_dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension.lower() != '.xlsx' or file_name.startswith('~$'):
+            continue
+
+        def sidecar(suffix):
+            path = os.path.join(input_dir, name + suffix)
+            return path if os.path.isfile(path) else None
+
+        reports.append({
+            'name': name,
+            'workbook': os.path.join(input_dir, file_name),
+            'image': next((path for path in map(sidecar, IMAGE_EXTENSIONS) if path), None),
+            'notes': sidecar('.notes.txt'),
+            'budget_notes': sidecar('.budget.txt'),
+            'kpis': sidecar('.kpis.json'),
+        })
+    return reports
+
+def _render_report(job):
+    """
+    Loads the workbook of one report, generates its texts and writes its PDF. Runs in a
+    worker process and returns the summary entry of the report; a failing report is
+    returned with its error instead of raising, so that the other reports still run.
+    """
+    from data_loader import load_financial_data
+    from report_model import build_report_model
+    from pdf_export import pdf_from_reportlab
+
+    entry = {'name': job['name'], 'workbook': job['workbook'], 'status': "done", 'errors': [], 'seconds': {}}
+    stage_start = time.perf_counter()
+    stage = "load"
+    try:
+        financial_data = load_financial_data(job['workbook'])
+        kpis = dict(DEFAULT_KPIS)
+        if job['kpis']:
+            with open(job['kpis'], encoding='utf-8') as kpis_file:
+                kpis.update({key: float(value) for key, value in json.load(kpis_file).items()})
+        hero_image = None
+        if job['image']:
+            with open(job['image'], 'rb') as image_file:
+                hero_image = prepare_hero_image(image_file.read(), {job['profile']: PDF_PROFILES[job['profile']]})
+        entry['seconds'][stage] = time.perf_counter() - stage_start
+
+        stage_start, stage = time.perf_counter(), "texts"
+        texts = dict(DEFAULT_TEXTS)
+        if job['generate_texts']:
+            texts, errors = headless_report_texts(
+                Job(job['name']),
+                _read_text(job['notes']) if job['notes'] else "",
+                _read_text(job['budget_notes']) if job['budget_notes'] else "",
+                financial_data,
+            )
+            entry['errors'].extend(errors)
+        entry['seconds'][stage] = time.perf_counter() - stage_start
+
+        stage_start, stage = time.perf_counter(), "pdf"
+        report_model = build_report_model(financial_data, texts, kpis)
+        pdf_bytes = pdf_from_reportlab(hero_image, report_model, profile=job['profile'])
+        with open(job['output'], 'wb') as out_file:
+            out_file.write(pdf_bytes)
+        entry['seconds'][stage] = time.perf_counter() - stage_start
+
+        entry.update({
+            'title': report_model.primary_market_area,
+            'date_range': report_model.date_range,
+            'output': job['output'],
+            'bytes': len(pdf_bytes),
+        })
+        if entry['errors']:
+            entry['status'] = "incomplete"
+    except Exception as e:
+        entry['seconds'][stage] = time.perf_counter() - stage_start
+        entry['status'] = "failed"
+        entry['errors'].append(f"{stage}: {e}")
+    return entry
+
+def run_batch(input_dir, output_dir, profile=DEFAULT_PDF_PROFILE, generate_texts=True, max_workers=None):
+    """
+    Renders a PDF for every workbook in `input_dir` (see `find_reports`) into
+    `output_dir`, spreading the reports over a pool of `max_workers` processes (one
+    per CPU by default). Writes the run summary to `output_dir`/summary.json and
+    returns it.
+    """
+    if profile not in PDF_PROFILES:
+        raise ValueError(f"Unknown PDF profile: {profile}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = [
+        {**report, 'profile': profile, 'generate_texts': generate_texts, 'output': os.path.join(output_dir, report['name'] + ".pdf")}
+        for report in find_reports(input_dir)
+    ]
+    max_workers = max_workers or os.cpu_count() or 1
+    started_at = time.time()
+    start = time.perf_counter()
+
+    entries = []
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        futures = [pool.submit(_render_report, job) for job in jobs]
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            print(f"[{len(entries)}/{len(jobs)}] {entry['name']}: {entry['status']} ({sum(entry['seconds'].values()):.1f}s)", flush=True)
+            for error in entry['errors']:
+                print(f"    {error}", flush=True)
+
+    seconds = time.perf_counter() - start
+    entries.sort(key=lambda entry: entry['name'])
+    summary = {
+        'input_dir': os.path.abspath(input_dir),
+        'output_dir': os.path.abspath(output_dir),
+        'profile': profile,
+        'generate_texts': generate_texts,
+        'workers': max_workers,
+        'started_at': started_at,
+        'seconds': seconds,
+        'reports_per_minute': len(entries) / seconds * 60 if seconds else 0.0,
+        'counts': {status: sum(1 for entry in entries if entry['status'] == status) for status in ("done", "incomplete", "failed")},
+        'reports': entries,
+    }
+    with open(os.path.join(output_dir, SUMMARY_FILE), 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file, ensure_ascii=False, indent=2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders the PDF reports of all workbooks in a directory without the web interface.")
+    parser.add_argument("input_dir", help="Directory with .xlsx workbooks and their optional sidecar files")
+    parser.add_argument("output_dir", help="Directory the PDFs and summary.json are written to")
+    parser.add_argument("--profile", default=DEFAULT_PDF_PROFILE, choices=list(PDF_PROFILES))
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: one per CPU)")
+    parser.add_argument("--no-texts", dest="generate_texts", action="store_false", help="Skip the Gemini texts and leave the text sections empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    summary = run_batch(args.input_dir, args.output_dir, profile=args.profile, generate_texts=args.generate_texts, max_workers=args.workers)
+    counts = summary['counts']
+    print(f"{len(summary['reports'])} reports in {summary['seconds']:.1f}s with {summary['workers']} workers: "
+          f"{counts['done']} done, {counts['incomplete']} incomplete, {counts['failed']} failed")
+    sys.exit(1 if counts['failed'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+from synthetic_workbook import DATA_COLUMNS, generate_workbook
+
+# Account rows per sheet of the synthetic workbooks
+DEFAULT_SIZES = (20, 200, 2000)
+# A result slower than baseline * threshold counts as a regression
+DEFAULT_THRESHOLD = 1.25
+
+# Stand-in for the Gemini texts, so that runs are fast, offline and repeatable
+STUB_TEXTS = {
+    'blockquote': "Stabile Erträge bei leicht steigenden Unterhaltskosten.",
+    'summary': "Die Liegenschaft erzielte im Berichtsjahr solide Mieterträge. " * 8,
+    'waterfall_explanation': "Der Unterhalt ist der grösste Aufwandposten. " * 4,
+    'budget': "**Budget**\n\n- Unterhalt: CHF 120'000\n- Verwaltung: CHF 40'000\n- Energie: CHF 25'000",
+}
+STUB_KPIS = {
+    'leerstand': 2.5,
+    'rendite_eigenkapital': 4.1,
+    'miete_pro_m2': 310.0,
+}
+
+def _prepare_case(rows, columns, noise_sheets):
+    """Generates the workbook of one input size and the intermediate results the stages start from."""
+    import pandas as pd
+    from PIL import Image as PILImage
+    from data_loader import load_financial_data, _process_dataframe
+    from images import prepare_hero_image, PDF_PROFILES
+    from report_model import build_report_model
+
+    workbook = generate_workbook(rows, columns, noise_sheets, seed=rows)
+    xls = pd.ExcelFile(BytesIO(workbook))
+    raw_sheets = {name: pd.read_excel(xls, name, header=None) for name in ("Bilanz", "Erfolgsrechnung")}
+    financial_data = load_financial_data(BytesIO(workbook))
+
+    image = BytesIO()
+    PILImage.new("RGB", (1600, 900), (90, 120, 150)).save(image, format="JPEG")
+    return {
+        'workbook': workbook,
+        'cells': [value for frame in raw_sheets.values() for value in frame.to_numpy().ravel()],
+        'bilanz': _process_dataframe(raw_sheets["Bilanz"]),
+        'erfolgsrechnung': _process_dataframe(raw_sheets["Erfolgsrechnung"]),
+        'financial_data': financial_data,
+        'report_model': build_report_model(financial_data, STUB_TEXTS, STUB_KPIS),
+        'hero_image': prepare_hero_image(image.getvalue(), PDF_PROFILES),
+    }
+
+def _clear_render_caches():
+    """Empties the caches that would otherwise turn every repetition after the first into a lookup."""
+    import html_renderer
+    import report_model
+    with html_renderer._section_cache_lock:
+        html_renderer._section_cache.clear()
+    with report_model._model_cache_lock:
+        report_model._model_cache.clear()
+
+def _stage_load(case):
+    from data_loader import load_financial_data
+    load_financial_data(BytesIO(case['workbook']))
+
+def _stage_parse_iso_currency(case):
+    from data_loader import parse_iso_currency
+    for value in case['cells']:
+        parse_iso_currency(value)
+
+def _stage_parse_bilanz(case):
+    from data_loader import parse_bilanz
+    parse_bilanz(case['bilanz'])
+
+def _stage_parse_erfolgsrechnung(case):
+    from data_loader import parse_erfolgsrechnung
+    parse_erfolgsrechnung(case['erfolgsrechnung'])
+
+def _stage_waterfall(case):
+    from report_model import _get_waterfall_chart_data
+    _get_waterfall_chart_data(case['financial_data'], [])
+
+def _stage_report_model(case):
+    from report_model import build_report_model
+    build_report_model(case['financial_data'], STUB_TEXTS, STUB_KPIS)
+
+def _stage_html(case):
+    from html_renderer import build_preview_context, render_report_html
+    render_report_html(build_preview_context(case['report_model'], case['hero_image']))
+
+def _stage_pdf(case):
+    from images import DEFAULT_PDF_PROFILE
+    from pdf_export import pdf_from_reportlab
+    pdf_from_reportlab(case['hero_image'], case['report_model'], profile=DEFAULT_PDF_PROFILE)
+
+# (name, function); every stage runs with cold render caches
+STAGES = (
+    ("load_financial_data", _stage_load),
+    ("parse_iso_currency", _stage_parse_iso_currency),
+    ("parse_bilanz", _stage_parse_bilanz),
+    ("parse_erfolgsrechnung", _stage_parse_erfolgsrechnung),
+    ("waterfall_chart_data", _stage_waterfall),
+    ("build_report_model", _stage_report_model),
+    ("render_report_html", _stage_html),
+    ("pdf_from_reportlab", _stage_pdf),
+)
+
+def measure_stage(fn, case, repeat):
+    """
+    Runs a stage once to load its modules and compile its templates, then `repeat`
+    times and returns the median and minimum seconds, then once more under
+    tracemalloc for the peak of the memory it allocated.
+    """
+    _clear_render_caches()
+    fn(case)
+
+    seconds = []
+    for _ in range(repeat):
+        _clear_render_caches()
+        start = time.perf_counter()
+        fn(case)
+        seconds.append(time.perf_counter() - start)
+
+    _clear_render_caches()
+    tracemalloc.start()
+    try:
+        fn(case)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(seconds), min(seconds), peak
+
+def run_benchmarks(sizes=DEFAULT_SIZES, columns=DATA_COLUMNS, noise_sheets=1, repeat=3, stages=None):
+    """
+    Times every stage for synthetic workbooks of the given sizes. Returns one result
+    per stage and size; a stage that fails (e.g. no Chromium for Kaleido) is reported
+    with its error instead of timings.
+    """
+    results = []
+    for rows in sizes:
+        case = _prepare_case(rows, columns, noise_sheets)
+        for name, fn in STAGES:
+            if stages and name not in stages:
+                continue
+            result = {'stage': name, 'rows': rows, 'columns': columns, 'workbook_bytes': len(case['workbook'])}
+            try:
+                median, minimum, peak = measure_stage(fn, case, repeat)
+                result.update({'median_s': median, 'min_s': minimum, 'peak_bytes': peak})
+            except Exception as e:
+                message = next((line for line in str(e).splitlines() if line.strip()), "")
+                result['error'] = f"{type(e).__name__}: {message}"
+            results.append(result)
+            print(_format_result(result), flush=True)
+    return results
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Adds the ratio to the baseline median to every result that has a baseline and
+    returns the results that got slower than `threshold` times the baseline.
+    """
+    baseline_medians = {
+        (entry['stage'], entry['rows'], entry['columns']): entry['median_s']
+        for entry in baseline['results'] if 'median_s' in entry
+    }
+    regressions = []
+    for result in results:
+        base = baseline_medians.get((result['stage'], result['rows'], result['columns']))
+        if base and 'median_s' in result:
+            result['baseline_ratio'] = result['median_s'] / base
+            if result['baseline_ratio'] > threshold:
+                regressions.append(result)
+    return regressions
+
+def _format_result(result):
+    label = f"{result['stage']:<24} {result['rows']:>6} rows {result['workbook_bytes'] / 1024:>7.0f} KB"
+    if 'error' in result:
+        return f"{label}  failed: {result['error']}"
+    line = f"{label} {result['median_s'] * 1000:>10.1f} ms (min {result['min_s'] * 1000:.1f}) {result['peak_bytes'] / 1024:>9.0f} KB peak"
+    if 'baseline_ratio' in result:
+        line += f"  x{result['baseline_ratio']:.2f} vs baseline"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the report pipeline stages on synthetic workbooks of growing size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Account rows per sheet")
+    parser.add_argument("--columns", type=int, default=DATA_COLUMNS)
+    parser.add_argument("--noise-sheets", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stage", action="append", choices=[name for name, _ in STAGES], help="Only run this stage (repeatable)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare against a baseline written with --save-baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown factor that fails the comparison")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.columns, args.noise_sheets, args.repeat, args.stage)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        print(f"\nCompared to {args.baseline} ({baseline['created']}, {baseline['python']}):")
+        for result in results:
+            print(_format_result(result))
+        for result in regressions:
+            print(f"FAIL: {result['stage']} with {result['rows']} rows is {result['baseline_ratio']:.2f}x slower than the baseline")
+        failed = bool(regressions)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({
+                'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, baseline_file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Upper limit for the raw upload bytes kept in memory, across all sessions
+BLOB_STORE_MAX_BYTES = int(os.environ.get("BLOB_STORE_MAX_BYTES", 256 * 1024 * 1024))
+
+# digest -> bytes, least recently used first
+_blobs = OrderedDict()
+_blobs_size = 0
+_blobs_lock = threading.Lock()
+
+def put_blob(data):
+    """
+    Stores raw bytes in the process-wide store and returns their SHA-256 digest.
+    Identical uploads from different sessions are kept only once.
+    """
+    global _blobs_size
+    data = bytes(data)
+    digest = hashlib.sha256(data).hexdigest()
+    with _blobs_lock:
+        if digest in _blobs:
+            _blobs.move_to_end(digest)
+            return digest
+        _blobs[digest] = data
+        _blobs_size += len(data)
+        # Always keep the blob just stored, even if it alone exceeds the limit
+        while _blobs_size > BLOB_STORE_MAX_BYTES and len(_blobs) > 1:
+            _, evicted = _blobs.popitem(last=False)
+            _blobs_size -= len(evicted)
+    return digest
+
+def get_blob(digest):
+    """Returns the bytes stored under `digest`, or None if they were evicted."""
+    with _blobs_lock:
+        data = _blobs.get(digest)
+        if data is not None:
+            _blobs.move_to_end(digest)
+        return data
+
+def blob_store_stats():
+    """Returns the number of stored blobs and their total size in bytes."""
+    with _blobs_lock:
+        return {'blobs': len(_blobs), 'bytes': _blobs_size, 'max_bytes': BLOB_STORE_MAX_BYTES}
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# The same checks run as tests/test_import_times.py with `python -m pytest tests` from
+# the repository root. Run this script directly to list the slowest imports; it exits
+# non-zero when a check fails.
+
+# Milliseconds importing the app may take before the login page renders. Machines
+# vary; raise it on slow ones with IMPORT_BUDGET_MS.
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 250.0))
+
+# Libraries the login page must not load; they are imported on first use
+DEFERRED_MODULES = ('pandas', 'numpy', 'reportlab', 'jinja2', 'markdown', 'google.genai', 'kaleido')
+
+# Streamlit is already imported by `streamlit run` before the app script starts, so it
+# is imported first and not counted against the app.
+_PROBE = """
+import json, sys
+import streamlit
+import {module}
+print(json.dumps(sorted(name for name in {deferred!r} if name in sys.modules)))
+"""
+
+def measure_import(module="main"):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime`. Returns the
+    cumulative import time of the module in milliseconds, the slowest modules it
+    imported as (name, milliseconds) and the deferred libraries that got loaded.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+        cwd=script_dir, capture_output=True, text=True, check=True,
+    )
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(cumulative) / 1000))
+
+    total = next((ms for name, ms in reversed(timings) if name == module), 0.0)
+    # Everything reported after streamlit finished loading was imported by the module
+    streamlit_index = max(index for index, (name, _) in enumerate(timings) if name == "streamlit")
+    app_timings = [(name.strip(), ms) for name, ms in timings[streamlit_index + 1:] if name != module]
+    slowest = sorted(app_timings, key=lambda timing: timing[1], reverse=True)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, slowest, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long importing the app takes before the login page can render.")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Fail if importing the module takes longer")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    args = parser.parse_args()
+
+    total, slowest, loaded = measure_import(args.module)
+    print(f"import {args.module}: {total:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, ms in slowest[:args.top]:
+        print(f"{ms:>9.1f} ms  {name}")
+
+    failed = False
+    if total > args.budget_ms:
+        print(f"FAIL: import takes longer than {args.budget_ms:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"FAIL: loaded at import time although deferred: {', '.join(loaded)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
-import pandas as pd
 import os
 import re
+import sys
+from collections.abc import Mapping
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from blob_store import put_blob, get_blob
+from tracing import span
+
+# Sheets whose cleaned contents are available as display frames
+DISPLAY_SHEETS = ('Bilanz', 'Erfolgsrechnung')
 
 def parse_iso_currency(value):
     """
@@ -183,41 +194,153 @@ def parse_bilanz(df):
         
     return aktiva_dict, passiva_dict
 
-def load_financial_data(uploaded_file):
-    """Loads, trims, and cleans financial data from an uploaded Excel file."""
-    xls = pd.ExcelFile(uploaded_file)
-    financial_data = {}
+def _process_dataframe(df):
+    """Cleans and processes the dataframe."""
+    df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
+    df = df.map(parse_iso_currency)
+    df = df.fillna('')
 
-    def process_dataframe(df):
-        """Cleans and processes the dataframe."""
-        df = df.dropna(how='all', axis=0).dropna(how='all', axis=1)
-        df = df.map(parse_iso_currency)
-        df = df.fillna('')
-        
-        new_columns = [f'Spalte {i + 1}' for i in range(len(df.columns))]
-        df.columns = new_columns
-        
-        return df
+    new_columns = [f'Spalte {i + 1}' for i in range(len(df.columns))]
+    df.columns = new_columns
+
+    return df
+
+def _display_frame(df):
+    """
+    For display purposes, convert all data to strings to avoid mixed-type columns
+    that can cause issues with Arrow serialization in Streamlit.
+    """
+    return df.astype(str).replace('nan', '')
+
+def _header_cell(df, row):
+    """Returns a cell of the second column of a display frame, or None if it is missing."""
+    try:
+        return df.iloc[row, 1]
+    except IndexError:
+        return None
+
+class WorkbookEvicted(Exception):
+    """Raised when a display frame is requested after the workbook left the blob store."""
+
+    def __init__(self, digest):
+        super().__init__("Die Excel-Datei ist nicht mehr im Speicher. Bitte laden Sie sie erneut hoch.")
+        self.digest = digest
+
+class FinancialData(Mapping):
+    """
+    The financial data of a workbook in a compact form. Each section (Erträge,
+    Aufwand, Aktiva, Passiva) is a tuple of labels with a float64 array of values.
+    The workbook itself is kept once in the shared blob store. The display frames
+    ('Bilanz', 'Erfolgsrechnung') are parsed from it by `display_frame` only, and
+    not retained.
+
+    Reads like the dict of sections that load_financial_data used to return:
+    `data['Aufwand']` builds the {label: value} dict on the fly. `'Bilanz' in data`
+    and keys() also list the sheets, but iterating, values() and items() cover the
+    sections only, so that none of them parses the workbook again.
+    """
+    __slots__ = ('digest', 'sheet_names', 'date_range', 'primary_market_area', '_sections')
+
+    def __init__(self, digest, sheet_names, sections, date_range=None, primary_market_area=None):
+        self.digest = digest
+        self.sheet_names = tuple(sheet_names)
+        self.date_range = date_range
+        self.primary_market_area = primary_market_area
+        self._sections = {
+            name: (tuple(sys.intern(label) for label in values), np.fromiter(values.values(), dtype=np.float64, count=len(values)))
+            for name, values in sections.items()
+        }
+
+    def section_arrays(self, name):
+        """Returns the labels and the float64 values of a section."""
+        return self._sections[name]
+
+    def display_frame(self, sheet_name):
+        """
+        Parses the display frame of a sheet from the stored workbook. Raises KeyError
+        if the sheet does not exist and WorkbookEvicted if the workbook is no longer
+        in the blob store.
+        """
+        if sheet_name not in DISPLAY_SHEETS or sheet_name not in self.sheet_names:
+            raise KeyError(sheet_name)
+        data = get_blob(self.digest)
+        if data is None:
+            raise WorkbookEvicted(self.digest)
+        return _display_frame(_process_dataframe(pd.read_excel(BytesIO(data), sheet_name, header=None)))
+
+    def __getitem__(self, key):
+        labels, values = self._sections[key]
+        return dict(zip(labels, values.tolist()))
+
+    def __contains__(self, key):
+        return key in self._sections or (key in DISPLAY_SHEETS and key in self.sheet_names)
+
+    def keys(self):
+        """Returns the section names followed by the display sheets of the workbook."""
+        return tuple(self._sections) + tuple(name for name in DISPLAY_SHEETS if name in self.sheet_names)
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    def memory_usage(self):
+        """Returns the bytes held by this object (the shared workbook not included)."""
+        size = sys.getsizeof(self) + sys.getsizeof(self._sections)
+        for labels, values in self._sections.values():
+            size += sys.getsizeof(labels) + sum(sys.getsizeof(label) for label in labels) + values.nbytes
+        return size
+
+def load_financial_data(uploaded_file, progress=None):
+    """
+    Loads, trims, and cleans financial data from an uploaded Excel file (file-like
+    object or path) and returns it as FinancialData.
+    `progress`, if given, is called with a fraction and a message between the steps.
+    """
+    def report(fraction, message):
+        if progress is not None:
+            progress(fraction, message)
+
+    report(0.0, "Excel-Datei wird geöffnet...")
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, 'rb') as f:
+            data = f.read()
+    else:
+        data = uploaded_file.getvalue() if hasattr(uploaded_file, 'getvalue') else uploaded_file.read()
+    digest = put_blob(data)
+    with span("excel_open", bytes=len(data)):
+        xls = pd.ExcelFile(BytesIO(data))
+    sections = {}
+    date_range = primary_market_area = None
 
     if "Bilanz" in xls.sheet_names:
-        bilanz_df = pd.read_excel(xls, "Bilanz", header=None)
-        processed_bilanz_df = process_dataframe(bilanz_df)
-        financial_data["Bilanz"] = processed_bilanz_df.astype(str).replace('nan', '')
-        
-        aktiva, passiva = parse_bilanz(processed_bilanz_df)
-        financial_data["Aktiva"] = aktiva
-        financial_data["Passiva"] = passiva
+        report(0.2, "Bilanz wird gelesen...")
+        with span("read_excel", sheet="Bilanz"):
+            bilanz_df = pd.read_excel(xls, "Bilanz", header=None)
+        with span("clean_sheet", sheet="Bilanz"):
+            processed_bilanz_df = _process_dataframe(bilanz_df)
+
+        with span("parse_bilanz"):
+            aktiva, passiva = parse_bilanz(processed_bilanz_df)
+        sections["Aktiva"] = aktiva
+        sections["Passiva"] = passiva
 
     if "Erfolgsrechnung" in xls.sheet_names:
-        erfolgsrechnung_df = pd.read_excel(xls, "Erfolgsrechnung", header=None)
-        processed_erfolgsrechnung_df = process_dataframe(erfolgsrechnung_df)
-        
-        ertraege, aufwand = parse_erfolgsrechnung(processed_erfolgsrechnung_df)
-        financial_data["Erträge"] = ertraege
-        financial_data["Aufwand"] = aufwand
-        
-        # For display purposes, convert all data to strings to avoid mixed-type columns
-        # that can cause issues with Arrow serialization in Streamlit.
-        financial_data["Erfolgsrechnung"] = processed_erfolgsrechnung_df.astype(str).replace('nan', '')
-        
-    return financial_data
+        report(0.6, "Erfolgsrechnung wird gelesen...")
+        with span("read_excel", sheet="Erfolgsrechnung"):
+            erfolgsrechnung_df = pd.read_excel(xls, "Erfolgsrechnung", header=None)
+        with span("clean_sheet", sheet="Erfolgsrechnung"):
+            processed_erfolgsrechnung_df = _process_dataframe(erfolgsrechnung_df)
+
+        with span("parse_erfolgsrechnung"):
+            ertraege, aufwand = parse_erfolgsrechnung(processed_erfolgsrechnung_df)
+        sections["Erträge"] = ertraege
+        sections["Aufwand"] = aufwand
+
+        # Only the report header is needed from the display frame, which is not kept
+        display_df = _display_frame(processed_erfolgsrechnung_df)
+        date_range = _header_cell(display_df, 1)
+        primary_market_area = _header_cell(display_df, 2)
+
+    return FinancialData(digest, xls.sheet_names, sections, date_range, primary_market_area)
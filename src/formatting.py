@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+
+# Swiss (de_CH) monetary conventions: "CHF 1’234.50" and "CHF-1’234.50"
+CURRENCY_SYMBOL = "CHF"
+THOUSANDS_SEPARATOR = "’"
+
+def _format_number(number):
+    """Formats a finite float the way de_CH formats amounts of money."""
+    text = f"{abs(number):,.2f}".replace(",", THOUSANDS_SEPARATOR)
+    if number < 0 and text != "0.00":
+        return f"{CURRENCY_SYMBOL}-{text}"
+    return f"{CURRENCY_SYMBOL} {text}"
+
+def format_currency(value):
+    """
+    Formats a number as CHF currency. Values that are not numbers (or not finite) are
+    returned unchanged. Does not depend on the system locale and is safe to call from
+    concurrent sessions.
+    """
+    try:
+        number = float(value)
+    except (ValueError, TypeError):
+        return value
+    if not math.isfinite(number):
+        return value
+    return _format_number(number)
+
+def format_currency_batch(values):
+    """
+    Formats a whole column of values (list, NumPy array or pandas Series) in one call
+    and returns a list of the same length. Gives the same result as calling
+    `format_currency` on every value.
+    """
+    if not hasattr(values, '__len__'):
+        values = list(values)
+    try:
+        numbers = np.asarray(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        # Mixed column with text entries; fall back to the per-value path
+        return [format_currency(value) for value in values]
+
+    finite = np.isfinite(numbers)
+    if finite.all():
+        return [_format_number(number) for number in numbers.tolist()]
+    return [
+        _format_number(number) if is_finite else value
+        for number, is_finite, value in zip(numbers.tolist(), finite.tolist(), values)
+    ]
@@ -0,0 +1,354 @@
+import base64
+import functools
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from formatting import format_currency
+from visualizations import create_waterfall_chart, create_waterfall_svg
+
+# --- Template and Static Assets ---
+TEMPLATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
+REPORT_TEMPLATE = 'mgmtreporting.html'
+CSS_PATH = os.path.join(TEMPLATE_DIR, 'tailwind.css')
+LOGO_PATH = os.path.join(TEMPLATE_DIR, 'LELIA_LOGO_L_W.png')
+
+TEMPLATE_PATH = os.path.join(TEMPLATE_DIR, REPORT_TEMPLATE)
+
+# Upper limit for the HTML sent to the preview iframe. Optional assets are dropped
+# (in the order below) when a report would exceed it.
+PREVIEW_MAX_BYTES = int(os.environ.get("PREVIEW_MAX_BYTES", 750_000))
+OPTIONAL_PREVIEW_ASSETS = ('hero_image_base64', 'logo_base64')
+# Financial tables of the template context. When a report is still too large without
+# the optional assets, the preview shows only their first rows; the PDF has them all.
+PREVIEW_TABLES = ('ertraege', 'aufwand', 'aktiva', 'passiva')
+# Marker in the dropped assets of render_preview_html for shortened tables
+TRUNCATED_TABLES = 'financial_tables'
+# Chart used in the HTML preview: "svg" (static, no JavaScript) or "plotly" (interactive,
+# loads plotly.js from the CDN)
+PREVIEW_CHART = os.environ.get("PREVIEW_CHART", "svg")
+
+# Number of rendered report sections ({% block %}s of the template) kept in memory
+SECTION_CACHE_SIZE = 128
+
+# Optional directory for Jinja's compiled template bytecode, so that a fresh process
+# does not have to compile the template again.
+BYTECODE_CACHE_DIR = os.environ.get("JINJA_BYTECODE_CACHE_DIR")
+
+def markdown_to_html(md):
+    """Converts a markdown string to HTML."""
+    import markdown
+    return markdown.markdown(md)
+
+def minify_css(css):
+    """Strips comments (except /*! license */ banners) and redundant whitespace from CSS."""
+    # Comments are matched left to right so that "*/*" after a comment is not taken
+    # for the start of another one
+    css = re.sub(r'/\*.*?\*/', lambda m: m.group(0) if m.group(0).startswith('/*!') else '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+_CLASS_SELECTOR = re.compile(r'\.((?:\\.|[\w-])+)')
+
+def _split_selectors(prelude):
+    """Splits a selector list at top-level commas (not inside parentheses or brackets)."""
+    selectors, depth, current = [], 0, []
+    for char in prelude:
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        if char == ',' and depth == 0:
+            selectors.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    selectors.append(''.join(current))
+    return selectors
+
+def _selector_classes(selector):
+    """Returns the (unescaped) class names a selector refers to."""
+    return {re.sub(r'\\(.)', r'\1', name) for name in _CLASS_SELECTOR.findall(selector)}
+
+def _matching_brace(css, open_index):
+    """Returns the index of the brace closing the block opened at `open_index`."""
+    depth = 0
+    for index in range(open_index, len(css)):
+        if css[index] == '{':
+            depth += 1
+        elif css[index] == '}':
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(css) - 1
+
+def purge_css(css, used_classes):
+    """
+    Drops the style rules of a utility stylesheet whose selectors need a class that
+    is not in `used_classes`. Element selectors, @font-face, @keyframes and the like
+    are kept; @media and @supports blocks are purged recursively.
+    """
+    out = []
+    pos = 0
+    while pos < len(css):
+        brace = css.find('{', pos)
+        semicolon = css.find(';', pos)
+        if brace == -1:
+            break
+        if semicolon != -1 and semicolon < brace:
+            # Statement at-rule such as @charset
+            out.append(css[pos:semicolon + 1])
+            pos = semicolon + 1
+            continue
+
+        prelude = css[pos:brace].strip()
+        end = _matching_brace(css, brace)
+        body = css[brace + 1:end]
+        pos = end + 1
+
+        if prelude.startswith(('@media', '@supports')):
+            inner = purge_css(body, used_classes)
+            if inner:
+                out.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            out.append(f'{prelude}{{{body}}}')
+        else:
+            kept = [selector for selector in _split_selectors(prelude) if _selector_classes(selector) <= used_classes]
+            if kept:
+                out.append(f'{",".join(kept)}{{{body}}}')
+    return ''.join(out)
+
+def template_classes(template_source):
+    """Returns the class names used in the class attributes of a template."""
+    classes = set()
+    for attribute in re.findall(r'class="([^"]*)"', template_source):
+        classes.update(attribute.split())
+    return classes
+
+def _create_environment():
+    """Creates the process-wide Jinja environment. Templates are compiled once and
+    recompiled only when the file changes on disk."""
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+    bytecode_cache = None
+    if BYTECODE_CACHE_DIR:
+        os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(BYTECODE_CACHE_DIR)
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), auto_reload=True, bytecode_cache=bytecode_cache)
+    env.filters['currency'] = format_currency
+    env.filters['markdown'] = markdown_to_html
+    return env
+
+_environment = None
+_environment_lock = threading.Lock()
+
+def get_environment():
+    """
+    Returns the process-wide Jinja environment, creating it on first use so that
+    Jinja is not imported before a report is rendered.
+    """
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                _environment = _create_environment()
+    return _environment
+
+# path -> (mtime_ns, transformed content)
+_static_cache = {}
+_static_cache_lock = threading.Lock()
+
+def _load_static(path, transform, mode='r', depends_on=()):
+    """
+    Returns `transform(content)` of a static file, reading and transforming it only
+    when the modification time of the file (or of a file in `depends_on`) changed.
+    Returns None if the file is missing.
+    """
+    try:
+        mtime = tuple(os.stat(dependency).st_mtime_ns for dependency in (path, *depends_on))
+    except FileNotFoundError:
+        return None
+
+    cached = _static_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _static_cache_lock:
+        cached = _static_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, mode) as f:
+            value = transform(f.read())
+        _static_cache[path] = (mtime, value)
+        return value
+
+def _purged_stylesheet(css):
+    """Minifies the stylesheet and keeps only the rules the report template uses."""
+    with open(TEMPLATE_PATH, encoding='utf-8') as f:
+        used_classes = template_classes(f.read())
+    return purge_css(minify_css(css), used_classes)
+
+def get_css():
+    """
+    Returns the minified stylesheet reduced to the rules used by the report template,
+    or None if it is missing.
+    """
+    return _load_static(CSS_PATH, _purged_stylesheet, depends_on=(TEMPLATE_PATH,))
+
+def get_logo_base64():
+    """Returns the Base64-encoded logo, or None if it is missing."""
+    return _load_static(LOGO_PATH, lambda data: base64.b64encode(data).decode('utf-8'), mode='rb')
+
+def get_template():
+    """Returns the compiled report template."""
+    return get_environment().get_template(REPORT_TEMPLATE)
+
+# (template, block name, values of its variables) -> rendered HTML
+_section_cache = OrderedDict()
+_section_cache_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=4)
+def _template_sections(template):
+    """
+    Returns ({block name: names it references}, splice template) for a compiled
+    template. The splice template extends `template` and fills every block with
+    prerendered HTML passed in the `_sections` variable.
+    """
+    from jinja2 import nodes
+
+    environment = get_environment()
+    source, _, _ = environment.loader.get_source(environment, template.name)
+    sections = {}
+    for block in environment.parse(source).find_all(nodes.Block):
+        # Every name, also the ones the block assigns: a name may be read from the
+        # context before a {% set %} or a loop shadows it
+        sections[block.name] = tuple(sorted({name.name for name in block.find_all(nodes.Name)}))
+    splice = environment.from_string(
+        "{% extends _template %}"
+        + "".join(f"{{% block {name} %}}{{{{ _sections[{name!r}] | safe }}}}{{% endblock %}}" for name in sections)
+    )
+    return sections, splice
+
+def _freeze(value):
+    """Turns lists and dicts into tuples so that a value can be used in a cache key."""
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+def build_preview_context(report_model, hero_image):
+    """Returns the template context of the HTML preview for a ReportModel and a HeroImage."""
+    if PREVIEW_CHART == "plotly":
+        waterfall_fig = create_waterfall_chart(list(report_model.waterfall_x), list(report_model.waterfall_y), list(report_model.waterfall_measure))
+        waterfall_html = waterfall_fig.to_html(full_html=False, include_plotlyjs='cdn')
+    else:
+        # Static SVG: no JavaScript bundle to fetch or execute in the preview iframe
+        waterfall_html = create_waterfall_svg(report_model.waterfall_x, report_model.waterfall_y, report_model.waterfall_measure)
+
+    return {
+        'report_title': report_model.primary_market_area,
+        'primary_market_area': '',
+        'date_range': report_model.date_range,
+        'hero_image_base64': hero_image.preview_base64 if hero_image else None,
+        'hero_image_mime': hero_image.preview_mime if hero_image else None,
+        'ertraege': report_model.table('Erträge'),
+        'aufwand': report_model.table('Aufwand'),
+        'aktiva': report_model.table('Aktiva'),
+        'passiva': report_model.table('Passiva'),
+        'current_year': datetime.now().year,
+        'waterfall_chart_html': waterfall_html,
+        'blockquote': report_model.texts['blockquote'],
+        'executivesummary': report_model.texts['summary'],
+        'waterfall_explanation_html': report_model.texts['waterfall_explanation'],
+        'budget_proposal_html': report_model.texts['budget'],
+        'leerstand': report_model.formatted_kpis['leerstand'],
+        'rendite_eigenkapital': report_model.formatted_kpis['rendite_eigenkapital'],
+        'miete_pro_m2': report_model.formatted_kpis['miete_pro_m2'],
+    }
+
+def render_report_html(context):
+    """
+    Renders the report template with the per-report `context`. The stylesheet and the
+    logo are filled in from the static asset cache.
+
+    Each section of the report is a {% block %} of the template and is cached by the
+    values of the variables it references, so editing the summary re-renders only the
+    summary section and reuses the (possibly large) financial tables.
+    """
+    template = get_template()
+    values = {
+        'css_content': get_css() or "",
+        'logo_base64': get_logo_base64(),
+        **context,
+    }
+    variables_by_section, splice = _template_sections(template)
+
+    sections = {}
+    for name, variables in variables_by_section.items():
+        cache_key = (template, name, tuple(_freeze(values.get(variable)) for variable in variables))
+        with _section_cache_lock:
+            html = _section_cache.get(cache_key)
+            if html is not None:
+                _section_cache.move_to_end(cache_key)
+        if html is None:
+            html = template.environment.concat(template.blocks[name](template.new_context(values)))
+            with _section_cache_lock:
+                _section_cache[cache_key] = html
+                while len(_section_cache) > SECTION_CACHE_SIZE:
+                    _section_cache.popitem(last=False)
+        sections[name] = html
+
+    return splice.render(values, _template=template, _sections=sections)
+
+def _truncated_tables(context, rows):
+    """Returns the context with every financial table cut to its first `rows` rows."""
+    context = dict(context)
+    for name in PREVIEW_TABLES:
+        table = context.get(name) or ()
+        context[name] = table[:rows]
+        context[f'{name}_hidden_rows'] = max(0, len(table) - rows)
+    return context
+
+def render_preview_html(context, max_bytes=PREVIEW_MAX_BYTES):
+    """
+    Renders the report for the preview iframe within a size budget of `max_bytes`.
+    When the full report is too large, the optional assets are left out one by one,
+    and then the financial tables are cut to as many rows as fit, each ending with a
+    note on the rows left out. Returns (html, size in bytes, names of the dropped
+    assets, with TRUNCATED_TABLES if the tables were cut); html is None only when the
+    report does not fit even without any table rows.
+    """
+    context = dict(context)
+    dropped = []
+    html = render_report_html(context)
+    size = len(html.encode('utf-8'))
+    for asset in OPTIONAL_PREVIEW_ASSETS:
+        if size <= max_bytes:
+            break
+        context[asset] = None
+        dropped.append(asset)
+        html = render_report_html(context)
+        size = len(html.encode('utf-8'))
+    if size <= max_bytes:
+        return html, size, dropped
+
+    # Search for the largest number of rows per table that still fits
+    fitting = None
+    low, high = 0, max(len(context.get(name) or ()) for name in PREVIEW_TABLES)
+    while low <= high:
+        rows = (low + high) // 2
+        trial_html = render_report_html(_truncated_tables(context, rows))
+        trial_size = len(trial_html.encode('utf-8'))
+        if trial_size <= max_bytes:
+            fitting = (trial_html, trial_size)
+            low = rows + 1
+        else:
+            high = rows - 1
+    if fitting is None:
+        return None, size, dropped
+    html, size = fitting
+    return html, size, dropped + [TRUNCATED_TABLES]
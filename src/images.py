@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from types import MappingProxyType
+from PIL import Image as PILImage, ImageOps, ExifTags
+
+# Size the hero image is drawn at on the PDF title page, in inches
+HERO_PDF_SIZE_IN = (7, 3.75)
+# Bounding box of the hero derivative embedded in the HTML preview, in pixels
+HERO_PREVIEW_SIZE_PX = (1600, 1000)
+HERO_PREVIEW_QUALITY = 75
+
+# PDF output profiles. Images are downsampled to the given DPI for the size they are displayed at in the PDF.
+# "screen" is meant for files sent by email, "print" for high-quality printouts.
+PDF_PROFILES = {
+    "screen": {"image_dpi": 110, "jpeg_quality": 70},
+    "print": {"image_dpi": 300, "jpeg_quality": 90},
+}
+DEFAULT_PDF_PROFILE = "print"
+
+# Number of prepared hero images kept in the process-wide cache
+HERO_CACHE_SIZE = 16
+
+def _encode_jpeg(img, quality):
+    """Encodes an RGB image as a progressive JPEG."""
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+def _to_rgb(img):
+    """Converts an image to RGB, flattening transparency onto white."""
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = PILImage.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def downsample_image(source, width_in, height_in, dpi, image_format="JPEG", quality=85):
+    """
+    Re-encodes an image so that it has no more pixels than needed to display it at
+    width_in x height_in inches and the given DPI. Images are never upscaled.
+    `source` may be raw bytes or a file path. Returns the encoded image as bytes.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    with PILImage.open(source) as img:
+        img.load()
+        max_size = (max(1, round(width_in * dpi)), max(1, round(height_in * dpi)))
+        img.thumbnail(max_size, PILImage.LANCZOS)
+
+        if image_format == "JPEG":
+            # JPEG has no alpha channel; flatten transparent images onto white
+            return _encode_jpeg(_to_rgb(img), quality)
+        out = BytesIO()
+        img.save(out, format=image_format, optimize=True)
+        return out.getvalue()
+
+@dataclass(frozen=True)
+class HeroImage:
+    """
+    The derivatives of an uploaded cover image, prepared once per upload: a small
+    WebP for the HTML preview and one JPEG per PDF profile, each sized for where it
+    is displayed.
+    """
+    digest: str
+    width: int
+    height: int
+    preview: bytes
+    preview_mime: str
+    preview_base64: str
+    # PDF profile name -> JPEG bytes
+    pdf_images: MappingProxyType
+
+    def pdf_image(self, profile):
+        """Returns the JPEG derivative for a PDF profile."""
+        return self.pdf_images[profile]
+
+_hero_cache = OrderedDict()
+_hero_cache_lock = threading.Lock()
+
+def prepare_hero_image(data, pdf_profiles):
+    """
+    Decodes an uploaded cover image once, applies its EXIF orientation and returns a
+    HeroImage with the preview and PDF derivatives. `pdf_profiles` maps profile names
+    to dicts with 'image_dpi' and 'jpeg_quality'. Results are cached by content hash,
+    so re-submitting the same upload is free.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    cache_key = (digest, tuple(sorted((name, settings['image_dpi'], settings['jpeg_quality']) for name, settings in pdf_profiles.items())))
+
+    with _hero_cache_lock:
+        hero = _hero_cache.get(cache_key)
+        if hero is not None:
+            _hero_cache.move_to_end(cache_key)
+            return hero
+
+    largest_pdf_size = max(
+        (round(HERO_PDF_SIZE_IN[0] * settings['image_dpi']), round(HERO_PDF_SIZE_IN[1] * settings['image_dpi']))
+        for settings in pdf_profiles.values()
+    ) if pdf_profiles else (0, 0)
+    decode_size = (max(HERO_PREVIEW_SIZE_PX[0], largest_pdf_size[0]), max(HERO_PREVIEW_SIZE_PX[1], largest_pdf_size[1]))
+
+    with PILImage.open(BytesIO(data)) as img:
+        # decode_size is in display orientation; orientations 5-8 are stored rotated
+        # by 90 degrees, so the decoder has to keep the swapped size
+        if img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            decode_size = decode_size[::-1]
+        # Let the JPEG decoder skip detail that none of the derivatives need
+        img.draft("RGB", decode_size)
+        img = _to_rgb(ImageOps.exif_transpose(img))
+    width, height = img.size
+
+    preview_img = img.copy()
+    preview_img.thumbnail(HERO_PREVIEW_SIZE_PX, PILImage.LANCZOS)
+    preview_out = BytesIO()
+    preview_img.save(preview_out, format="WEBP", quality=HERO_PREVIEW_QUALITY, method=4)
+    preview = preview_out.getvalue()
+
+    pdf_images = {}
+    for name, settings in pdf_profiles.items():
+        pdf_img = img.copy()
+        pdf_img.thumbnail((round(HERO_PDF_SIZE_IN[0] * settings['image_dpi']), round(HERO_PDF_SIZE_IN[1] * settings['image_dpi'])), PILImage.LANCZOS)
+        pdf_images[name] = _encode_jpeg(pdf_img, settings['jpeg_quality'])
+
+    hero = HeroImage(
+        digest=digest,
+        width=width,
+        height=height,
+        preview=preview,
+        preview_mime="image/webp",
+        preview_base64=base64.b64encode(preview).decode('ascii'),
+        pdf_images=MappingProxyType(pdf_images),
+    )
+
+    with _hero_cache_lock:
+        _hero_cache[cache_key] = hero
+        while len(_hero_cache) > HERO_CACHE_SIZE:
+            _hero_cache.popitem(last=False)
+    return hero
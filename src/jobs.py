@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import current_trace, trace
+
+# Number of jobs that run at the same time, across all sessions
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# Number of jobs that may wait for a worker before new ones are refused
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 64))
+# Number of finished jobs kept so that sessions can pick up their results
+JOB_HISTORY_SIZE = 256
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class JobCancelled(Exception):
+    """Raised inside a job function when the job was cancelled."""
+
+class JobQueueFull(Exception):
+    """Raised by JobQueue.submit when JOB_QUEUE_LIMIT jobs are already waiting."""
+
+class Job:
+    """
+    A unit of work run by the JobQueue. The job function receives the Job as its first
+    argument and reports progress through `update`, which is also where a cancelled
+    job stops.
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._future = None
+        # The job is traced as a child of the rerun that submitted it
+        self._parent_trace = current_trace()
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def update(self, progress, message=None):
+        """Reports progress (0.0 to 1.0). Raises JobCancelled if the job was cancelled."""
+        self.progress = progress
+        if message is not None:
+            self.message = message
+        if self.cancelled:
+            raise JobCancelled()
+
+    def cancel(self):
+        """
+        Cancels the job. A queued job never starts; a running job stops at its next
+        `update`.
+        """
+        self._cancel_event.set()
+        if self._future is not None and self._future.cancel():
+            self.status = CANCELLED
+            self.finished_at = time.time()
+
+class JobQueue:
+    """Runs jobs on a bounded pool of worker threads and keeps track of their state."""
+
+    def __init__(self, max_workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Queues `fn(job, *args, **kwargs)` and returns its Job. Raises JobQueueFull when
+        too many jobs are waiting.
+        """
+        job = Job(name)
+        with self._lock:
+            if sum(1 for other in self._jobs.values() if other.status == QUEUED) >= self.queue_limit:
+                raise JobQueueFull(f"{self.queue_limit} jobs are already waiting")
+            self._jobs[job.id] = job
+            self._prune()
+        job._future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            with trace(f"job:{job.name}", parent=job._parent_trace):
+                job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = e
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """Forgets the oldest finished jobs beyond JOB_HISTORY_SIZE."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY_SIZE)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Returns the job with the given id, or None if it is unknown."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancels the job with the given id, if it is still known."""
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def stats(self):
+        """Returns the queue depth, the number of busy workers and the worker utilization."""
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+        return {
+            'queued': queued,
+            'running': running,
+            'workers': self.max_workers,
+            'utilization': running / self.max_workers,
+        }
+
+# Process-wide queue shared by all sessions
+job_queue = JobQueue()
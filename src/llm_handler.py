@@ -1,31 +1,78 @@
 import streamlit as st
-import google.genai as genai
-import google.genai.types as types
+import logging
 import re
 import os
+import threading
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from tracing import span
 
 # --- Centralized API Configuration ---
 
 # Define the model name as a constant to ensure consistency and ease of updates.
 MODEL_NAME = 'gemini-2.5-flash'
 
-def get_gemini_client():
+def _genai():
+    """
+    Imports the Gemini SDK on first use. It takes about half a second to load and is
+    not needed until the first text is generated.
+    """
+    import google.genai as genai
+    import google.genai.types as types
+    return genai, types
+
+logger = logging.getLogger(__name__)
+
+def report_error(message):
+    """
+    Shows an error on the Streamlit page when called from a script run. Background
+    jobs and the command-line tools have no page to show it on, so it is logged.
+    """
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.error(message)
+    else:
+        logger.error(message)
+
+def _get_api_key():
+    """Returns the Gemini API key from the environment or the Streamlit secrets, or None."""
+    api_key = os.environ.get("GEM_API")
+    if api_key:
+        return api_key
+    try:
+        return st.secrets.get("GEM_API")
+    except Exception:
+        # No secrets file, e.g. when running headless
+        return None
+
+# The client is created once per process and shared by all sessions
+_client = None
+_client_api_key = None
+_client_lock = threading.Lock()
+
+def get_gemini_client(on_error=report_error):
     """Initializes and returns the Gemini client, handling errors."""
-    api_key = os.environ.get("GEM_API") or st.secrets.get("GEM_API")
+    global _client, _client_api_key
+    api_key = _get_api_key()
     if not api_key:
-        st.error("GEMINI_API_KEY not found. Please set it in your environment or secrets.")
-        return None
-    try:
-        client = genai.Client(api_key=api_key)
-        return client
-    except Exception as e:
-        st.error(f"Failed to configure Gemini API: {e}")
+        on_error("GEMINI_API_KEY not found. Please set it in your environment or secrets.")
         return None
+    with _client_lock:
+        if _client is not None and _client_api_key == api_key:
+            return _client
+        try:
+            genai, _ = _genai()
+            _client = genai.Client(api_key=api_key)
+            _client_api_key = api_key
+            return _client
+        except Exception as e:
+            on_error(f"Failed to configure Gemini API: {e}")
+            return None
 
 
-def generate_summary_with_gemini(user_notes, financial_data):
+def generate_summary_with_gemini(user_notes, financial_data, on_error=report_error):
     """Generates an executive summary and a blockquote using the Gemini API."""
-    client = get_gemini_client()
+    client = get_gemini_client(on_error)
     if not client:
         return "Fehler: API-Client konnte nicht initialisiert werden.", "Zusammenfassung konnte nicht generiert werden."
 
@@ -61,17 +108,19 @@ def generate_summary_with_gemini(user_notes, financial_data):
     [END_EXECUTIVE_SUMMARY]
     """
 
+    _, types = _genai()
     try:
         # Generate the content
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=types.Part.from_text(text=prompt),
-            config=types.GenerateContentConfig(
-                temperature=0.1,
-                top_p=0.95,
-                top_k=20,
-            ),
-        )
+        with span("gemini_summary", model=MODEL_NAME):
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=types.Part.from_text(text=prompt),
+                config=types.GenerateContentConfig(
+                    temperature=0.1,
+                    top_p=0.95,
+                    top_k=20,
+                ),
+            )
 
         # Parse the response
         blockquote_match = re.search(r'\[BLOCKQUOTE\](.*?)\[END_BLOCKQUOTE\]', response.text, re.DOTALL)
@@ -83,14 +132,14 @@ def generate_summary_with_gemini(user_notes, financial_data):
         return blockquote, summary
 
     except Exception as e:
-        st.error(f"An error occurred while calling the Gemini API: {e}")
+        on_error(f"An error occurred while calling the Gemini API: {e}")
         return "Fehler bei der Generierung.", str(e)
 
-def generate_waterfall_explanation(aufwand_data):
+def generate_waterfall_explanation(aufwand_data, on_error=report_error):
     """
     Generates an explanation for the waterfall chart based on the Aufwand data.
     """
-    client = get_gemini_client()
+    client = get_gemini_client(on_error)
     if not client:
         return "Fehler bei der Generierung der Wasserfall-Erklärung."
 
@@ -108,17 +157,19 @@ def generate_waterfall_explanation(aufwand_data):
     Please provide a concise, short, one-paragraph explanation and wrap your response in [EXPLANATION] and [END_EXPLANATION] tags.
     """
 
+    _, types = _genai()
     try:
         # Generate the content
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=types.Part.from_text(text=prompt),
-            config=types.GenerateContentConfig(
-                temperature=0.1,
-                top_p=0.95,
-                top_k=20,
-            ),
-        )
+        with span("gemini_waterfall_explanation", model=MODEL_NAME):
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=types.Part.from_text(text=prompt),
+                config=types.GenerateContentConfig(
+                    temperature=0.1,
+                    top_p=0.95,
+                    top_k=20,
+                ),
+            )
         
         explanation_match = re.search(r'\[EXPLANATION\](.*?)\[END_EXPLANATION\]', response.text, re.DOTALL)
         explanation = explanation_match.group(1).strip() if explanation_match else "Konnte Erklärung nicht analysieren."
@@ -126,14 +177,14 @@ def generate_waterfall_explanation(aufwand_data):
         return explanation
         
     except Exception as e:
-        st.error(f"An error occurred while calling the Gemini API for the waterfall explanation: {e}")
+        on_error(f"An error occurred while calling the Gemini API for the waterfall explanation: {e}")
         return "Fehler bei der Generierung der Wasserfall-Erklärung."
 
-def generate_budget_proposal(budget_notes, financial_data):
+def generate_budget_proposal(budget_notes, financial_data, on_error=report_error):
     """
     Generates a budget proposal for the upcoming year.
     """
-    client = get_gemini_client()
+    client = get_gemini_client(on_error)
     if not client:
         return "Fehler bei der Generierung des Budgetvorschlags."
 
@@ -157,22 +208,49 @@ def generate_budget_proposal(budget_notes, financial_data):
     Please provide a concise and short answer, and wrap your entire response in [BUDGET] and [END_BUDGET] tags.
     """
 
+    _, types = _genai()
     try:
         # Generate the content
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=types.Part.from_text(text=prompt),
-            config=types.GenerateContentConfig(
-                temperature=0.1,
-                top_p=0.95,
-                top_k=20,
-            ),
-        )
+        with span("gemini_budget", model=MODEL_NAME):
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=types.Part.from_text(text=prompt),
+                config=types.GenerateContentConfig(
+                    temperature=0.1,
+                    top_p=0.95,
+                    top_k=20,
+                ),
+            )
         
         budget_match = re.search(r'\[BUDGET\](.*?)\[END_BUDGET\]', response.text, re.DOTALL)
         budget = budget_match.group(1).strip() if budget_match else "Konnte Budgetvorschlag nicht analysieren."
         
         return budget
     except Exception as e:
-        st.error(f"Fehler bei der Generierung des Budgetvorschlags: {e}")
+        on_error(f"Fehler bei der Generierung des Budgetvorschlags: {e}")
         return "Fehler bei der Generierung des Budgetvorschlags."
+
+def generate_report_texts(job, user_notes, budget_notes, financial_data):
+    """
+    Generates all texts of a report. Runs as a background job (see jobs.py), reporting
+    its progress between the calls to the Gemini API. Errors of the individual calls
+    do not fail the job; their messages are returned under 'generation_errors'.
+    """
+    errors = []
+
+    job.update(0.0, "Zusammenfassung wird generiert...")
+    blockquote, summary = generate_summary_with_gemini(user_notes, financial_data, on_error=errors.append)
+
+    job.update(1 / 3, "Erläuterung zum Wasserfalldiagramm wird generiert...")
+    waterfall_explanation = generate_waterfall_explanation(financial_data.get('Aufwand', {}), on_error=errors.append)
+
+    job.update(2 / 3, "Budgetvorschlag wird generiert...")
+    budget = generate_budget_proposal(budget_notes, financial_data, on_error=errors.append)
+
+    return {
+        'generated_blockquote': blockquote,
+        'generated_summary': summary,
+        'waterfall_explanation': waterfall_explanation,
+        'generated_budget': budget,
+        'generation_errors': errors,
+    }
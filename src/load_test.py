@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from types import SimpleNamespace
+
+from synthetic_workbook import generate_workbook
+
+# Steps of one simulated session, in the order a user goes through them in the app
+STEPS = ("upload_workbook", "upload_image", "generate_texts", "edit_kpis", "pdf")
+# Seconds a user waits before trying again when the job queue refuses a job
+RETRY_AFTER_SECONDS = 1.0
+
+# Answer of the stubbed Gemini client; it carries the tags of all three prompts
+STUB_RESPONSE = """
+[BLOCKQUOTE]Stabile Erträge bei leicht steigenden Unterhaltskosten.[END_BLOCKQUOTE]
+[EXECUTIVE_SUMMARY]""" + "Die Liegenschaft erzielte im Berichtsjahr solide Mieterträge. " * 8 + """[END_EXECUTIVE_SUMMARY]
+[EXPLANATION]""" + "Der Unterhalt ist der grösste Aufwandposten. " * 4 + """[END_EXPLANATION]
+[BUDGET]**Budget**
+
+- Unterhalt: CHF 120'000
+- Verwaltung: CHF 40'000
+- Energie: CHF 25'000[END_BUDGET]
+"""
+
+class _StubModels:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=STUB_RESPONSE)
+
+@contextmanager
+def stubbed_gemini(latency):
+    """
+    Replaces the Gemini client with one that answers every prompt with STUB_RESPONSE
+    after `latency` seconds, so that the prompts are still built and the answers
+    parsed by llm_handler, without network access or an API key.
+    """
+    import llm_handler
+    client = SimpleNamespace(models=_StubModels(latency))
+    original = llm_handler.get_gemini_client
+    llm_handler.get_gemini_client = lambda on_error=None: client
+    try:
+        yield
+    finally:
+        llm_handler.get_gemini_client = original
+
+def _rss_bytes():
+    """Current resident set size of this process; the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+class ResourceSampler(threading.Thread):
+    """Samples the CPU usage and the RSS of the process and the job queue load over time."""
+
+    def __init__(self, interval):
+        super().__init__(name="load-test-sampler", daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from jobs import job_queue
+        start = last_wall = time.perf_counter()
+        last_cpu = time.process_time()
+        while not self._stop_event.wait(self.interval):
+            wall, cpu = time.perf_counter(), time.process_time()
+            stats = job_queue.stats()
+            self.samples.append({
+                't_s': round(wall - start, 3),
+                # 100% is one fully used core
+                'cpu_percent': round((cpu - last_cpu) / (wall - last_wall) * 100, 1),
+                'rss_bytes': _rss_bytes(),
+                'threads': threading.active_count(),
+                'jobs_queued': stats['queued'],
+                'jobs_running': stats['running'],
+            })
+            last_wall, last_cpu = wall, cpu
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _cover_image(seed):
+    from PIL import Image as PILImage
+    image = BytesIO()
+    PILImage.new("RGB", (1600, 900), (seed * 37 % 256, 120, 150)).save(image, format="JPEG")
+    return image.getvalue()
+
+def _session_texts(generated):
+    """The texts the report is built from, as ui._session_texts_and_kpis collects them."""
+    return {
+        'blockquote': generated['generated_blockquote'],
+        'summary': generated['generated_summary'],
+        'waterfall_explanation': generated['waterfall_explanation'],
+        'budget': generated['generated_budget'],
+    }
+
+def _edited_kpis(user, iteration, edit):
+    """KPIs entered in the editor; every edit changes them, so no edit is a cache hit."""
+    step = user * 1000 + iteration * 100 + edit
+    return {
+        'leerstand': round(1 + step % 97 / 10, 2),
+        'rendite_eigenkapital': round(3 + step % 53 / 10, 2),
+        'miete_pro_m2': round(250 + step % 311, 2),
+    }
+
+def _reference(data):
+    """
+    What a user's report has to contain, derived on the main thread before the load
+    starts: the header and the formatted financial tables.
+    """
+    from data_loader import load_financial_data
+    from report_model import build_report_model
+    financial_data = load_financial_data(BytesIO(data))
+    model = build_report_model(financial_data, {}, {})
+    return model.date_range, model.primary_market_area, _formatted_tables(model)
+
+def _formatted_tables(report_model):
+    return {name: tuple((label, text) for label, _, text in rows) for name, rows in report_model.financial_tables.items()}
+
+class SimulatedUser(threading.Thread):
+    """
+    One session going through the app: it uploads a workbook and a cover image, has
+    the texts generated, edits the KPIs a few times and downloads the PDF. The work
+    runs on the app's job queue and through the functions main.py and ui.py call.
+    """
+
+    def __init__(self, index, data, image, reference, args, results):
+        super().__init__(name=f"load-test-user-{index}", daemon=True)
+        self.index = index
+        self.data = data
+        self.image = image
+        self.reference = reference
+        self.args = args
+        self.results = results
+
+    def _record(self, step, seconds, error=None):
+        with self.results['lock']:
+            self.results['steps'][step].append(seconds)
+        if error is not None:
+            self._error(step, error)
+
+    def _error(self, step, error):
+        with self.results['lock']:
+            self.results['errors'].append({'user': self.index, 'step': step, 'error': error})
+
+    def _run_job(self, name, fn, *args):
+        """Submits a job like the app does, retrying while the queue is full, and waits for it."""
+        from jobs import job_queue, JobQueueFull, DONE
+        from profiling import job_function
+        while True:
+            try:
+                job = job_queue.submit(name, job_function({}, fn, name), *args)
+                break
+            except JobQueueFull:
+                with self.results['lock']:
+                    self.results['rejected'] += 1
+                time.sleep(RETRY_AFTER_SECONDS)
+        while not job.done:
+            time.sleep(self.args.poll_interval)
+        if job.status != DONE:
+            raise RuntimeError(f"{name}: {job.status}: {job.error}")
+        return job.result
+
+    def _step(self, step, fn):
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self._record(step, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+            return None
+        self._record(step, time.perf_counter() - start)
+        time.sleep(self.args.think_time)
+        return result
+
+    def _edit_kpis(self, financial_data, hero_image, texts, kpis):
+        """Re-renders the preview the way ui.display_html_report does after an edit."""
+        from html_renderer import build_preview_context, render_preview_html
+        from report_model import build_report_model
+        report_model = build_report_model(financial_data, texts, kpis)
+        html, _, _ = render_preview_html(build_preview_context(report_model, hero_image))
+        self._check(report_model, html, kpis)
+        return report_model
+
+    def _check(self, report_model, html, kpis):
+        """Raises if the report differs from the one derived without concurrency."""
+        date_range, market_area, tables = self.reference
+        if (report_model.date_range, report_model.primary_market_area) != (date_range, market_area):
+            raise AssertionError(f"header {report_model.primary_market_area!r} instead of {market_area!r}")
+        if _formatted_tables(report_model) != tables:
+            raise AssertionError("financial tables differ from the reference")
+        expected = {name: f"{value:.2f}" for name, value in kpis.items()}
+        if dict(report_model.formatted_kpis) != expected:
+            raise AssertionError(f"KPIs {dict(report_model.formatted_kpis)} instead of {expected}")
+        if html is not None and market_area not in html:
+            raise AssertionError("preview does not show the market area")
+
+    def _pdf(self, hero_image, report_model):
+        from images import DEFAULT_PDF_PROFILE
+        from ui import _build_pdf
+        pdf = self._run_job("PDF", _build_pdf, hero_image, report_model, DEFAULT_PDF_PROFILE)
+        if not pdf.startswith(b"%PDF"):
+            raise AssertionError("PDF job returned no PDF")
+
+    def run(self):
+        from llm_handler import generate_report_texts
+        from upload_jobs import parse_workbook, prepare_uploaded_image
+        for iteration in range(self.args.iterations):
+            financial_data = self._step("upload_workbook", lambda: self._run_job("Excel einlesen", parse_workbook, self.data))
+            hero_image = self._step("upload_image", lambda: self._run_job("Bild vorbereiten", prepare_uploaded_image, self.image))
+            if financial_data is None or hero_image is None:
+                continue
+            generated = self._step("generate_texts", lambda: self._run_job(
+                "Texte generieren", generate_report_texts, self.args.notes, self.args.notes, financial_data))
+            if generated is None:
+                continue
+            if generated['generation_errors']:
+                self._error("generate_texts", "; ".join(generated['generation_errors']))
+
+            texts = _session_texts(generated)
+            report_model = None
+            for edit in range(self.args.edits):
+                kpis = _edited_kpis(self.index, iteration, edit)
+                report_model = self._step("edit_kpis", lambda: self._edit_kpis(financial_data, hero_image, texts, kpis)) or report_model
+            if report_model is not None and not self.args.no_pdf:
+                self._step("pdf", lambda: self._pdf(hero_image, report_model))
+            with self.results['lock']:
+                self.results['sessions'] += 1
+
+def _percentile(sorted_values, share):
+    index = min(len(sorted_values) - 1, max(0, round(share * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def summarize_steps(steps):
+    """Returns the count and the p50/p95/p99/max latency (seconds) of every step."""
+    summary = {}
+    for step in STEPS:
+        values = sorted(steps[step])
+        if not values:
+            continue
+        summary[step] = {
+            'count': len(values),
+            'p50_s': statistics.median(values),
+            'p95_s': _percentile(values, 0.95),
+            'p99_s': _percentile(values, 0.99),
+            'max_s': values[-1],
+        }
+    return summary
+
+def run_load_test(args):
+    """
+    Runs `args.users` simulated sessions at the same time, started `args.ramp_up`
+    seconds apart, and returns throughput, latencies, errors and resource samples.
+    Every user has its own workbook, so the sessions do not share cached results.
+    """
+    from report_model import build_report_model  # noqa: F401 (loads pandas before the clock starts)
+    from benchmark import _clear_render_caches
+
+    print(f"Preparing {args.users} workbooks with {args.rows} rows...", flush=True)
+    inputs = []
+    for user in range(args.users):
+        data = generate_workbook(args.rows, seed=user, market_area=f"Lasttest {user + 1}")
+        inputs.append((data, _cover_image(user), _reference(data)))
+    _clear_render_caches()
+
+    results = {'lock': threading.Lock(), 'steps': {step: [] for step in STEPS}, 'errors': [], 'rejected': 0, 'sessions': 0}
+    sampler = ResourceSampler(args.sample_interval)
+    users = [SimulatedUser(index, *inputs[index], args, results) for index in range(args.users)]
+
+    with stubbed_gemini(args.llm_latency):
+        sampler.start()
+        start = time.perf_counter()
+        for user in users:
+            user.start()
+            time.sleep(args.ramp_up)
+        for user in users:
+            user.join()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+
+    from jobs import JOB_WORKERS, JOB_QUEUE_LIMIT
+    return {
+        'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'job_workers': JOB_WORKERS,
+        'job_queue_limit': JOB_QUEUE_LIMIT,
+        'users': args.users,
+        'iterations': args.iterations,
+        'llm_latency_s': args.llm_latency,
+        'elapsed_s': elapsed,
+        'sessions': results['sessions'],
+        'sessions_per_minute': results['sessions'] / elapsed * 60,
+        'rejected_jobs': results['rejected'],
+        'steps': summarize_steps(results['steps']),
+        'errors': results['errors'],
+        'samples': sampler.samples,
+    }
+
+def _print_report(report):
+    print(f"\n{report['users']} users x {report['iterations']} sessions, {report['job_workers']} job workers, "
+          f"LLM {report['llm_latency_s']:.1f} s")
+    print(f"{report['sessions']} sessions in {report['elapsed_s']:.1f} s = {report['sessions_per_minute']:.1f} sessions/min, "
+          f"{report['rejected_jobs']} jobs refused by the full queue")
+    print(f"\n{'step':<16} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for step, values in report['steps'].items():
+        print(f"{step:<16} {values['count']:>6}" + "".join(
+            f" {values[key] * 1000:>7.0f}ms" for key in ('p50_s', 'p95_s', 'p99_s', 'max_s')))
+    if report['samples']:
+        print(f"\n{'t':>6} {'cpu':>6} {'rss':>8} {'threads':>8} {'queued':>7} {'running':>8}")
+        for sample in report['samples']:
+            print(f"{sample['t_s']:>5.0f}s {sample['cpu_percent']:>5.0f}% {sample['rss_bytes'] / 1024 / 1024:>6.0f}MB "
+                  f"{sample['threads']:>8} {sample['jobs_queued']:>7} {sample['jobs_running']:>8}")
+    if report['errors']:
+        print(f"\n{len(report['errors'])} errors:")
+        for error in report['errors'][:20]:
+            print(f"  user {error['user']}, {error['step']}: {error['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulates concurrent sessions going through upload, text generation, KPI edits and PDF "
+                    "download, with a stubbed LLM. Set JOB_WORKERS and JOB_QUEUE_LIMIT as in production.")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=1, help="Reports each session creates")
+    parser.add_argument("--ramp-up", type=float, default=0.5, help="Seconds between the starts of two sessions")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="Seconds the stubbed Gemini takes per call")
+    parser.add_argument("--edits", type=int, default=3, help="KPI edits (preview renders) per report")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Seconds a user pauses after each step")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="Seconds between two checks of a running job")
+    parser.add_argument("--rows", type=int, default=40, help="Account rows per sheet of the workbooks")
+    parser.add_argument("--notes", default="Mieterträge stabil, Heizung ersetzt.")
+    parser.add_argument("--no-pdf", action="store_true", help="Skip the PDF step (it needs Chromium for Kaleido)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between two CPU/RSS samples")
+    parser.add_argument("--output", metavar="PATH", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    _print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out_file:
+            json.dump(report, out_file, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+    raise SystemExit(1 if report['errors'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,33 @@
 import os
 import streamlit as st
 import json
+from contextlib import nullcontext
 
-from data_loader import load_financial_data
-from ui import display_html_report
-from llm_handler import generate_summary_with_gemini, generate_waterfall_explanation, generate_budget_proposal
+from upload_jobs import parse_workbook, prepare_uploaded_image
+from jobs import job_queue, JobQueueFull, DONE, FAILED
+from llm_handler import generate_report_texts
+from warmup import WARMUP_ENABLED, start_warmup
+from tracing import TRACING_ENABLED, trace, streamlit_session_id
+from profiling import RERUN, capture_profile, take_armed, job_function
+from report_archive import ARCHIVE_ENABLED
 
 # --- Session State Initialization ---
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
+if 'is_admin' not in st.session_state:
+    st.session_state.is_admin = False
 if 'report_generated' not in st.session_state:
     st.session_state.report_generated = False
 if 'full_financial_data' not in st.session_state:
     st.session_state.full_financial_data = None
+if 'report_parse_job_id' not in st.session_state:
+    st.session_state.report_parse_job_id = None
 if 'uploaded_image' not in st.session_state:
     st.session_state.uploaded_image = None
+if 'image_job_id' not in st.session_state:
+    st.session_state.image_job_id = None
+if 'generation_job_id' not in st.session_state:
+    st.session_state.generation_job_id = None
 if 'generated_blockquote' not in st.session_state:
     st.session_state.generated_blockquote = "Der Markt erlebte im letzten Quartal eine beispiellose Liquidität..."
 if 'generated_summary' not in st.session_state:
@@ -40,12 +53,15 @@ def get_credentials():
     return []
 
 def authenticate_user(username, password):
-    """Checks if the provided username and password match any in the secrets."""
+    """
+    Checks if the provided username and password match any in the secrets. Returns
+    the matching credentials entry, or None.
+    """
     credentials = get_credentials()
     for user_creds in credentials:
         if user_creds["username"] == username and user_creds["password"] == password:
-            return True
-    return False
+            return user_creds
+    return None
 
 def login_page():
     """Displays the login form."""
@@ -53,17 +69,66 @@ def login_page():
     username = st.text_input("Username", key="login_username")
     password = st.text_input("Password", type="password", key="login_password")
     if st.button("Login"):
-        if authenticate_user(username, password):
+        user_creds = authenticate_user(username, password)
+        if user_creds is not None:
             st.session_state.authenticated = True
+            # Admins ("admin": true in their credentials) get the profiling tools
+            st.session_state.is_admin = bool(user_creds.get("admin", False))
             st.rerun()
         else:
             st.error("Ungültiger Benutzername oder Passwort")
 
 def logout():
     st.session_state.authenticated = False
+    st.session_state.is_admin = False
     st.session_state.report_generated = False # Reset report view on logout
     st.rerun()
 
+def _ui():
+    """
+    Imports the report UI on first use. It pulls in pandas and NumPy, which the login
+    page does not need.
+    """
+    import ui
+    return ui
+
+def _start_upload_job(job_id_key, name, fn, uploaded_file):
+    """
+    Starts processing an upload in the background as soon as it arrives. A job still
+    working on a replaced upload is cancelled.
+    """
+    job_queue.cancel(st.session_state[job_id_key])
+    st.session_state[job_id_key] = None
+    if uploaded_file is not None:
+        try:
+            st.session_state[job_id_key] = job_queue.submit(name, job_function(st.session_state, fn, name), uploaded_file.getvalue()).id
+        except JobQueueFull:
+            st.warning("Der Server ist ausgelastet. Bitte laden Sie die Datei erneut hoch.")
+
+def start_report_parse():
+    _start_upload_job('report_parse_job_id', "Excel einlesen", parse_workbook, st.session_state.report_uploader)
+
+def start_image_preparation():
+    _start_upload_job('image_job_id', "Bild vorbereiten", prepare_uploaded_image, st.session_state.image_uploader)
+
+def collect_upload_job(job_id_key, result_key, error_message):
+    """
+    Moves the result of a finished upload job into the session state, or shows the
+    progress of a job that is still running. Returns True while the job is running.
+    """
+    job = job_queue.get(st.session_state[job_id_key])
+    if job is None:
+        return False
+    if not job.done:
+        _ui().poll_job(job.id)
+        return True
+    st.session_state[job_id_key] = None
+    if job.status == DONE:
+        st.session_state[result_key] = job.result
+    elif job.status == FAILED:
+        st.error(f"{error_message}: {job.error}")
+    return False
+
 def update_summary():
     st.session_state.generated_summary = st.session_state.summary_input
 
@@ -79,9 +144,84 @@ def update_rendite_eigenkapital():
 def update_miete_pro_m2():
     st.session_state.miete_pro_m2 = st.session_state.miete_pro_m2_input
 
+@st.fragment
+def report_workspace():
+    """
+    Editor and live preview. Runs as a fragment: editing a text or a KPI reruns only
+    this function, not the uploads and the text generation in the sidebar.
+    """
+    with trace("fragment:report_workspace", session=streamlit_session_id()):
+        _report_workspace()
+
+def _report_workspace():
+    """Body of report_workspace, traced as one span."""
+    editor_col, preview_col = st.columns([1, 2])
+
+    with editor_col:
+        st.header("Texte bearbeiten")
+        
+        st.subheader("Zusammenfassung")
+        st.text_area(
+            "Zusammenfassung bearbeiten", 
+            value=st.session_state.generated_summary, 
+            height=300,
+            key="summary_input",
+            on_change=update_summary
+        )
+
+        st.subheader("Budgetvorschlag für das kommende Jahr")
+        st.text_area(
+            "Budget bearbeiten", 
+            value=st.session_state.generated_budget, 
+            height=300,
+            key="budget_input",
+            on_change=update_budget
+        )
+
+        st.subheader("Wichtige Kennzahlen (KPIs)")
+        st.number_input(
+            "Leerstand (%)",
+            min_value=0.0,
+            max_value=100.0,
+            value=st.session_state.leerstand,
+            format="%.2f",
+            key="leerstand_input",
+            on_change=update_leerstand
+        )
+        st.number_input(
+            "Rendite auf Eigenkapital (%)",
+            min_value=-100.0,
+            max_value=100.0,
+            value=st.session_state.rendite_eigenkapital,
+            format="%.2f",
+            key="rendite_eigenkapital_input",
+            on_change=update_rendite_eigenkapital
+        )
+        st.number_input(
+            "Durschnittliche Miete pro m2 (CHF)",
+            min_value=0.0,
+            value=st.session_state.miete_pro_m2,
+            format="%.2f",
+            key="miete_pro_m2_input",
+            on_change=update_miete_pro_m2
+        )
+
+
+    with preview_col:
+        st.header("Live-Vorschau")
+        _ui().display_html_report(
+            "Live Report", # report_title is no longer used in the same way
+            st.session_state.uploaded_image, 
+            st.session_state.full_financial_data
+        )
+
 def main():
     st.set_page_config(layout="wide")
 
+    # Streamlit has no process start hook; the first page served starts the warmup
+    if WARMUP_ENABLED:
+        start_warmup()
+
     if not st.session_state.authenticated:
         login_page()
         return
@@ -114,102 +254,76 @@ def main():
             st.button("Logout", icon=":material/logout:", on_click=logout) # Added icon
 
         st.header("1. Dateien hochladen")
-        uploaded_report = st.file_uploader("Excel-Report", type="xlsx", key="report_uploader")
-        uploaded_image = st.file_uploader("Deckblatt-Bild", type=["png", "jpg", "jpeg"], key="image_uploader")
+        # Uploads are processed in the background while the notes are being entered
+        st.file_uploader("Excel-Report", type="xlsx", key="report_uploader", on_change=start_report_parse)
+        report_pending = collect_upload_job('report_parse_job_id', 'full_financial_data', "Fehler beim Einlesen der Excel-Datei")
+        st.file_uploader("Deckblatt-Bild", type=["png", "jpg", "jpeg"], key="image_uploader", on_change=start_image_preparation)
+        image_pending = collect_upload_job('image_job_id', 'uploaded_image', "Fehler beim Verarbeiten des Bildes")
 
-        if uploaded_report:
-            st.session_state.full_financial_data = load_financial_data(uploaded_report)
-        
-        if uploaded_image:
-            st.session_state.uploaded_image = uploaded_image
+        if st.toggle("Speicherbericht anzeigen", key="show_memory_report"):
+            _ui().display_memory_report()
+
+        if st.session_state.is_admin:
+            _ui().display_profiling_panel()
+
+        if ARCHIVE_ENABLED:
+            st.toggle("Berichtsarchiv anzeigen", key="show_archive", help="Frühere Berichte öffnen, ohne sie neu zu erstellen")
 
         st.header("2. Notizen für LLM")
         user_notes = st.text_area("Anmerkungen für die Zusammenfassung:", height=150, key="summary_notes")
         budget_notes = st.text_area("Anmerkungen für das Budget:", height=150, key="budget_notes")
 
-        if st.button("Bericht generieren", icon=":material/build:"): # Changed text and added icon
+        if st.button("Bericht generieren", icon=":material/build:", disabled=st.session_state.generation_job_id is not None or report_pending or image_pending): # Changed text and added icon
             if st.session_state.full_financial_data and st.session_state.uploaded_image:
-                with st.spinner("Generiere Texte mit Gemini..."):
-                    financial_data = st.session_state.get('full_financial_data', {})
-                    blockquote, summary = generate_summary_with_gemini(user_notes, financial_data)
-                    st.session_state.generated_blockquote = blockquote
-                    st.session_state.generated_summary = summary
-                    
-                    aufwand_data = financial_data.get('Aufwand', {})
-                    st.session_state.waterfall_explanation = generate_waterfall_explanation(aufwand_data)
-
-                    st.session_state.generated_budget = generate_budget_proposal(budget_notes, financial_data)
-                
-                st.session_state.report_generated = True
-                st.success("Texte wurden generiert!")
+                try:
+                    # The texts are generated by a background job; the UI polls for the result
+                    job = job_queue.submit(
+                        "Texte generieren",
+                        job_function(st.session_state, generate_report_texts, "Texte generieren"),
+                        user_notes,
+                        budget_notes,
+                        st.session_state.get('full_financial_data', {}),
+                    )
+                    st.session_state.generation_job_id = job.id
+                except JobQueueFull:
+                    st.warning("Der Server ist ausgelastet. Bitte versuchen Sie es in einem Moment erneut.")
             else:
                 st.warning("Bitte laden Sie sowohl einen Excel-Report als auch ein Bild hoch.")
 
+        generation_job = job_queue.get(st.session_state.generation_job_id)
+        if generation_job is not None and generation_job.done:
+            st.session_state.generation_job_id = None
+            if generation_job.status == DONE:
+                texts = dict(generation_job.result)
+                errors = texts.pop('generation_errors', [])
+                st.session_state.update(texts)
+                st.session_state.report_generated = True
+                for error in errors:
+                    st.error(error)
+                if not errors:
+                    st.success("Texte wurden generiert!")
+            elif generation_job.status == FAILED:
+                st.error(f"Fehler bei der Generierung der Texte: {generation_job.error}")
+        elif generation_job is not None:
+            st.caption("Texte werden mit Gemini generiert...")
+            _ui().poll_job(generation_job.id)
+        else:
+            st.session_state.generation_job_id = None
+
 
     # --- Main Content Layout (Editor & Preview) ---
-    if st.session_state.report_generated:
-        editor_col, preview_col = st.columns([1, 2])
-
-        with editor_col:
-            st.header("Texte bearbeiten")
-            
-            st.subheader("Zusammenfassung")
-            st.text_area(
-                "Zusammenfassung bearbeiten", 
-                value=st.session_state.generated_summary, 
-                height=300,
-                key="summary_input",
-                on_change=update_summary
-            )
-
-            st.subheader("Budgetvorschlag für das kommende Jahr")
-            st.text_area(
-                "Budget bearbeiten", 
-                value=st.session_state.generated_budget, 
-                height=300,
-                key="budget_input",
-                on_change=update_budget
-            )
-
-            st.subheader("Wichtige Kennzahlen (KPIs)")
-            st.number_input(
-                "Leerstand (%)",
-                min_value=0.0,
-                max_value=100.0,
-                value=st.session_state.leerstand,
-                format="%.2f",
-                key="leerstand_input",
-                on_change=update_leerstand
-            )
-            st.number_input(
-                "Rendite auf Eigenkapital (%)",
-                min_value=-100.0,
-                max_value=100.0,
-                value=st.session_state.rendite_eigenkapital,
-                format="%.2f",
-                key="rendite_eigenkapital_input",
-                on_change=update_rendite_eigenkapital
-            )
-            st.number_input(
-                "Durschnittliche Miete pro m2 (CHF)",
-                min_value=0.0,
-                value=st.session_state.miete_pro_m2,
-                format="%.2f",
-                key="miete_pro_m2_input",
-                on_change=update_miete_pro_m2
-            )
-
-
-        with preview_col:
-            st.header("Live-Vorschau")
-            display_html_report(
-                "Live Report", # report_title is no longer used in the same way
-                st.session_state.uploaded_image, 
-                st.session_state.full_financial_data
-            )
+    if st.session_state.get('show_archive'):
+        _ui().display_report_archive()
+    elif st.session_state.report_generated:
+        report_workspace()
     else:
         st.info("Bitte laden Sie einen Excel-Report und ein Deckblatt-Bild in der Seitenleiste hoch und klicken Sie auf 'Bericht generieren', um zu beginnen.")
 
+    if TRACING_ENABLED:
+        _ui().display_performance_panel()
+
 
 if __name__ == "__main__":
-    main()
+    profile = capture_profile("Rerun") if take_armed(st.session_state, RERUN) else nullcontext()
+    with trace("rerun", session=streamlit_session_id()), profile:
+        main()
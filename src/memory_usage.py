@@ -0,0 +1,79 @@
+import sys
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+from data_loader import FinancialData, DISPLAY_SHEETS
+
+# Number of workbooks whose legacy size is remembered
+LEGACY_SIZE_CACHE_SIZE = 32
+
+# Workbook digest -> legacy size in bytes
+_legacy_sizes = OrderedDict()
+_legacy_sizes_lock = threading.Lock()
+
+def deep_size(obj, seen=None):
+    """
+    Estimates the bytes held by an object and everything it references. Objects
+    reachable twice are counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, FinancialData):
+        return obj.memory_usage()
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum()) if isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, (dict, MappingProxyType)):
+        return size + sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return size + deep_size(vars(obj), seen)
+    return size
+
+def legacy_financial_data_size(financial_data):
+    """
+    Estimates the bytes the same workbook took in the dict representation that was
+    kept per session before: string copies of both sheets plus the section dicts.
+    The legacy structures are built only for measuring and dropped again; the
+    result is remembered per workbook, so that the sheets are parsed once per upload.
+    Raises WorkbookEvicted if the workbook is no longer in the blob store.
+    """
+    digest = financial_data.digest
+    with _legacy_sizes_lock:
+        if digest in _legacy_sizes:
+            _legacy_sizes.move_to_end(digest)
+            return _legacy_sizes[digest]
+
+    legacy = dict(financial_data.items())
+    for name in DISPLAY_SHEETS:
+        if name in financial_data:
+            legacy[name] = financial_data.display_frame(name)
+    size = deep_size(legacy)
+
+    with _legacy_sizes_lock:
+        _legacy_sizes[digest] = size
+        while len(_legacy_sizes) > LEGACY_SIZE_CACHE_SIZE:
+            _legacy_sizes.popitem(last=False)
+    return size
+
+def session_memory_report(session_state):
+    """
+    Returns a list of (key, bytes) for the entries of a session state, largest first.
+    The shared workbook bytes are not attributed to the session.
+    """
+    rows = [(key, deep_size(value)) for key, value in session_state.items()]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
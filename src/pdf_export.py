@@ -0,0 +1,442 @@
+import os
+import re
+import tempfile
+from io import BytesIO
+
+import plotly.io as pio
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak, Flowable, KeepInFrame
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import landscape, A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from tracing import span
+from visualizations import create_waterfall_chart
+from images import downsample_image, HERO_PDF_SIZE_IN, PDF_PROFILES, DEFAULT_PDF_PROFILE
+
+# --- Kaleido Configuration for Heroku ---
+# For robust deployment on Heroku, we explicitly configure Kaleido to use the
+# Chromium executable provided by the Google Chrome buildpack.
+
+# The heroku-buildpack-chrome-for-testing buildpack automatically sets the
+# GOOGLE_CHROME_BIN environment variable to the path of the executable.
+chrome_path = os.environ.get("GOOGLE_CHROME_BIN")
+
+if chrome_path:
+    # For Plotly v6+, the Kaleido configuration has moved to `pio.defaults`.
+    # 1. Set the path to the executable provided by the buildpack.
+    pio.defaults.kaleido.executable = chrome_path
+    
+    # 2. Add mandatory flags for running in a containerized environment.
+    # --no-sandbox: Essential for Heroku/Docker.
+    # --disable-dev-shm-usage: Prevents out-of-memory errors by using /tmp.
+    pio.defaults.kaleido.chrome_args = ["--no-sandbox", "--disable-dev-shm-usage"]
+
+
+def _create_financial_table(rows, headers, table_width, styles):
+    """
+    Creates a styled ReportLab table from the (label, value, formatted value) rows of
+    a ReportModel financial section.
+
+    Account rows are passed to ReportLab as plain strings, which are much cheaper to
+    lay out than Paragraphs; only the bold summary rows (and labels too long for a
+    single line) use Paragraphs. The table splits by row and repeats its header on
+    every page or column it continues on.
+    """
+    table_data = []
+    
+    # Prepare header row with Paragraphs
+    header_row = [Paragraph(headers[0], styles['TableHeaderLeft']), Paragraph(headers[1], styles['TableHeaderRight'])]
+    table_data.append(header_row)
+
+    col_widths = [table_width * 0.66, table_width * 0.34]
+    # Plain strings do not wrap, so longer labels fall back to a Paragraph.
+    max_label_width = col_widths[0] - 4
+
+    # Row heights are passed to ReportLab up front so that splitting a long table page
+    # by page does not re-measure every remaining cell.
+    plain_row_height = 10 + 2 + 2 # Leading plus top and bottom padding
+    row_heights = [None] # Let ReportLab measure the header row
+
+    for key, _, formatted_value in rows:
+        # Condition for bolding: if the key does NOT contain a sequence of four digits
+        is_bold = not bool(re.search(r'[0-9]{4}', key))
+        
+        # Special condition for "Abschluss Erfolgsrechnung"
+        if key == "Abschluss Erfolgsrechnung":
+            row = [Paragraph(key, styles['OrangeBodyBoldSmallLeft']), Paragraph(formatted_value, styles['OrangeBodyBoldSmallRight'])]
+        elif is_bold:
+            row = [Paragraph(key, styles['BodyBoldSmallLeft']), Paragraph(formatted_value, styles['BodyBoldSmallRight'])]
+        elif stringWidth(key, 'Helvetica', 8) > max_label_width:
+            row = [Paragraph(key, styles['BodySmallLeft']), formatted_value]
+        else:
+            row = [key, formatted_value]
+
+        if isinstance(row[0], Paragraph):
+            _, label_height = row[0].wrap(max_label_width, 1000)
+            row_heights.append(max(label_height + 4, plain_row_height))
+        else:
+            row_heights.append(plain_row_height)
+        table_data.append(row)
+    
+    table = Table(table_data, colWidths=col_widths, rowHeights=row_heights, repeatRows=1, splitByRow=1)
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.white), # Entire table background white
+        ('FONT', (0, 1), (-1, -1), 'Helvetica', 8, 10), # Plain-string account rows
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('LEFTPADDING', (0, 1), (-1, -1), 2),
+        ('RIGHTPADDING', (0, 1), (-1, -1), 2),
+        ('TOPPADDING', (0, 1), (-1, -1), 2),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 2),
+        ('LINEBELOW', (0,0), (-1,0), 1, colors.black), # Line below header
+    ])
+    table.setStyle(style)
+    return table
+
+class _BalancedColumns(Flowable):
+    """
+    Flows a list of flowables (section titles and financial tables) through two
+    columns. Content fills the left column, then the right one, and continues on the
+    next page; on the last page the remaining content is balanced between both
+    columns. Unlike nesting tables inside an outer table cell, this splits across
+    any number of pages.
+    """
+
+    def __init__(self, flowables, gap):
+        super().__init__()
+        self._content = list(flowables)
+        self._gap = gap
+        self._layout_cache = {}
+        # Set once nothing fitted and the frame was asked to move on
+        self._deferred = False
+
+    @staticmethod
+    def _fill_column(content, width, height):
+        """Places as much content as fits into one column. Returns (placed, remainder, used_height)."""
+        placed = []
+        remainder = list(content)
+        used = 0
+        while remainder:
+            flowable = remainder[0]
+            # Stacked the same way as a table cell holding a list of flowables
+            space = placed[-1].getSpaceAfter() + flowable.getSpaceBefore() if placed else 0
+            available = height - used - space
+            if available <= 0:
+                break
+            _, h = flowable.wrap(width, available)
+            if h <= available:
+                placed.append(flowable)
+                used += space + h
+                remainder.pop(0)
+                continue
+            parts = flowable.split(width, available)
+            if parts:
+                _, h = parts[0].wrap(width, available)
+                placed.append(parts[0])
+                used += space + h
+                remainder[0:1] = parts[1:]
+            break
+
+        # Don't leave a section title orphaned at the bottom of a column.
+        if remainder and placed and isinstance(placed[-1], Paragraph) and len(placed) > 1:
+            remainder.insert(0, placed.pop())
+        return placed, remainder, used
+
+    def _layout(self, aW, aH):
+        """Fills both columns for the available height, balancing them if all content fits."""
+        if (aW, aH) not in self._layout_cache:
+            self._layout_cache[(aW, aH)] = self._compute_layout(aW, aH)
+        return self._layout_cache[(aW, aH)]
+
+    def _compute_layout(self, aW, aH):
+        col_width = (aW - self._gap) / 2
+        left, rest, _ = self._fill_column(self._content, col_width, aH)
+        right, rest, _ = self._fill_column(rest, col_width, aH)
+
+        if not rest:
+            # Everything fits: search for the lowest column height that still holds it all.
+            low, high = 0, aH
+            while high - low > 1:
+                mid = (low + high) / 2
+                trial_left, trial_rest, _ = self._fill_column(self._content, col_width, mid)
+                trial_right, trial_rest, _ = self._fill_column(trial_rest, col_width, mid)
+                if trial_rest:
+                    low = mid
+                else:
+                    high = mid
+            left, rest, _ = self._fill_column(self._content, col_width, high)
+            right, rest, _ = self._fill_column(rest, col_width, high)
+
+        if not left and not right:
+            return None, rest
+
+        page_table = Table([[left, '', right]], colWidths=[col_width, self._gap, col_width])
+        page_table.setStyle(TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('LEFTPADDING', (0,0), (-1,-1), 0),
+            ('RIGHTPADDING', (0,0), (-1,-1), 0),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
+            ('TOPPADDING', (0,0), (-1,-1), 0),
+        ]))
+        return page_table, rest
+
+    def wrap(self, aW, aH):
+        page_table, remainder = self._layout(aW, aH)
+        if page_table is None:
+            return aW, aH + 1 # Nothing fits here; let the frame try to split or move on
+        w, h = page_table.wrap(aW, aH)
+        if remainder:
+            h = max(h, aH + 1) # Force the frame to split this flowable
+        self._page_table = page_table
+        return w, h
+
+    def split(self, aW, aH):
+        page_table, remainder = self._layout(aW, aH)
+        if page_table is None:
+            if not self._deferred:
+                # Nothing fits below what is already in this frame: try the next one
+                self._deferred = True
+                return []
+            # Not even a fresh frame holds the first flowable in a column. Give it the
+            # full frame, shrunk if need be, instead of failing the layout.
+            oversized = KeepInFrame(aW, aH, [remainder[0]], mode='shrink')
+            if len(remainder) == 1:
+                return [oversized]
+            return [oversized, _BalancedColumns(remainder[1:], self._gap)]
+        if not remainder:
+            return [page_table]
+        return [page_table, _BalancedColumns(remainder, self._gap)]
+
+    def draw(self):
+        self._page_table.drawOn(self.canv, 0, 0)
+
+def _add_page_footer(canvas, doc, logo_path):
+    """Adds a footer with logo and page number to each page."""
+    canvas.saveState()
+    
+    # Draw separator line
+    line_y = doc.bottomMargin + 0.1 * inch
+    canvas.setStrokeColorRGB(0, 0, 0)
+    canvas.line(doc.leftMargin, line_y, doc.width + doc.leftMargin, line_y)
+
+    # Draw logo on the left, below the line
+    if logo_path and os.path.exists(logo_path):
+        canvas.drawImage(logo_path, doc.leftMargin, 0.1 * inch, width=0.6*inch, height=0.6*inch, preserveAspectRatio=True, mask='auto')
+
+    # Draw page number on the right
+    canvas.setFont('Helvetica', 9)
+    page_number_text = f"Seite {doc.page}"
+    canvas.drawRightString(doc.width + doc.leftMargin, 0.2 * inch, page_number_text)
+    
+    canvas.restoreState()
+
+def markdown_to_flowables(md_text, styles):
+    """Converts a markdown string to a list of ReportLab Flowables."""
+    flowables = []
+    for line in md_text.split('\n'):
+        line = line.strip()
+        if line.startswith('- '):
+            # Use the existing 'Bullet' style and remove the markdown character
+            flowables.append(Paragraph(line[2:], styles['Bullet']))
+        elif line.startswith('**') and line.endswith('**'):
+            # Use <b> tags for bold
+            flowables.append(Paragraph(f"<b>{line[2:-2]}</b>", styles['Body']))
+        elif line.startswith('*') and line.endswith('*'):
+            # Use <i> tags for italic
+            flowables.append(Paragraph(f"<i>{line[1:-1]}</i>", styles['Body']))
+        elif line: # Handle non-empty lines
+            flowables.append(Paragraph(line, styles['Body']))
+    return flowables
+
+def _write_temp_file(data, suffix):
+    """Writes bytes to a named temporary file and returns its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(data)
+        return tmp_file.name
+
+def pdf_from_reportlab(hero_image, report_model, profile=DEFAULT_PDF_PROFILE, page_footer=True):
+    """
+    Generates a PDF report from a ReportModel and a prepared HeroImage using ReportLab.
+    Without a hero image (None) the title page shows only the logo and the title.
+
+    `profile` selects one of PDF_PROFILES and controls the resolution and JPEG quality
+    of the embedded images. With `page_footer=False` the footer is left off so that a
+    caller merging several reports can number the pages itself.
+    """
+    texts = report_model.texts
+    kpis = report_model.formatted_kpis
+
+    profile_settings = PDF_PROFILES[profile]
+    image_dpi = profile_settings["image_dpi"]
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), rightMargin=inch/2, leftMargin=inch/2, topMargin=inch/2, bottomMargin=inch/2, pageCompression=1)
+    
+    styles = getSampleStyleSheet()
+    
+    # Define LeliaOrange
+    LeliaOrange = colors.HexColor('#ff6b00')
+
+    # Modify existing Title style
+    styles['Title'].fontName = 'Helvetica-Bold'
+    styles['Title'].fontSize = 24
+    styles['Title'].alignment = TA_CENTER
+    styles['Title'].spaceAfter = 14
+
+    # Add custom styles
+    styles.add(ParagraphStyle(name='Date', fontName='Helvetica', fontSize=12, alignment=TA_CENTER, spaceAfter=20))
+    styles.add(ParagraphStyle(name='H1', fontName='Helvetica-Bold', fontSize=18, spaceBefore=20, spaceAfter=10))
+    styles.add(ParagraphStyle(name='H2', fontName='Helvetica-Bold', fontSize=14, spaceBefore=10, spaceAfter=5))
+    styles.add(ParagraphStyle(name='Body', fontName='Helvetica', fontSize=10, leading=14))
+    styles.add(ParagraphStyle(name='Quote', fontName='Helvetica-BoldOblique', fontSize=12, leading=14, leftIndent=20, rightIndent=20, spaceBefore=10, spaceAfter=10))
+    
+    # New styles for financial tables
+    styles.add(ParagraphStyle(name='BodySmallLeft', fontName='Helvetica', fontSize=8, leading=10, alignment=TA_LEFT))
+    styles.add(ParagraphStyle(name='BodyBoldSmallLeft', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_LEFT))
+    styles.add(ParagraphStyle(name='BodySmallRight', fontName='Helvetica', fontSize=8, leading=10, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='BodyBoldSmallRight', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='TableHeaderLeft', fontName='Helvetica-Bold', fontSize=10, textColor=LeliaOrange, alignment=TA_LEFT))
+    styles.add(ParagraphStyle(name='TableHeaderRight', fontName='Helvetica-Bold', fontSize=10, textColor=LeliaOrange, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='KpiValue', fontName='Helvetica-Bold', fontSize=24, textColor=LeliaOrange, alignment=TA_LEFT))
+    styles.add(ParagraphStyle(name='KpiTitle', fontName='Helvetica', fontSize=10, alignment=TA_LEFT, spaceBefore=10))
+    styles.add(ParagraphStyle(name='OrangeBodyBoldSmallLeft', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_LEFT, textColor=LeliaOrange))
+    styles.add(ParagraphStyle(name='OrangeBodyBoldSmallRight', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_RIGHT, textColor=LeliaOrange))
+
+
+    story = []
+    chart_filename = None
+    hero_image_path = None
+    logo_path = None
+
+    try:
+        # --- Robust Path Construction ---
+        script_dir = os.path.dirname(__file__)
+        templates_dir = os.path.abspath(os.path.join(script_dir, 'templates'))
+        source_logo_path = os.path.join(templates_dir, 'LELIA_LOGO_L_O.png')
+
+        # --- Title Page ---
+        if os.path.exists(source_logo_path):
+            # The title page and every footer draw the logo from the same file, so
+            # ReportLab embeds it only once.
+            logo_path = _write_temp_file(downsample_image(source_logo_path, 3, 1.5, image_dpi, image_format="PNG"), ".png")
+            logo = Image(logo_path, width=3*inch, height=1.5*inch)
+            logo.hAlign = 'CENTER'
+            story.append(logo)
+            story.append(Spacer(1, 0.25*inch))
+
+        story.append(Paragraph(report_model.primary_market_area, styles['Title'])) # Use the primary market area as the main title
+        story.append(Paragraph(report_model.date_range, styles['Date']))
+
+        if hero_image is not None:
+            hero_image_path = _write_temp_file(hero_image.pdf_image(profile), ".jpg")
+
+            hero_flowable = Image(hero_image_path, width=HERO_PDF_SIZE_IN[0]*inch, height=HERO_PDF_SIZE_IN[1]*inch)
+            hero_flowable.hAlign = 'CENTER'
+            story.append(hero_flowable)
+        story.append(PageBreak())
+
+        # --- Executive Summary & KPIs ---
+        story.append(Paragraph("Zusammenfassung & KPIs", styles['H1']))
+        story.append(Spacer(1, 0.2*inch))
+
+        # Create KPI column
+        kpi_story = []
+        kpi_story.append(Paragraph("Leerstand (%)", styles['KpiTitle']))
+        kpi_story.append(Paragraph(f"{kpis['leerstand']}%", styles['KpiValue']))
+        kpi_story.append(Spacer(1, 0.2*inch))
+        kpi_story.append(Paragraph("Rendite auf Eigenkapital (%)", styles['KpiTitle']))
+        kpi_story.append(Paragraph(f"{kpis['rendite_eigenkapital']}%", styles['KpiValue']))
+        kpi_story.append(Spacer(1, 0.2*inch))
+        kpi_story.append(Paragraph("Durschnittliche Miete pro m2 (CHF)", styles['KpiTitle']))
+        kpi_story.append(Paragraph(kpis['miete_pro_m2'], styles['KpiValue']))
+
+        # Create Summary column
+        summary_story = []
+        summary_story.append(Paragraph(texts['blockquote'], styles['Quote']))
+        summary_story.append(Spacer(1, 0.2*inch))
+        summary_story.extend(markdown_to_flowables(texts['summary'], styles))
+
+        # Combine into a two-column table
+        summary_table_data = [[summary_story, kpi_story]]
+        summary_table = Table(summary_table_data, colWidths=[doc.width * 0.7, doc.width * 0.3])
+        summary_table.setStyle(TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ]))
+        story.append(summary_table)
+        story.append(Spacer(1, 0.25*inch))
+
+
+        # --- Financial Tables ---
+        # Calculate available width for two tables side-by-side
+        available_width = doc.width # This is the content width of the page
+        column_gap = 0.25*inch
+        table_half_width = (available_width - column_gap) / 2
+
+        # --- Erfolgsrechnung Section ---
+        story.append(PageBreak())
+        story.append(Paragraph("Erfolgsrechnung", styles['H1']))
+        story.append(Spacer(1, 0.2*inch)) # Added spacer
+
+        ertraege_table = _create_financial_table(report_model.table('Erträge'), ['Beschreibung', 'Betrag (CHF)'], table_half_width, styles)
+        aufwand_table = _create_financial_table(report_model.table('Aufwand'), ['Beschreibung', 'Betrag (CHF)'], table_half_width, styles)
+
+        # Flow both tables through two balanced columns so long ledgers continue on following pages
+        story.append(_BalancedColumns([
+            Paragraph("Erträge", styles['H2']), ertraege_table,
+            Paragraph("Aufwand", styles['H2']), aufwand_table,
+        ], column_gap))
+        story.append(Spacer(1, 0.25*inch))
+
+        # --- Bilanz Section ---
+        story.append(PageBreak())
+        story.append(Paragraph("Bilanz", styles['H1']))
+        story.append(Spacer(1, 0.2*inch)) # Added spacer
+
+        aktiva_table = _create_financial_table(report_model.table('Aktiva'), ['Konto', 'Betrag (CHF)'], table_half_width, styles)
+        passiva_table = _create_financial_table(report_model.table('Passiva'), ['Konto', 'Betrag (CHF)'], table_half_width, styles)
+
+        story.append(_BalancedColumns([
+            Paragraph("Aktiva", styles['H2']), aktiva_table,
+            Paragraph("Passiva", styles['H2']), passiva_table,
+        ], column_gap))
+        story.append(Spacer(1, 0.25*inch))
+
+        # --- Waterfall Chart ---
+        story.append(PageBreak())
+        story.append(Paragraph("Finanzanalyse", styles['H1']))
+        waterfall_fig = create_waterfall_chart(list(report_model.waterfall_x), list(report_model.waterfall_y), list(report_model.waterfall_measure))
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_chart:
+            chart_filename = tmp_chart.name
+            # Rasterize at the profile DPI for the 7x4 inch box the chart is drawn in
+            with span("kaleido_chart", dpi=image_dpi):
+                waterfall_fig.write_image(chart_filename, width=700, height=400, scale=7 * image_dpi / 700)
+        
+        chart_image = Image(chart_filename, width=7*inch, height=4*inch)
+        chart_image.hAlign = 'CENTER'
+        story.append(chart_image)
+        story.append(Spacer(1, 0.25*inch))
+        story.append(Paragraph("Detaillierte Erklärung", styles['H2']))
+        story.extend(markdown_to_flowables(texts['waterfall_explanation'], styles))
+
+        # --- Budget Proposal ---
+        story.append(PageBreak())
+        story.append(Paragraph("Budgetvorschlag für das kommende Jahr", styles['H1']))
+        story.append(Spacer(1, 0.2*inch)) # Added spacer
+        story.extend(markdown_to_flowables(texts['budget'], styles))
+
+        add_footer = (lambda c, d: _add_page_footer(c, d, logo_path)) if page_footer else (lambda c, d: None)
+        with span("reportlab_build", flowables=len(story)):
+            doc.build(story, onFirstPage=lambda c, d: None, onLaterPages=add_footer)
+    finally:
+        # Clean up temporary files
+        for tmp_path in (hero_image_path, chart_filename, logo_path):
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    buffer.seek(0)
+    return buffer.getvalue()
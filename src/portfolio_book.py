@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NullObject,
+    NumberObject, StreamObject, TextStringObject,
+)
+from reportlab.lib.pagesizes import landscape, A4
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas as pdf_canvas
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib import colors
+
+from data_loader import load_financial_data
+from images import downsample_image, prepare_hero_image, PDF_PROFILES
+from report_model import build_report_model, DEFAULT_TEXTS, DEFAULT_KPIS
+from pdf_export import pdf_from_reportlab, _add_page_footer
+
+PAGE_SIZE = landscape(A4)
+PAGE_MARGIN = inch / 2
+# Times the table of contents is laid out before its page count has to have settled
+TOC_LAYOUT_ATTEMPTS = 3
+# Page attributes a page may inherit from its parents in the page tree
+INHERITED_PAGE_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+def _render_section(job):
+    """
+    Renders the report of one property to a PDF file in the work directory.
+    Runs in a worker process; only the file path and metadata are sent back.
+    """
+    financial_data = load_financial_data(job['workbook'])
+    texts = {**DEFAULT_TEXTS, **(job.get('texts') or {})}
+    kpis = {**DEFAULT_KPIS, **(job.get('kpis') or {})}
+    report_model = build_report_model(financial_data, texts, kpis)
+
+    with open(job['image'], 'rb') as image_file:
+        hero_image = prepare_hero_image(image_file.read(), {job['profile']: PDF_PROFILES[job['profile']]})
+
+    pdf_bytes = pdf_from_reportlab(hero_image, report_model, profile=job['profile'], page_footer=False)
+
+    with open(job['output'], 'wb') as out_file:
+        out_file.write(pdf_bytes)
+
+    return {
+        'title': report_model.primary_market_area,
+        'date_range': report_model.date_range,
+        'path': job['output'],
+        'pages': len(PdfReader(job['output']).pages),
+    }
+
+def _render_table_of_contents(book_title, sections, first_pages, output_path):
+    """Renders the table of contents to `output_path` and returns its page count."""
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='TocEntry', fontName='Helvetica', fontSize=11, leading=14))
+    styles.add(ParagraphStyle(name='TocPage', fontName='Helvetica', fontSize=11, leading=14, alignment=TA_RIGHT))
+
+    doc = SimpleDocTemplate(output_path, pagesize=PAGE_SIZE, rightMargin=PAGE_MARGIN, leftMargin=PAGE_MARGIN, topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN, pageCompression=1)
+    story = [Paragraph(book_title, styles['Title']), Paragraph("Inhaltsverzeichnis", styles['Heading1']), Spacer(1, 0.2*inch)]
+
+    rows = [
+        [Paragraph(section['title'], styles['TocEntry']), Paragraph(section['date_range'], styles['TocEntry']), Paragraph(str(page), styles['TocPage'])]
+        for section, page in zip(sections, first_pages)
+    ]
+    if rows:
+        toc_table = Table(rows, colWidths=[doc.width * 0.55, doc.width * 0.35, doc.width * 0.10])
+        toc_table.setStyle(TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('LINEBELOW', (0,0), (-1,-1), 0.25, colors.lightgrey),
+        ]))
+        story.append(toc_table)
+
+    doc.build(story)
+    return len(PdfReader(output_path).pages)
+
+def _render_page_footers(first_page, page_count, skip_pages, logo_path, output_path):
+    """
+    Renders one overlay page per page of a part of the book, carrying the footer from
+    `_add_page_footer` with the page numbers from `first_page` on. Pages in
+    `skip_pages` (book page numbers) stay blank.
+    """
+    width, height = PAGE_SIZE
+    overlay = pdf_canvas.Canvas(output_path, pagesize=PAGE_SIZE, pageCompression=1)
+    for page in range(first_page, first_page + page_count):
+        if page not in skip_pages:
+            doc = SimpleNamespace(leftMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN, width=width - 2 * PAGE_MARGIN, page=page)
+            _add_page_footer(overlay, doc, logo_path)
+        overlay.showPage()
+    overlay.save()
+
+class _PdfConcatenator:
+    """
+    Writes the pages of several PDFs to one file, part by part. The objects of a part
+    are written out as soon as its pages are added, so only the part being added is
+    held in memory; what is kept across parts is one offset per object and the
+    digests of the streams written, by which identical streams (fonts, the logo) are
+    written once.
+    """
+
+    def __init__(self, out_file):
+        self._out = out_file
+        # Object number -> file offset; None while reserved. Object 0 is not used.
+        self._offsets = [None]
+        self._stream_ids = {}
+        self._page_ids = []
+        self._pages_id = self._reserve()
+        self._out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _reserve(self):
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def _write(self, object_id, data):
+        self._offsets[object_id] = self._out.tell()
+        self._out.write(b"%d 0 obj\n" % object_id + data + b"\nendobj\n")
+
+    @staticmethod
+    def _serialize(obj):
+        buffer = BytesIO()
+        obj.write_to_stream(buffer)
+        return buffer.getvalue()
+
+    def _clone(self, obj, ids):
+        """Copies a direct object, replacing the references with the numbers in the output."""
+        if isinstance(obj, IndirectObject):
+            object_id = self._copy_object(obj, ids)
+            return NullObject() if object_id is None else IndirectObject(object_id, 0, None)
+        if isinstance(obj, StreamObject):
+            # A stream must be an indirect object; pages merged by pypdf have direct ones
+            return IndirectObject(self._write_stream(obj, ids), 0, None)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._clone(value, ids) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._clone(value, ids) for value in obj)
+        return obj
+
+    def _write_stream(self, stream, ids):
+        if isinstance(stream, DecodedStreamObject):
+            stream = stream.flate_encode()
+        clone = StreamObject()
+        clone.update({key: self._clone(value, ids) for key, value in stream.items() if key != "/Length"})
+        clone._data = stream._data
+        data = self._serialize(clone)
+        digest = hashlib.sha256(data).digest()
+        object_id = self._stream_ids.get(digest)
+        if object_id is None:
+            object_id = self._stream_ids[digest] = self._reserve()
+            self._write(object_id, data)
+        return object_id
+
+    def _copy_object(self, reference, ids):
+        """Writes the object behind a reference of a part and returns its number in the output."""
+        key = (id(reference.pdf), reference.idnum, reference.generation)
+        if key in ids:
+            return ids[key]
+        obj = reference.get_object()
+        if isinstance(obj, StreamObject):
+            # Streams do not point back to the objects referencing them
+            ids[key] = self._write_stream(obj, ids)
+            return ids[key]
+        if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Page":
+            # A link to a page that is not part of the book
+            return None
+        # Reserved first: dictionaries may refer back to themselves (annotations, pages)
+        object_id = ids[key] = self._reserve()
+        self._write(object_id, self._serialize(self._clone(obj, ids)))
+        return object_id
+
+    def add_pages(self, pages):
+        """Appends pages of one part; the pages must be added together with all pages they link to."""
+        ids = {}
+        page_ids = []
+        for page in pages:
+            page_id = self._reserve()
+            if page.indirect_reference is not None:
+                reference = page.indirect_reference
+                ids[(id(reference.pdf), reference.idnum, reference.generation)] = page_id
+            page_ids.append(page_id)
+
+        for page, page_id in zip(pages, page_ids):
+            page_dict = DictionaryObject({key: self._clone(value, ids) for key, value in page.items() if key != "/Parent"})
+            for key in INHERITED_PAGE_ATTRIBUTES:
+                node = page
+                while key not in node and "/Parent" in node:
+                    node = node["/Parent"].get_object()
+                if key in node and key not in page_dict:
+                    page_dict[NameObject(key)] = self._clone(node[key], ids)
+            page_dict[NameObject("/Parent")] = IndirectObject(self._pages_id, 0, None)
+            self._write(page_id, self._serialize(page_dict))
+        self._page_ids += page_ids
+
+    def finish(self, outline=()):
+        """Writes the page tree, the outline of (title, 0-based page index) entries and the trailer."""
+        def reference(object_id):
+            return IndirectObject(object_id, 0, None)
+
+        catalog = DictionaryObject({NameObject("/Type"): NameObject("/Catalog"), NameObject("/Pages"): reference(self._pages_id)})
+        if outline:
+            outline_id = self._reserve()
+            item_ids = [self._reserve() for _ in outline]
+            for index, ((title, page_index), item_id) in enumerate(zip(outline, item_ids)):
+                item = DictionaryObject({
+                    NameObject("/Title"): TextStringObject(title),
+                    NameObject("/Parent"): reference(outline_id),
+                    NameObject("/Dest"): ArrayObject([reference(self._page_ids[page_index]), NameObject("/Fit")]),
+                })
+                if index > 0:
+                    item[NameObject("/Prev")] = reference(item_ids[index - 1])
+                if index < len(item_ids) - 1:
+                    item[NameObject("/Next")] = reference(item_ids[index + 1])
+                self._write(item_id, self._serialize(item))
+            self._write(outline_id, self._serialize(DictionaryObject({
+                NameObject("/Type"): NameObject("/Outlines"),
+                NameObject("/First"): reference(item_ids[0]),
+                NameObject("/Last"): reference(item_ids[-1]),
+                NameObject("/Count"): NumberObject(len(item_ids)),
+            })))
+            catalog[NameObject("/Outlines")] = reference(outline_id)
+
+        self._write(self._pages_id, self._serialize(DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(reference(page_id) for page_id in self._page_ids),
+            NameObject("/Count"): NumberObject(len(self._page_ids)),
+        })))
+        catalog_id = self._reserve()
+        self._write(catalog_id, self._serialize(catalog))
+
+        # Numbers reserved for objects that were never written (links out of the book)
+        for object_id, offset in enumerate(self._offsets):
+            if object_id and offset is None:
+                self._write(object_id, b"null")
+
+        xref_offset = self._out.tell()
+        self._out.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self._offsets))
+        for offset in self._offsets[1:]:
+            self._out.write(b"%010d 00000 n \n" % offset)
+        self._out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self._offsets), catalog_id, xref_offset))
+
+def build_portfolio_book(properties, output_path, book_title="Portfolio-Bericht", profile="screen", max_workers=None):
+    """
+    Renders the report of every property in a process pool and merges them into a
+    single PDF with a table of contents and continuous page numbers.
+
+    `properties` is a list of dicts with the keys 'workbook' and 'image' (file paths)
+    and optionally 'texts' and 'kpis' as accepted by `build_report_model`. The
+    sections are written to disk by the workers and appended to the book one at a
+    time, so the parent process holds one section (and its footer overlay) in
+    memory, whatever the size of the portfolio. Returns the list of rendered
+    sections.
+    """
+    if profile not in PDF_PROFILES:
+        raise ValueError(f"Unknown PDF profile: {profile}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        jobs = [
+            {**prop, 'profile': profile, 'output': os.path.join(work_dir, f"section_{index:05d}.pdf")}
+            for index, prop in enumerate(properties)
+        ]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            sections = list(pool.map(_render_section, jobs))
+
+        # The table of contents lists the start pages, which depend on its own length.
+        # It is laid out again until the page count it assumed is the one it got.
+        toc_path = os.path.join(work_dir, "toc.pdf")
+        toc_pages = _render_table_of_contents(book_title, sections, [0] * len(sections), toc_path)
+        for _ in range(TOC_LAYOUT_ATTEMPTS):
+            first_pages = []
+            next_page = toc_pages + 1
+            for section in sections:
+                first_pages.append(next_page)
+                next_page += section['pages']
+            rendered_pages = _render_table_of_contents(book_title, sections, first_pages, toc_path)
+            if rendered_pages == toc_pages:
+                break
+            toc_pages = rendered_pages
+        else:
+            raise RuntimeError(f"The table of contents did not settle on a page count after {TOC_LAYOUT_ATTEMPTS} layouts")
+
+        # Title pages of the table of contents and of each section carry no footer
+        skip_pages = {1} | set(first_pages)
+
+        script_dir = os.path.dirname(__file__)
+        logo_path = os.path.join(work_dir, "logo.png")
+        with open(logo_path, 'wb') as logo_file:
+            logo_file.write(downsample_image(os.path.join(script_dir, 'templates', 'LELIA_LOGO_L_O.png'), 0.6, 0.6, PDF_PROFILES[profile]['image_dpi'], image_format="PNG"))
+
+        footer_path = os.path.join(work_dir, "footers.pdf")
+        parts = [(toc_path, 1, toc_pages)] + [
+            (section['path'], first_page, section['pages']) for section, first_page in zip(sections, first_pages)
+        ]
+        with open(output_path, 'wb') as out_file:
+            book = _PdfConcatenator(out_file)
+            for part_path, first_page, page_count in parts:
+                _render_page_footers(first_page, page_count, skip_pages, logo_path, footer_path)
+                with PdfReader(part_path) as part, PdfReader(footer_path) as footers:
+                    pages = list(part.pages)
+                    for page, footer in zip(pages, footers.pages):
+                        page.merge_page(footer)
+                    book.add_pages(pages)
+            book.finish([(section['title'], first_page - 1) for section, first_page in zip(sections, first_pages)])
+
+    return [{**section, 'first_page': page} for section, page in zip(sections, first_pages)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds a portfolio report book from a JSON manifest.")
+    parser.add_argument("manifest", help="JSON file with a list of {workbook, image, texts, kpis} entries")
+    parser.add_argument("output", help="Path of the merged PDF")
+    parser.add_argument("--title", default="Portfolio-Bericht")
+    parser.add_argument("--profile", default="screen", choices=list(PDF_PROFILES))
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding='utf-8') as manifest_file:
+        properties = json.load(manifest_file)
+
+    sections = build_portfolio_book(properties, args.output, book_title=args.title, profile=args.profile, max_workers=args.workers)
+    for section in sections:
+        print(f"{section['first_page']:>5}  {section['title']} ({section['pages']} Seiten)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# What is profiled without arming it in the UI: "rerun", "job" or "all". Meant for
+# an admin who cannot log in to the app, e.g. to profile the jobs of the HTTP API.
+PROFILING = os.environ.get("PROFILING", "").lower()
+# Number of functions and allocation sites listed in the reports
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", 30))
+# Number of captures kept in memory, across all sessions
+PROFILE_HISTORY_SIZE = 10
+
+RERUN = "rerun"
+JOB = "job"
+
+# Session state key holding the target armed by an admin for the session's next run
+ARMED_KEY = 'profile_next'
+
+@dataclass(frozen=True)
+class ProfileCapture:
+    """The CPU profile and the allocations of one profiled run."""
+    id: str
+    name: str
+    started_at: float
+    seconds: float
+    pstats_bytes: bytes
+    function_report: str
+    allocation_report: str
+
+_captures = deque(maxlen=PROFILE_HISTORY_SIZE)
+_captures_lock = threading.Lock()
+# cProfile and tracemalloc are process-wide; only one capture runs at a time
+_capture_lock = threading.Lock()
+
+def _function_report(profiler, top_n):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+    return stream.getvalue()
+
+def _allocation_report(name, before, after, peak, top_n):
+    differences = after.compare_to(before, 'lineno')
+    net = sum(stat.size_diff for stat in differences)
+    lines = [
+        f"Speicherprofil: {name}",
+        f"Spitze während des Laufs: {peak / 1024:.0f} KB, netto {net / 1024:+.0f} KB (alle Threads)",
+        "",
+        f"Top {top_n} Zuwächse nach Zeile:",
+    ]
+    lines += [str(stat) for stat in differences[:top_n]]
+    return "\n".join(lines) + "\n"
+
+def _pstats_bytes(profiler):
+    with tempfile.NamedTemporaryFile(suffix=".pstats", delete=False) as tmp_file:
+        path = tmp_file.name
+    try:
+        profiler.dump_stats(path)
+        with open(path, 'rb') as stats_file:
+            return stats_file.read()
+    finally:
+        os.remove(path)
+
+@contextmanager
+def capture_profile(name, top_n=PROFILE_TOP_N):
+    """
+    Runs the block under cProfile and tracemalloc and keeps the result in the list of
+    captures. The CPU profile covers the calling thread only, so a job is captured
+    from within its worker. While another capture is running the block runs
+    unprofiled.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        started_at = time.time()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            capture = ProfileCapture(
+                id=uuid.uuid4().hex[:12],
+                name=name,
+                started_at=started_at,
+                seconds=seconds,
+                pstats_bytes=_pstats_bytes(profiler),
+                function_report=_function_report(profiler, top_n),
+                allocation_report=_allocation_report(name, before, after, peak, top_n),
+            )
+            with _captures_lock:
+                _captures.append(capture)
+    finally:
+        _capture_lock.release()
+
+def recent_captures():
+    """Returns the kept captures, newest first."""
+    with _captures_lock:
+        return list(reversed(_captures))
+
+def take_armed(session_state, target):
+    """
+    Returns True if the next `target` ("rerun" or "job") of the session is to be
+    profiled, either because an admin armed it (which is consumed) or through the
+    PROFILING environment variable.
+    """
+    if session_state.get(ARMED_KEY) == target:
+        session_state[ARMED_KEY] = None
+        return True
+    return PROFILING in (target, "all")
+
+def profiled(fn, name):
+    """Wraps a job function so that the job is captured in its worker thread."""
+    def run(job, *args, **kwargs):
+        with capture_profile(f"Job: {name}"):
+            return fn(job, *args, **kwargs)
+    return run
+
+def job_function(session_state, fn, name):
+    """Returns `fn`, wrapped in a capture if the session's next job is to be profiled."""
+    return profiled(fn, name) if take_armed(session_state, JOB) else fn
@@ -0,0 +1,358 @@
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from batch_reports import headless_report_texts
+from images import prepare_hero_image, PDF_PROFILES, DEFAULT_PDF_PROFILE
+from jobs import JobQueue, JobQueueFull, DONE, FAILED, CANCELLED
+from profiling import job_function
+from report_model import DEFAULT_TEXTS, DEFAULT_KPIS
+from tracing import prometheus_metrics
+
+# Number of reports rendered at the same time and number of reports that may wait
+API_WORKERS = int(os.environ.get("API_WORKERS", 4))
+API_QUEUE_LIMIT = int(os.environ.get("API_QUEUE_LIMIT", 32))
+# Requests with a larger body are refused with 413
+API_MAX_BODY_BYTES = int(os.environ.get("API_MAX_BODY_BYTES", 50 * 1024 * 1024))
+# When set, clients have to send "Authorization: Bearer <token>". Without a token the
+# server only listens on a loopback address.
+API_TOKEN = os.environ.get("REPORT_API_TOKEN")
+# Seconds a client is asked to wait after a 429
+RETRY_AFTER_SECONDS = 5
+# Finished PDFs and HTML reports are written to this directory instead of being kept
+# in the job history, and removed this many seconds after the job finished
+API_RESULT_DIR = os.environ.get("API_RESULT_DIR") or os.path.join(tempfile.gettempdir(), "report_api_results")
+API_RESULT_TTL_SECONDS = int(os.environ.get("API_RESULT_TTL_SECONDS", 3600))
+
+_CONTENT_TYPES = {'pdf': "application/pdf", 'html': "text/html; charset=utf-8"}
+
+_JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{32})(?:/(pdf|html))?$')
+
+# The API has its own queue so that it never competes with the interactive app for
+# the same workers when both run in one process.
+api_job_queue = JobQueue(max_workers=API_WORKERS, queue_limit=API_QUEUE_LIMIT)
+
+# Input hash -> job id, so that resubmitting the same request returns the same job
+_jobs_by_input = {}
+_jobs_by_input_lock = threading.Lock()
+
+class RequestError(Exception):
+    """Raised for an invalid request; carries the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _decode_base64(request, field):
+    value = request.get(field)
+    if value is None:
+        return None
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError):
+        raise RequestError(400, f"'{field}' is not valid base64")
+
+def parse_request(body):
+    """
+    Validates a POST /jobs body and returns the normalized request. The body is a JSON
+    object with the base64-encoded 'workbook' (required) and 'image', the strings
+    'notes' and 'budget_notes', the 'kpis' object, the PDF 'profile' and
+    the boolean 'generate_texts' (default true).
+    """
+    try:
+        request = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise RequestError(400, f"Body is not valid JSON: {e}")
+    if not isinstance(request, dict):
+        raise RequestError(400, "Body must be a JSON object")
+
+    workbook = _decode_base64(request, 'workbook')
+    if not workbook:
+        raise RequestError(400, "'workbook' is required")
+    profile = request.get('profile', DEFAULT_PDF_PROFILE)
+    if profile not in PDF_PROFILES:
+        raise RequestError(400, f"'profile' must be one of {', '.join(PDF_PROFILES)}")
+    kpis = request.get('kpis') or {}
+    if not isinstance(kpis, dict):
+        raise RequestError(400, "'kpis' must be an object")
+    try:
+        kpis = {**DEFAULT_KPIS, **{str(key): float(value) for key, value in kpis.items()}}
+    except (TypeError, ValueError):
+        raise RequestError(400, "'kpis' values must be numbers")
+    generate_texts = request.get('generate_texts', True)
+    if not isinstance(generate_texts, bool):
+        raise RequestError(400, "'generate_texts' must be true or false")
+
+    return {
+        'workbook': workbook,
+        'image': _decode_base64(request, 'image'),
+        'notes': str(request.get('notes') or ""),
+        'budget_notes': str(request.get('budget_notes') or ""),
+        'kpis': kpis,
+        'profile': profile,
+        'generate_texts': generate_texts,
+    }
+
+def input_hash(request):
+    """Hashes everything a report is derived from; equal requests give equal reports."""
+    payload = json.dumps({
+        'workbook': hashlib.sha256(request['workbook']).hexdigest(),
+        'image': hashlib.sha256(request['image']).hexdigest() if request['image'] else None,
+        **{key: request[key] for key in ('notes', 'budget_notes', 'kpis', 'profile', 'generate_texts')},
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def result_path(job_id, artifact):
+    """Path of the 'pdf' or 'html' file of a finished job."""
+    return os.path.join(API_RESULT_DIR, f"{job_id}.{artifact}")
+
+def _write_result(job_id, artifact, data):
+    # Written under a temporary name, so that a GET never serves half a file
+    os.makedirs(API_RESULT_DIR, exist_ok=True)
+    path = result_path(job_id, artifact)
+    with open(f"{path}.tmp", 'wb') as result_file:
+        result_file.write(data)
+    os.replace(f"{path}.tmp", path)
+
+def _expired(job):
+    # The files may also have been removed by another process sharing API_RESULT_DIR
+    return job.result['expires_at'] <= time.time() or not os.path.exists(result_path(job.id, 'pdf'))
+
+def remove_expired_results():
+    """Deletes the result files older than API_RESULT_TTL_SECONDS."""
+    try:
+        names = os.listdir(API_RESULT_DIR)
+    except FileNotFoundError:
+        return
+    cutoff = time.time() - API_RESULT_TTL_SECONDS
+    for name in names:
+        path = os.path.join(API_RESULT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _render_report(job, request):
+    """
+    Renders the PDF and the HTML of one API request and writes them to API_RESULT_DIR.
+    Runs on the API job queue; the job result only keeps the metadata.
+    """
+    from data_loader import load_financial_data
+    from html_renderer import build_preview_context, render_report_html
+    from pdf_export import pdf_from_reportlab
+    from report_model import build_report_model
+
+    job.update(0.0, "Arbeitsmappe wird gelesen...")
+    financial_data = load_financial_data(BytesIO(request['workbook']))
+    hero_image = None
+    if request['image']:
+        hero_image = prepare_hero_image(request['image'], PDF_PROFILES)
+
+    texts, errors = dict(DEFAULT_TEXTS), []
+    if request['generate_texts']:
+        texts, errors = headless_report_texts(job, request['notes'], request['budget_notes'], financial_data)
+
+    job.update(0.9, "PDF wird erstellt...")
+    report_model = build_report_model(financial_data, texts, request['kpis'])
+    _write_result(job.id, 'pdf', pdf_from_reportlab(hero_image, report_model, profile=request['profile']))
+    _write_result(job.id, 'html', render_report_html(build_preview_context(report_model, hero_image)).encode('utf-8'))
+    return {
+        'title': report_model.primary_market_area,
+        'date_range': report_model.date_range,
+        'errors': errors,
+        'expires_at': time.time() + API_RESULT_TTL_SECONDS,
+    }
+
+def submit_report(request):
+    """
+    Queues the rendering of a parsed request and returns (job, created). A request
+    equal to one that is queued, running or done returns that job instead of
+    rendering again, unless its files have expired. Raises JobQueueFull when too many
+    jobs are waiting.
+    """
+    remove_expired_results()
+    key = input_hash(request)
+    with _jobs_by_input_lock:
+        job = api_job_queue.get(_jobs_by_input.get(key))
+        if job is not None and job.status not in (FAILED, CANCELLED) and not (job.status == DONE and _expired(job)):
+            return job, False
+        # There is no session here; only PROFILING=job|all profiles API jobs
+        job = api_job_queue.submit("API-Bericht", job_function({}, _render_report, "API-Bericht"), request)
+        _jobs_by_input[key] = job.id
+        # Forget the keys of jobs the queue no longer knows
+        for stale_key in [k for k, job_id in _jobs_by_input.items() if api_job_queue.get(job_id) is None]:
+            del _jobs_by_input[stale_key]
+    return job, True
+
+def job_status(job):
+    """Returns the JSON representation of a job."""
+    status = {
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'submitted_at': job.submitted_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == DONE:
+        status.update({
+            'title': job.result['title'],
+            'date_range': job.result['date_range'],
+            'errors': job.result['errors'],
+            'expires_at': job.result['expires_at'],
+        })
+        if not _expired(job):
+            status.update({'pdf_url': f"/jobs/{job.id}/pdf", 'html_url': f"/jobs/{job.id}/html"})
+    elif job.status == FAILED:
+        status['error'] = str(job.error)
+    return status
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs            queue a report, 202 with the job (200 if it already exists)
+    GET  /jobs/<id>       status of a job
+    GET  /jobs/<id>/pdf   the PDF, once the job is done (410 after API_RESULT_TTL_SECONDS)
+    GET  /jobs/<id>/html  the HTML report, once the job is done (410 after API_RESULT_TTL_SECONDS)
+    GET  /health          queue statistics
+    GET  /metrics         stage timings in the Prometheus text format (TRACING=1)
+    """
+
+    server_version = "LeliaReportAPI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if content_type == "application/json":
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path, content_type):
+        with open(path, 'rb') as body:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.fstat(body.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(body, self.wfile)
+
+    def _send_error(self, status, message, headers=None):
+        self._send(status, {'error': message}, headers=headers)
+
+    def _authorized(self):
+        if not API_TOKEN:
+            return True
+        expected = f"Bearer {API_TOKEN}"
+        return hmac.compare_digest(self.headers.get("Authorization", "").encode(), expected.encode())
+
+    def _refuse_unread(self, status, message):
+        # The body is not read, so what is left of it would be parsed as the next
+        # request on a kept-alive connection
+        self.close_connection = True
+        self._send_error(status, message, headers={"Connection": "close"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._refuse_unread(401, "Unauthorized")
+        if self.path != "/jobs":
+            return self._refuse_unread(404, "Not found")
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self._refuse_unread(411, "Content-Length required")
+        if length < 0:
+            # rfile.read(-1) would wait until the client closes the connection
+            return self._refuse_unread(400, "Content-Length must not be negative")
+        if length > API_MAX_BODY_BYTES:
+            return self._refuse_unread(413, f"Body larger than {API_MAX_BODY_BYTES} bytes")
+
+        try:
+            request = parse_request(self.rfile.read(length))
+            job, created = submit_report(request)
+        except RequestError as e:
+            return self._send_error(e.status, str(e))
+        except JobQueueFull:
+            return self._send_error(429, "Too many reports waiting", headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+        self._send(202 if created else 200, job_status(job), headers={"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send_error(401, "Unauthorized")
+        if self.path == "/health":
+            return self._send(200, api_job_queue.stats())
+        if self.path == "/metrics":
+            return self._send(200, prometheus_metrics(), content_type="text/plain; version=0.0.4")
+
+        match = _JOB_PATH.match(self.path)
+        job = api_job_queue.get(match.group(1)) if match else None
+        if job is None:
+            return self._send_error(404, "Not found")
+
+        artifact = match.group(2)
+        if artifact is None:
+            return self._send(200, job_status(job))
+        if job.status != DONE:
+            return self._send_error(409, f"Job is {job.status}")
+        remove_expired_results()
+        try:
+            if _expired(job):
+                raise FileNotFoundError
+            self._send_file(result_path(job.id, artifact), _CONTENT_TYPES[artifact])
+        except FileNotFoundError:
+            self._send_error(410, "The report has expired; submit the request again")
+
+    def log_message(self, format, *args):
+        # Health checks and metric scrapes would drown the log
+        if self.path not in ("/health", "/metrics"):
+            super().log_message(format, *args)
+
+def is_loopback(host):
+    """Returns True if a server bound to `host` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves report generation over HTTP.")
+    parser.add_argument("--host", default=os.environ.get("API_HOST", "127.0.0.1"),
+                        help="Address to listen on; other than loopback only with REPORT_API_TOKEN set")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("API_PORT", 8502)))
+    args = parser.parse_args()
+    if not API_TOKEN and not is_loopback(args.host):
+        # Anyone reaching the port could start reports and spend the Gemini quota
+        parser.error(f"refusing to listen on {args.host} without REPORT_API_TOKEN")
+
+    remove_expired_results()
+    server = ThreadingHTTPServer((args.host, args.port), ReportRequestHandler)
+    print(f"Report API listening on {args.host}:{args.port} with {API_WORKERS} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
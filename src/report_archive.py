@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+# Set REPORT_ARCHIVE=1 to store every report a session builds a PDF of. The archive is
+# shared by the whole deployment: every logged-in user sees and opens every archived
+# report, whoever built it.
+ARCHIVE_ENABLED = os.environ.get("REPORT_ARCHIVE", "").lower() in ("1", "true", "yes")
+# SQLite file of the archive, by default in the user's data directory rather than in
+# the source tree
+ARCHIVE_PATH = os.environ.get("REPORT_ARCHIVE_PATH") or os.path.join(
+    os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "lelia-reporting", "report_archive.sqlite3",
+)
+# If set, the PDFs are written to this directory and the archive keeps their paths
+# instead of the PDF bytes
+ARCHIVE_PDF_DIR = os.environ.get("REPORT_ARCHIVE_PDF_DIR")
+
+_DATE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    input_hash TEXT NOT NULL UNIQUE,
+    market_area TEXT NOT NULL,
+    date_range TEXT NOT NULL,
+    period_start TEXT,
+    period_end TEXT,
+    profile TEXT NOT NULL,
+    archived_at REAL NOT NULL,
+    texts TEXT NOT NULL,
+    kpis TEXT NOT NULL,
+    pdf_path TEXT,
+    -- The large columns come last, so that listing the archive does not read them
+    html TEXT NOT NULL,
+    pdf BLOB
+);
+CREATE INDEX IF NOT EXISTS reports_market_area_period ON reports (market_area, period_start);
+CREATE INDEX IF NOT EXISTS reports_period ON reports (period_start);
+"""
+
+_LIST_COLUMNS = "id, input_hash, market_area, date_range, period_start, period_end, profile, archived_at, texts, kpis"
+
+# Archive files whose tables exist
+_ready_paths = set()
+_schema_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class ArchivedReport:
+    """An entry of the archive, without its HTML and PDF."""
+    id: int
+    input_hash: str
+    market_area: str
+    date_range: str
+    # ISO dates parsed from date_range, None if it is not "dd.mm.yyyy - dd.mm.yyyy"
+    period_start: str
+    period_end: str
+    profile: str
+    archived_at: float
+    texts: dict
+    kpis: dict
+
+def parse_period(date_range):
+    """Returns the first and the last date of a "dd.mm.yyyy - dd.mm.yyyy" range as ISO dates."""
+    dates = [f"{year}-{int(month):02d}-{int(day):02d}" for day, month, year in _DATE.findall(date_range or "")]
+    if not dates:
+        return None, None
+    return dates[0], dates[-1]
+
+def report_input_hash(report_model, hero_image, profile):
+    """
+    Hashes everything an archived report is derived from: the parsed financial data,
+    the texts and the KPIs (the fingerprint of the report model), the cover image and
+    the PDF profile.
+    """
+    payload = json.dumps([report_model.fingerprint, hero_image.digest if hero_image else None, profile])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _connect(path):
+    if path not in _ready_paths:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    if path not in _ready_paths:
+        with _schema_lock:
+            if path not in _ready_paths:
+                # WAL lets the sessions browse the archive while a report is written
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_SCHEMA)
+                _ready_paths.add(path)
+    return connection
+
+def _entry(row):
+    return ArchivedReport(*row[:8], texts=json.loads(row[8]), kpis=json.loads(row[9]))
+
+def archive_report(report_model, hero_image, profile, pdf, html, path=None):
+    """
+    Stores a finished report and returns its id. Archiving the same report again
+    (same input hash) replaces the entry.
+    """
+    input_hash = report_input_hash(report_model, hero_image, profile)
+    period_start, period_end = parse_period(report_model.date_range)
+    pdf_path = None
+    if ARCHIVE_PDF_DIR:
+        os.makedirs(ARCHIVE_PDF_DIR, exist_ok=True)
+        pdf_path = os.path.join(ARCHIVE_PDF_DIR, f"{input_hash}.pdf")
+        with open(pdf_path, 'wb') as pdf_file:
+            pdf_file.write(pdf)
+        pdf = None
+
+    with closing(_connect(path or ARCHIVE_PATH)) as connection, connection:
+        cursor = connection.execute(
+            """
+            INSERT INTO reports (input_hash, market_area, date_range, period_start, period_end, profile,
+                                 archived_at, texts, kpis, pdf_path, html, pdf)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (input_hash) DO UPDATE SET
+                archived_at = excluded.archived_at, pdf_path = excluded.pdf_path,
+                html = excluded.html, pdf = excluded.pdf
+            RETURNING id
+            """,
+            (
+                input_hash, report_model.primary_market_area, report_model.date_range, period_start, period_end,
+                profile, time.time(), json.dumps(dict(report_model.texts), ensure_ascii=False),
+                json.dumps(dict(report_model.kpis)), pdf_path, html, pdf,
+            ),
+        )
+        return cursor.fetchone()[0]
+
+def search_reports(market_area=None, year=None, limit=200, path=None):
+    """
+    Returns the archived reports of a property (exact market area) and/or of the
+    periods overlapping a year, newest period first.
+    """
+    conditions, parameters = [], []
+    if market_area:
+        conditions.append("market_area = ?")
+        parameters.append(market_area)
+    if year:
+        conditions.append("period_start <= ? AND period_end >= ?")
+        parameters += [f"{year}-12-31", f"{year}-01-01"]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(_connect(path or ARCHIVE_PATH)) as connection:
+        rows = connection.execute(
+            f"SELECT {_LIST_COLUMNS} FROM reports {where} ORDER BY period_start DESC, archived_at DESC LIMIT ?",
+            (*parameters, limit),
+        ).fetchall()
+    return [_entry(row) for row in rows]
+
+def archive_facets(path=None):
+    """Returns the archived market areas and the years their periods cover, for the filters."""
+    with closing(_connect(path or ARCHIVE_PATH)) as connection:
+        market_areas = [row[0] for row in connection.execute("SELECT DISTINCT market_area FROM reports ORDER BY market_area")]
+        periods = connection.execute("SELECT DISTINCT period_start, period_end FROM reports WHERE period_start IS NOT NULL").fetchall()
+    years = {year for start, end in periods for year in range(int(start[:4]), int(end[:4]) + 1)}
+    return market_areas, sorted(years, reverse=True)
+
+def load_report(report_id, path=None):
+    """
+    Returns (entry, html, pdf bytes) of an archived report, or None if it does not
+    exist. The PDF is None if its file was removed.
+    """
+    with closing(_connect(path or ARCHIVE_PATH)) as connection:
+        row = connection.execute(
+            f"SELECT {_LIST_COLUMNS}, pdf_path, html, pdf FROM reports WHERE id = ?", (report_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    pdf_path, html, pdf = row[10:]
+    if pdf_path is not None:
+        try:
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf = pdf_file.read()
+        except OSError:
+            pdf = None
+    return _entry(row), html, pdf
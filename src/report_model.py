@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from formatting import format_currency_batch
+
+logger = logging.getLogger(__name__)
+
+# Number of report models kept in the process-wide memo
+MODEL_CACHE_SIZE = 64
+
+FINANCIAL_SECTIONS = ('Erträge', 'Aufwand', 'Aktiva', 'Passiva')
+
+# Texts and KPIs of a report that is rendered without them (batch runs, the API)
+DEFAULT_TEXTS = {
+    'blockquote': "",
+    'summary': "",
+    'waterfall_explanation': "",
+    'budget': "",
+}
+DEFAULT_KPIS = {
+    'leerstand': 0.0,
+    'rendite_eigenkapital': 0.0,
+    'miete_pro_m2': 0.0,
+}
+
+@dataclass(frozen=True)
+class ReportModel:
+    """
+    Everything the HTML preview and the PDF export derive from the financial data,
+    the texts and the KPIs, computed once. Treat instances as read-only; they are
+    shared between reruns and sessions.
+    """
+    fingerprint: str
+    date_range: str
+    primary_market_area: str
+    # Section name -> tuple of (label, value, formatted value) rows
+    financial_tables: MappingProxyType
+    waterfall_x: tuple
+    waterfall_y: tuple
+    waterfall_measure: tuple
+    texts: MappingProxyType
+    kpis: MappingProxyType
+    # KPI name -> value formatted with two decimals
+    formatted_kpis: MappingProxyType
+    # Problems found while deriving the model (missing totals, header fields), for the
+    # UI to show. Part of the model so that a memoized model still reports them.
+    warnings: tuple = ()
+
+    def table(self, section):
+        """Returns the (label, value, formatted value) rows of a financial section."""
+        return self.financial_tables.get(section, ())
+
+    def table_values(self, section):
+        """Returns a financial section as a {label: value} dict."""
+        return {label: value for label, value, _ in self.table(section)}
+
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+def _get_waterfall_chart_data(full_financial_data, warnings):
+    """
+    Extracts data for a P&L waterfall chart, flowing from income to net result.
+    Problems are appended to `warnings`.
+    """
+    waterfall_x = []
+    waterfall_y = []
+    waterfall_measure = []
+
+    ertraege_data = full_financial_data.get("Erträge", {})
+    aufwand_data = full_financial_data.get("Aufwand", {})
+
+    # Define the keys for the main totals and the final result
+    POSSIBLE_ERTRAEGE_KEYS = [
+        "Erträge aus Vermietung ohne MWST",
+        "Erträge aus Vermietung",
+        "Erträge"
+    ]
+    AUFWANDE_KEY = "Aufwände"
+    FINAL_RESULT_KEY = "Abschluss Erfolgsrechnung"
+
+    # 1. Find and start with Total Income
+    ertraege_key_found = None
+    for key in POSSIBLE_ERTRAEGE_KEYS:
+        if key in ertraege_data:
+            ertraege_key_found = key
+            break
+    
+    if ertraege_key_found is None:
+        warnings.append("Could not find a valid income key in Erträge data. Cannot build waterfall chart.")
+        return [], [], []
+
+    # Ensure the starting income value is positive
+    ertraege_total_value = abs(ertraege_data[ertraege_key_found])
+    waterfall_x.append("Erträge") # Renamed label
+    waterfall_y.append(ertraege_total_value)
+    waterfall_measure.append("absolute")
+
+    # 2. Subtract main expense categories from "Aufwand"
+    if not aufwand_data:
+        warnings.append("Aufwand data not available for waterfall chart.")
+    else:
+        for key, value in aufwand_data.items():
+            # Skip the main total and the final result keys
+            if key == AUFWANDE_KEY or key == FINAL_RESULT_KEY:
+                continue
+            
+            # Only subtract main expense categories (those without a 4-digit code)
+            if not re.search(r'[0-9]{4}', key):
+                waterfall_x.append(key)
+                waterfall_y.append(-value) # Negative for breakdown
+                waterfall_measure.append("relative")
+
+    # 3. Add the final result bar
+    if FINAL_RESULT_KEY in aufwand_data:
+        final_result_value = aufwand_data[FINAL_RESULT_KEY]
+        waterfall_x.append("Gewinn") # Renamed label
+        waterfall_y.append(final_result_value)
+        waterfall_measure.append("total")
+    else:
+        warnings.append(f"'{FINAL_RESULT_KEY}' not found in Aufwand data. Waterfall chart will be incomplete.")
+
+    return waterfall_x, waterfall_y, waterfall_measure
+
+def _get_report_header(full_financial_data, warnings):
+    """
+    Returns the date range and primary market area read from the Erfolgsrechnung sheet.
+    Problems are appended to `warnings`.
+    """
+    dynamic_date_range = "Daten nicht verfügbar"
+    dynamic_primary_market_area = "Daten nicht verfügbar"
+    if "Erfolgsrechnung" in full_financial_data.sheet_names:
+        if isinstance(full_financial_data.date_range, str):
+            dynamic_date_range = full_financial_data.date_range
+        else:
+            warnings.append("Could not extract date range from Erfolgsrechnung. Using default.")
+        if isinstance(full_financial_data.primary_market_area, str):
+            dynamic_primary_market_area = full_financial_data.primary_market_area
+        else:
+            warnings.append("Could not extract primary market area from Erfolgsrechnung. Using default.")
+
+    return dynamic_date_range, dynamic_primary_market_area
+
+def _fingerprint(header, sections, texts, kpis):
+    """Hashes the inputs a report model is derived from."""
+    payload = json.dumps(
+        [header, [[name, list(values.items())] for name, values in sections], sorted(texts.items()), sorted(kpis.items())],
+        default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def build_report_model(full_financial_data, texts, kpis):
+    """
+    Returns the ReportModel for the given financial data, texts and KPIs. Models are
+    memoized by a fingerprint of their inputs, so an unchanged report is not derived
+    again on the next rerun. Does not show anything: the caller shows or logs the
+    model's `warnings`.
+    """
+    warnings = []
+    header = _get_report_header(full_financial_data, warnings)
+    sections = [(name, full_financial_data.get(name, {})) for name in FINANCIAL_SECTIONS]
+    fingerprint = _fingerprint(header, sections, texts, kpis)
+
+    with _model_cache_lock:
+        model = _model_cache.get(fingerprint)
+        if model is not None:
+            _model_cache.move_to_end(fingerprint)
+            return model
+
+    waterfall_x, waterfall_y, waterfall_measure = _get_waterfall_chart_data(full_financial_data, warnings)
+    for warning in warnings:
+        logger.warning("%s: %s", header[1], warning)
+    model = ReportModel(
+        fingerprint=fingerprint,
+        date_range=header[0],
+        primary_market_area=header[1],
+        financial_tables=MappingProxyType({
+            name: tuple(zip(values.keys(), values.values(), format_currency_batch(list(values.values()))))
+            for name, values in sections
+        }),
+        waterfall_x=tuple(waterfall_x),
+        waterfall_y=tuple(waterfall_y),
+        waterfall_measure=tuple(waterfall_measure),
+        texts=MappingProxyType(dict(texts)),
+        kpis=MappingProxyType(dict(kpis)),
+        formatted_kpis=MappingProxyType({name: f"{value:.2f}" for name, value in kpis.items()}),
+        warnings=tuple(warnings),
+    )
+
+    with _model_cache_lock:
+        _model_cache[fingerprint] = model
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
@@ -0,0 +1,200 @@
+import argparse
+import random
+from io import BytesIO
+
+from openpyxl import Workbook
+
+# Ways the exports we receive write CHF amounts; all are read by parse_iso_currency
+CURRENCY_FORMATS = (
+    lambda value: f"CHF {value:,.2f}".replace(",", "'"),
+    lambda value: f"{value:,.2f} CHF".replace(",", "'"),
+    lambda value: f"CHF {value:.2f}",
+    lambda value: f"CHF {value:,.0f}".replace(",", "'"),
+)
+
+# Category -> name of its accounts. The parsers start a section at the last cell
+# containing its title ("Erträge", "Aufwände", ...), so no other cell may contain one.
+INCOME_CATEGORIES = {"Mieteinnahmen": "Mietertrag", "Übriger Ertrag": "Nebenertrag"}
+EXPENSE_CATEGORIES = {
+    "Unterhalt": "Reparatur", "Verwaltung": "Honorar", "Versicherungen": "Prämie",
+    "Energie": "Strom", "Abschreibungen": "Abschreibung",
+}
+ASSET_CATEGORIES = {"Umlaufvermögen": "Bank", "Anlagevermögen": "Liegenschaft"}
+LIABILITY_CATEGORIES = {"Fremdkapital": "Hypothek", "Eigenkapital": "Kapital"}
+SECTION_TITLES = ("Erträge", "Aufwände", "Aktiva", "Passiva")
+# Last row of the Aufwände column: income minus expenses, the end of the waterfall chart
+FINAL_RESULT_LABEL = "Abschluss Erfolgsrechnung"
+NOISE_WORDS = ("Mieter", "Objekt", "Vertrag", "Zahlung", "Konto", "Beleg", "Periode", "Status")
+
+# Columns of one section: code or label, account name, previous year, amount. The
+# two sections of a sheet are side by side, the way the parsers read them: each
+# section runs down its own column until that column is empty.
+SECTION_COLUMNS = 4
+DATA_COLUMNS = 2 * SECTION_COLUMNS
+
+class _SheetWriter:
+    """Collects the rows of one sheet with `columns` columns; the first eight carry the data."""
+
+    def __init__(self, columns, rng, currency_share):
+        self.rows = []
+        self.columns = columns
+        self.rng = rng
+        self.currency_share = currency_share
+
+    def amount(self, value):
+        """Returns the amount as a number or, for a share of the cells, as a CHF string."""
+        if self.rng.random() < self.currency_share:
+            return self.rng.choice(CURRENCY_FORMATS)(value)
+        return value
+
+    def row(self, *cells):
+        cells = list(cells) + [None] * (DATA_COLUMNS - len(cells))
+        # Extra columns look like the budget and deviation columns of real exports
+        for _ in range(self.columns - DATA_COLUMNS):
+            cells.append(self.amount(round(self.rng.uniform(-5000, 5000), 2)) if self.rng.random() < 0.5 else None)
+        self.rows.append(cells)
+
+    def blank(self, count=1):
+        for _ in range(count):
+            self.rows.append([None] * self.columns)
+
+    def section(self, categories, first_code, rows):
+        """
+        Returns the rows of a section: the category rows, each followed by its 4-digit
+        accounts, with SECTION_COLUMNS cells each, and the section total.
+        """
+        section_rows = []
+        total = 0.0
+        per_category = max(1, rows // len(categories))
+        code = first_code
+        for category, account in categories.items():
+            amounts = [round(self.rng.uniform(100, 50000), 2) for _ in range(per_category)]
+            section_rows.append([category, None, None, round(sum(amounts), 2)])
+            for index, value in enumerate(amounts):
+                section_rows.append([str(code), f"{code} {account} {index + 1}", self.amount(round(value * 0.95, 2)), self.amount(value)])
+                code += 1
+            total += sum(amounts)
+        return section_rows, round(total, 2)
+
+    def side_by_side(self, left, right):
+        """Writes two sections next to each other; the shorter one ends with empty cells."""
+        empty = [None] * SECTION_COLUMNS
+        for index in range(max(len(left), len(right))):
+            cells = [(section[index] if index < len(section) else []) + empty for section in (left, right)]
+            self.row(*cells[0][:SECTION_COLUMNS], *cells[1][:SECTION_COLUMNS])
+
+def _amount_rows(section_rows):
+    """Number of rows of a section the parsers read: those with an amount."""
+    return sum(1 for row in section_rows if len(row) > 3 and row[3] is not None)
+
+def _erfolgsrechnung(writer, rows, date_range, market_area):
+    writer.row(None, "Erfolgsrechnung")
+    writer.row(None, date_range)
+    writer.row(None, market_area)
+    writer.blank()
+
+    # Rows are split evenly between income and expenses
+    income_rows, income = writer.section(INCOME_CATEGORIES, 3000, rows // 2)
+    expense_rows, expenses = writer.section(EXPENSE_CATEGORIES, 4000, rows - rows // 2)
+    income_rows = [["Erträge", None, None, writer.amount(income)]] + income_rows
+    expense_rows = [["Aufwände", None, None, expenses]] + expense_rows + [[FINAL_RESULT_LABEL, None, None, round(income - expenses, 2)]]
+    writer.side_by_side(income_rows, expense_rows)
+    return {"Erträge": _amount_rows(income_rows), "Aufwand": _amount_rows(expense_rows)}
+
+def _bilanz(writer, rows):
+    writer.blank(2)
+    asset_rows, _ = writer.section(ASSET_CATEGORIES, 1000, rows // 2)
+    liability_rows, _ = writer.section(LIABILITY_CATEGORIES, 2000, rows - rows // 2)
+    writer.side_by_side([["Aktiva"]] + asset_rows, [["Passiva"]] + liability_rows)
+    return {"Aktiva": _amount_rows(asset_rows), "Passiva": _amount_rows(liability_rows)}
+
+def _noise_sheet(writer, rows):
+    for _ in range(rows):
+        writer.row(*(
+            f"{writer.rng.choice(NOISE_WORDS)} {writer.rng.randint(1, 9999)}" if writer.rng.random() < 0.6
+            else writer.amount(round(writer.rng.uniform(0, 10000), 2))
+            for _ in range(5)
+        ))
+
+def check_sections(data, expected):
+    """
+    Parses the Bilanz and the Erfolgsrechnung of a workbook with the app's parsers and
+    raises ValueError unless every section has the expected number of rows and the
+    Aufwand ends with the final result (Erträge minus Aufwände).
+    """
+    import pandas as pd
+    from data_loader import _process_dataframe, parse_bilanz, parse_erfolgsrechnung
+    xls = pd.ExcelFile(BytesIO(data))
+    ertraege, aufwand = parse_erfolgsrechnung(_process_dataframe(pd.read_excel(xls, "Erfolgsrechnung", header=None)))
+    aktiva, passiva = parse_bilanz(_process_dataframe(pd.read_excel(xls, "Bilanz", header=None)))
+    parsed = {"Erträge": len(ertraege), "Aufwand": len(aufwand), "Aktiva": len(aktiva), "Passiva": len(passiva)}
+    if parsed != expected:
+        raise ValueError(f"The workbook parses into {parsed} section rows instead of {expected}")
+    final_result = aufwand.get(FINAL_RESULT_LABEL)
+    if final_result is None or abs(final_result - (ertraege["Erträge"] - aufwand["Aufwände"])) > 0.01:
+        raise ValueError(f"The Aufwand has no '{FINAL_RESULT_LABEL}' row with Erträge minus Aufwände")
+
+def generate_workbook(rows=40, columns=DATA_COLUMNS, noise_sheets=1, noise_rows=None, currency_share=0.3, seed=0,
+                      market_area="Synthetisch", date_range="01.01.2025 - 31.12.2025", check=True):
+    """
+    Returns the bytes of a synthetic "Bilanz"/"Erfolgsrechnung" workbook laid out like
+    the exports the app reads: the two sections of each sheet side by side, each with
+    category rows followed by 4-digit accounts and the amount in its fourth column,
+    the final result below the Aufwände and the header cells on top of the
+    Erfolgsrechnung.
+
+    `rows` is the number of accounts per sheet and `columns` the width of the sheets
+    (at least DATA_COLUMNS; the extra columns are filled with noise). `currency_share`
+    is the share of amounts written as CHF strings in one of CURRENCY_FORMATS instead
+    of numbers. `noise_sheets` sheets with `noise_rows` rows (default: `rows`) of
+    unrelated data are added. The same arguments always give the same workbook. With
+    `check`, the workbook is parsed back and ValueError is raised unless every section
+    comes out with the rows written to it and with the final result.
+    """
+    if columns < DATA_COLUMNS:
+        raise ValueError(f"A workbook needs at least {DATA_COLUMNS} columns")
+    rng = random.Random(seed)
+
+    sheets = []
+    writer = _SheetWriter(columns, rng, currency_share)
+    expected = _erfolgsrechnung(writer, rows, date_range, market_area)
+    sheets.append(("Erfolgsrechnung", writer.rows))
+    writer = _SheetWriter(columns, rng, currency_share)
+    expected.update(_bilanz(writer, rows))
+    sheets.append(("Bilanz", writer.rows))
+    for index in range(noise_sheets):
+        writer = _SheetWriter(columns, rng, currency_share)
+        _noise_sheet(writer, rows if noise_rows is None else noise_rows)
+        sheets.append((f"Daten {index + 1}", writer.rows))
+
+    workbook = Workbook(write_only=True)
+    for title, sheet_rows in sheets:
+        sheet = workbook.create_sheet(title)
+        for row in sheet_rows:
+            sheet.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    data = buffer.getvalue()
+    if check:
+        check_sections(data, expected)
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic Bilanz/Erfolgsrechnung workbook.")
+    parser.add_argument("output", help="Path of the .xlsx file")
+    parser.add_argument("--rows", type=int, default=40, help="Accounts per sheet")
+    parser.add_argument("--columns", type=int, default=DATA_COLUMNS)
+    parser.add_argument("--noise-sheets", type=int, default=1)
+    parser.add_argument("--currency-share", type=float, default=0.3, help="Share of amounts written as CHF strings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--market-area", default="Synthetisch")
+    args = parser.parse_args()
+
+    data = generate_workbook(args.rows, args.columns, args.noise_sheets, currency_share=args.currency_share,
+                             seed=args.seed, market_area=args.market_area)
+    with open(args.output, 'wb') as out_file:
+        out_file.write(data)
+    print(f"{args.output}: {len(data) / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Set TRACING=1 to record how long each stage of a rerun or a background job takes.
+# When it is off, `trace` and `span` return a shared no-op context manager.
+TRACING_ENABLED = os.environ.get("TRACING", "").lower() in ("1", "true", "yes")
+# If set, every finished trace is appended to this file as one JSON line
+TRACE_LOG = os.environ.get("TRACE_LOG")
+# Number of finished traces kept in memory, across all sessions
+TRACE_HISTORY_SIZE = 200
+# Upper bounds (seconds) of the histogram buckets of the Prometheus export
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DISABLED = nullcontext()
+
+_current_trace = ContextVar("current_trace", default=None)
+
+_traces = deque(maxlen=TRACE_HISTORY_SIZE)
+# Span name -> {'count', 'sum', 'errors', 'buckets'}, aggregated over all traces
+_span_stats = {}
+_lock = threading.Lock()
+
+class Trace:
+    """The spans recorded during one rerun or one background job."""
+
+    __slots__ = ('id', 'name', 'session', 'parent_id', 'started_at', 'duration_ms', 'spans', '_start', '_depth')
+
+    def __init__(self, name, session=None, parent_id=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.session = session
+        self.parent_id = parent_id
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self._start = time.perf_counter()
+        self._depth = 0
+
+    def to_dict(self):
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'session': self.session,
+            'parent_id': self.parent_id,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'spans': self.spans,
+        }
+
+def streamlit_session_id():
+    """Returns the id of the Streamlit session running the current script, or None."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+def current_trace():
+    """Returns the trace of the running rerun or job, or None."""
+    return _current_trace.get()
+
+def _record(name, seconds, failed):
+    with _lock:
+        stats = _span_stats.get(name)
+        if stats is None:
+            stats = _span_stats[name] = {'count': 0, 'sum': 0.0, 'errors': 0, 'buckets': [0] * len(HISTOGRAM_BUCKETS)}
+        stats['count'] += 1
+        stats['sum'] += seconds
+        stats['errors'] += failed
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                stats['buckets'][index] += 1
+
+@contextmanager
+def _span(trace_, name, attributes):
+    start = time.perf_counter()
+    depth = trace_._depth
+    trace_._depth += 1
+    error = None
+    try:
+        yield
+    except Exception as e:
+        # st.rerun() and st.stop() raise BaseExceptions; they are not failures
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        trace_._depth = depth
+        span = {
+            'name': name,
+            'start_ms': (start - trace_._start) * 1000,
+            'duration_ms': seconds * 1000,
+            'depth': depth,
+        }
+        if attributes:
+            span['attributes'] = attributes
+        if error is not None:
+            span['error'] = error
+        trace_.spans.append(span)
+        _record(name, seconds, error is not None)
+
+@contextmanager
+def _trace(name, session, parent):
+    trace_ = Trace(name, session if session is not None else getattr(parent, 'session', None), getattr(parent, 'id', None))
+    token = _current_trace.set(trace_)
+    try:
+        with _span(trace_, name, None):
+            yield trace_
+    finally:
+        _current_trace.reset(token)
+        trace_.duration_ms = (time.perf_counter() - trace_._start) * 1000
+        # Spans are appended when they end; the timeline reads them in start order
+        trace_.spans.sort(key=lambda span: span['start_ms'])
+        with _lock:
+            _traces.append(trace_)
+            if TRACE_LOG:
+                with open(TRACE_LOG, 'a', encoding='utf-8') as log_file:
+                    log_file.write(json.dumps(trace_.to_dict(), ensure_ascii=False) + "\n")
+
+def trace(name, session=None, parent=None):
+    """
+    Starts a trace for a rerun or a job, unless one is already running, in which case
+    this is a span of it. A job passes the trace that submitted it as `parent`, so
+    that it is linked to it and belongs to the same session.
+    """
+    if not TRACING_ENABLED:
+        return _DISABLED
+    if _current_trace.get() is not None:
+        return _span(_current_trace.get(), name, None)
+    return _trace(name, session, parent)
+
+def span(name, **attributes):
+    """Times a stage within the running trace. Outside of a trace it does nothing."""
+    if not TRACING_ENABLED:
+        return _DISABLED
+    trace_ = _current_trace.get()
+    if trace_ is None:
+        return _DISABLED
+    return _span(trace_, name, attributes)
+
+def recent_traces(session=None, limit=None):
+    """Returns the finished traces, newest first, optionally only those of one session."""
+    with _lock:
+        traces = [trace_ for trace_ in reversed(_traces) if session is None or trace_.session == session]
+    return traces[:limit] if limit else traces
+
+def traces_to_jsonl(traces):
+    """Returns the traces as JSON lines, one trace per line."""
+    return "".join(json.dumps(trace_.to_dict(), ensure_ascii=False) + "\n" for trace_ in traces)
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_metrics():
+    """Returns the span statistics of this process in the Prometheus text format."""
+    with _lock:
+        stats = {name: dict(values, buckets=list(values['buckets'])) for name, values in _span_stats.items()}
+        trace_count = len(_traces)
+
+    lines = [
+        "# HELP report_span_seconds Duration of the stages of report reruns and jobs.",
+        "# TYPE report_span_seconds histogram",
+    ]
+    for name, values in sorted(stats.items()):
+        label = _label(name)
+        for bound, count in zip(HISTOGRAM_BUCKETS, values['buckets']):
+            lines.append(f'report_span_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+        lines.append(f'report_span_seconds_bucket{{span="{label}",le="+Inf"}} {values["count"]}')
+        lines.append(f'report_span_seconds_sum{{span="{label}"}} {values["sum"]:.6f}')
+        lines.append(f'report_span_seconds_count{{span="{label}"}} {values["count"]}')
+    lines += [
+        "# HELP report_span_errors_total Stages that ended with an exception.",
+        "# TYPE report_span_errors_total counter",
+    ]
+    for name, values in sorted(stats.items()):
+        lines.append(f'report_span_errors_total{{span="{_label(name)}"}} {values["errors"]}')
+    lines += [
+        "# HELP report_traces_kept Finished traces kept in memory.",
+        "# TYPE report_traces_kept gauge",
+        f"report_traces_kept {trace_count}",
+    ]
+    return "\n".join(lines) + "\n"
@@ -1,512 +1,301 @@
 import streamlit as st
 import pandas as pd
-import plotly.io as pio
-from jinja2 import Environment, FileSystemLoader
-import os
-import base64
-import locale
+import logging
+import sqlite3
 from datetime import datetime
-from visualizations import create_waterfall_chart
-import markdown
-import re
-from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.lib.pagesizes import landscape, A4
-import tempfile
-
-# --- Kaleido Configuration for Heroku ---
-# For robust deployment on Heroku, we explicitly configure Kaleido to use the
-# Chromium executable provided by the Google Chrome buildpack.
-
-# The heroku-buildpack-chrome-for-testing buildpack automatically sets the
-# GOOGLE_CHROME_BIN environment variable to the path of the executable.
-chrome_path = os.environ.get("GOOGLE_CHROME_BIN")
-
-if chrome_path:
-    # For Plotly v6+, the Kaleido configuration has moved to `pio.defaults`.
-    # 1. Set the path to the executable provided by the buildpack.
-    pio.defaults.kaleido.executable = chrome_path
-    
-    # 2. Add mandatory flags for running in a containerized environment.
-    # --no-sandbox: Essential for Heroku/Docker.
-    # --disable-dev-shm-usage: Prevents out-of-memory errors by using /tmp.
-    pio.defaults.kaleido.chrome_args = ["--no-sandbox", "--disable-dev-shm-usage"]
-
-
-def image_to_base64(path):
-    """Converts an image file to a Base64 string."""
-    try:
-        with open(path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        return None
-
-def format_currency(value):
-    """Formats a number as CHF currency."""
-    try:
-        locale.setlocale(locale.LC_ALL, 'de_CH.UTF-8')
-        return locale.currency(float(value), grouping=True, symbol='CHF')
-    except (ValueError, TypeError):
-        return value
+from visualizations import create_trace_timeline
+from data_loader import WorkbookEvicted
+from report_model import build_report_model
+from images import PDF_PROFILES, DEFAULT_PDF_PROFILE
+from html_renderer import build_preview_context, render_preview_html, render_report_html, get_css, PREVIEW_MAX_BYTES, PREVIEW_CHART, TRUNCATED_TABLES
+from jobs import job_queue, JobQueueFull, QUEUED, DONE, FAILED
+from blob_store import blob_store_stats
+from memory_usage import session_memory_report, legacy_financial_data_size
+from tracing import span, trace, streamlit_session_id, recent_traces, traces_to_jsonl, prometheus_metrics
+from profiling import RERUN, JOB, ARMED_KEY, recent_captures, job_function
+from report_archive import ARCHIVE_ENABLED, archive_report, archive_facets, search_reports, load_report
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of a running background job
+JOB_POLL_INTERVAL = 1.0
+
+def _session_texts_and_kpis():
+    """Collects the report texts and KPIs from the Streamlit session state."""
+    texts = {
+        'blockquote': st.session_state.get('generated_blockquote', "..."),
+        'summary': st.session_state.generated_summary,
+        'waterfall_explanation': st.session_state.waterfall_explanation,
+        'budget': st.session_state.generated_budget,
+    }
+    kpis = {
+        'leerstand': st.session_state.leerstand,
+        'rendite_eigenkapital': st.session_state.rendite_eigenkapital,
+        'miete_pro_m2': st.session_state.miete_pro_m2,
+    }
+    return texts, kpis
 
-def _get_waterfall_chart_data(full_financial_data):
+def display_html_report(report_title, hero_image, full_financial_data):
     """
-    Extracts data for a P&L waterfall chart, flowing from income to net result.
+    Displays the HTML report. `hero_image` is the HeroImage prepared from the upload.
     """
-    waterfall_x = []
-    waterfall_y = []
-    waterfall_measure = []
-
-    ertraege_data = full_financial_data.get("Erträge", {})
-    aufwand_data = full_financial_data.get("Aufwand", {})
-
-    # Define the keys for the main totals and the final result
-    POSSIBLE_ERTRAEGE_KEYS = [
-        "Erträge aus Vermietung ohne MWST",
-        "Erträge aus Vermietung",
-        "Erträge"
-    ]
-    AUFWANDE_KEY = "Aufwände"
-    FINAL_RESULT_KEY = "Abschluss Erfolgsrechnung"
-
-    # 1. Find and start with Total Income
-    ertraege_key_found = None
-    for key in POSSIBLE_ERTRAEGE_KEYS:
-        if key in ertraege_data:
-            ertraege_key_found = key
-            break
-    
-    if ertraege_key_found is None:
-        st.warning(f"Could not find a valid income key in Erträge data. Cannot build waterfall chart.")
-        return [], [], []
-
-    # Ensure the starting income value is positive
-    ertraege_total_value = abs(ertraege_data[ertraege_key_found])
-    waterfall_x.append("Erträge") # Renamed label
-    waterfall_y.append(ertraege_total_value)
-    waterfall_measure.append("absolute")
+    # --- Report Model (derived once for the preview and the PDF) ---
+    texts, kpis = _session_texts_and_kpis()
+    with span("build_report_model"):
+        report_model = build_report_model(full_financial_data, texts, kpis)
+    for warning in report_model.warnings:
+        st.warning(warning)
+
+    if get_css() is None:
+        st.warning("tailwind.css not found.")
 
-    # 2. Subtract main expense categories from "Aufwand"
-    if not aufwand_data:
-        st.warning("Aufwand data not available for waterfall chart.")
-    else:
-        for key, value in aufwand_data.items():
-            # Skip the main total and the final result keys
-            if key == AUFWANDE_KEY or key == FINAL_RESULT_KEY:
-                continue
-            
-            # Only subtract main expense categories (those without a 4-digit code)
-            if not re.search(r'[0-9]{4}', key):
-                waterfall_x.append(key)
-                waterfall_y.append(-value) # Negative for breakdown
-                waterfall_measure.append("relative")
+    with span("preview_context", chart=PREVIEW_CHART):
+        report_context = build_preview_context(report_model, hero_image)
 
-    # 3. Add the final result bar
-    if FINAL_RESULT_KEY in aufwand_data:
-        final_result_value = aufwand_data[FINAL_RESULT_KEY]
-        waterfall_x.append("Gewinn") # Renamed label
-        waterfall_y.append(final_result_value)
-        waterfall_measure.append("total")
+    with span("render_preview_html"):
+        html_content, payload_size, dropped_assets = render_preview_html(report_context)
+    if html_content is None:
+        st.error(f"Die Vorschau ist mit {payload_size / 1024:.0f} KB grösser als das Limit von {PREVIEW_MAX_BYTES / 1024:.0f} KB.")
     else:
-        st.warning(f"'{FINAL_RESULT_KEY}' not found in Aufwand data. Waterfall chart will be incomplete.")
+        dropped_images = [asset for asset in dropped_assets if asset != TRUNCATED_TABLES]
+        if dropped_images:
+            st.warning(f"Die Vorschau enthält wegen des Grössenlimits keine Bilder ({', '.join(dropped_images)}).")
+        if TRUNCATED_TABLES in dropped_assets:
+            st.info("Die Finanztabellen sind in der Vorschau wegen des Grössenlimits gekürzt. Das PDF enthält alle Zeilen.")
+        st.components.v1.html(html_content, height=800, scrolling=True)
+        st.caption(f"Vorschau: {payload_size / 1024:.0f} KB von {PREVIEW_MAX_BYTES / 1024:.0f} KB")
 
-    return waterfall_x, waterfall_y, waterfall_measure
+    display_pdf_download(hero_image, report_model)
 
-def _create_financial_table(data_dict, headers, table_width, styles):
-    """Creates a styled ReportLab table from a financial data dictionary."""
-    table_data = []
-    
-    # Prepare header row with Paragraphs
-    header_row = [Paragraph(headers[0], styles['TableHeaderLeft']), Paragraph(headers[1], styles['TableHeaderRight'])]
-    table_data.append(header_row)
+def display_memory_report():
+    """
+    Shows what the session keeps in memory and how much the compact financial data
+    saves compared to keeping string copies of the sheets.
+    """
+    rows = session_memory_report(st.session_state)
+    st.dataframe(pd.DataFrame(rows, columns=["Eintrag", "Bytes"]), hide_index=True)
+    st.caption(f"Sitzung gesamt: {sum(size for _, size in rows) / 1024:.0f} KB")
 
-    for key, value in data_dict.items():
-        formatted_value = format_currency(value)
-        
-        # Condition for bolding: if the key does NOT contain a sequence of four digits
-        is_bold = not bool(re.search(r'[0-9]{4}', key))
-        
-        # Special condition for "Abschluss Erfolgsrechnung"
-        if key == "Abschluss Erfolgsrechnung":
-            key_paragraph = Paragraph(key, styles['OrangeBodyBoldSmallLeft'])
-            value_paragraph = Paragraph(formatted_value, styles['OrangeBodyBoldSmallRight'])
-        elif is_bold:
-            key_paragraph = Paragraph(key, styles['BodyBoldSmallLeft'])
-            value_paragraph = Paragraph(formatted_value, styles['BodyBoldSmallRight'])
+    financial_data = st.session_state.get('full_financial_data')
+    if financial_data is not None:
+        lean_size = financial_data.memory_usage()
+        try:
+            legacy_size = legacy_financial_data_size(financial_data)
+        except WorkbookEvicted as e:
+            st.info(str(e))
         else:
-            key_paragraph = Paragraph(key, styles['BodySmallLeft'])
-            value_paragraph = Paragraph(formatted_value, styles['BodySmallRight'])
-        
-        table_data.append([key_paragraph, value_paragraph])
-    
-    col_widths = [table_width * 0.66, table_width * 0.34]
-    
-    table = Table(table_data, colWidths=col_widths)
-    style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.white), # Entire table background white
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('LEFTPADDING', (0, 1), (-1, -1), 2),
-        ('RIGHTPADDING', (0, 1), (-1, -1), 2),
-        ('TOPPADDING', (0, 1), (-1, -1), 2),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 2),
-        ('LINEBELOW', (0,0), (-1,0), 1, colors.black), # Line below header
-    ])
-    table.setStyle(style)
-    return table
-
-def _add_page_footer(canvas, doc, logo_path):
-    """Adds a footer with logo and page number to each page."""
-    canvas.saveState()
-    
-    # Draw separator line
-    line_y = doc.bottomMargin + 0.1 * inch
-    canvas.setStrokeColorRGB(0, 0, 0)
-    canvas.line(doc.leftMargin, line_y, doc.width + doc.leftMargin, line_y)
-
-    # Draw logo on the left, below the line
-    if os.path.exists(logo_path):
-        canvas.drawImage(logo_path, doc.leftMargin, 0.1 * inch, width=0.6*inch, height=0.6*inch, preserveAspectRatio=True, mask='auto')
-
-    # Draw page number on the right
-    canvas.setFont('Helvetica', 9)
-    page_number_text = f"Seite {doc.page}"
-    canvas.drawRightString(doc.width + doc.leftMargin, 0.2 * inch, page_number_text)
-    
-    canvas.restoreState()
-
-def markdown_to_flowables(md_text, styles):
-    """Converts a markdown string to a list of ReportLab Flowables."""
-    flowables = []
-    for line in md_text.split('\n'):
-        line = line.strip()
-        if line.startswith('- '):
-            # Use the existing 'Bullet' style and remove the markdown character
-            flowables.append(Paragraph(line[2:], styles['Bullet']))
-        elif line.startswith('**') and line.endswith('**'):
-            # Use <b> tags for bold
-            flowables.append(Paragraph(f"<b>{line[2:-2]}</b>", styles['Body']))
-        elif line.startswith('*') and line.endswith('*'):
-            # Use <i> tags for italic
-            flowables.append(Paragraph(f"<i>{line[1:-1]}</i>", styles['Body']))
-        elif line: # Handle non-empty lines
-            flowables.append(Paragraph(line, styles['Body']))
-    return flowables
-
-def pdf_from_reportlab(image_file, full_financial_data, dynamic_date_range, dynamic_primary_market_area):
-    """Generates a PDF report using ReportLab."""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), rightMargin=inch/2, leftMargin=inch/2, topMargin=inch/2, bottomMargin=inch/2)
-    
-    styles = getSampleStyleSheet()
-    
-    # Define LeliaOrange
-    LeliaOrange = colors.HexColor('#ff6b00')
-
-    # Modify existing Title style
-    styles['Title'].fontName = 'Helvetica-Bold'
-    styles['Title'].fontSize = 24
-    styles['Title'].alignment = TA_CENTER
-    styles['Title'].spaceAfter = 14
-
-    # Add custom styles
-    styles.add(ParagraphStyle(name='Date', fontName='Helvetica', fontSize=12, alignment=TA_CENTER, spaceAfter=20))
-    styles.add(ParagraphStyle(name='H1', fontName='Helvetica-Bold', fontSize=18, spaceBefore=20, spaceAfter=10))
-    styles.add(ParagraphStyle(name='H2', fontName='Helvetica-Bold', fontSize=14, spaceBefore=10, spaceAfter=5))
-    styles.add(ParagraphStyle(name='Body', fontName='Helvetica', fontSize=10, leading=14))
-    styles.add(ParagraphStyle(name='Quote', fontName='Helvetica-BoldOblique', fontSize=12, leading=14, leftIndent=20, rightIndent=20, spaceBefore=10, spaceAfter=10))
-    
-    # New styles for financial tables
-    styles.add(ParagraphStyle(name='BodySmallLeft', fontName='Helvetica', fontSize=8, leading=10, alignment=TA_LEFT))
-    styles.add(ParagraphStyle(name='BodyBoldSmallLeft', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_LEFT))
-    styles.add(ParagraphStyle(name='BodySmallRight', fontName='Helvetica', fontSize=8, leading=10, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='BodyBoldSmallRight', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='TableHeaderLeft', fontName='Helvetica-Bold', fontSize=10, textColor=LeliaOrange, alignment=TA_LEFT))
-    styles.add(ParagraphStyle(name='TableHeaderRight', fontName='Helvetica-Bold', fontSize=10, textColor=LeliaOrange, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='KpiValue', fontName='Helvetica-Bold', fontSize=24, textColor=LeliaOrange, alignment=TA_LEFT))
-    styles.add(ParagraphStyle(name='KpiTitle', fontName='Helvetica', fontSize=10, alignment=TA_LEFT, spaceBefore=10))
-    styles.add(ParagraphStyle(name='OrangeBodyBoldSmallLeft', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_LEFT, textColor=LeliaOrange))
-    styles.add(ParagraphStyle(name='OrangeBodyBoldSmallRight', fontName='Helvetica-Bold', fontSize=8, leading=10, alignment=TA_RIGHT, textColor=LeliaOrange))
-
-
-    story = []
-    chart_filename = None
-    hero_image_path = None
-
-    try:
-        # --- Robust Path Construction ---
-        script_dir = os.path.dirname(__file__)
-        templates_dir = os.path.abspath(os.path.join(script_dir, '..', 'templates'))
-        logo_path = os.path.join(templates_dir, 'LELIA_LOGO_L_O.png')
-
-        # --- Title Page ---
-        if os.path.exists(logo_path):
-            logo = Image(logo_path, width=3*inch, height=1.5*inch)
-            logo.hAlign = 'CENTER'
-            story.append(logo)
-            story.append(Spacer(1, 0.25*inch))
-
-        story.append(Paragraph(dynamic_primary_market_area, styles['Title'])) # Use dynamic_primary_market_area as the main title
-        story.append(Paragraph(dynamic_date_range, styles['Date']))
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_image:
-            tmp_image.write(image_file.getvalue())
-            hero_image_path = tmp_image.name
-        
-        hero_image = Image(hero_image_path, width=7*inch, height=3.75*inch)
-        hero_image.hAlign = 'CENTER'
-        story.append(hero_image)
-        story.append(PageBreak())
-
-        # --- Executive Summary & KPIs ---
-        story.append(Paragraph("Zusammenfassung & KPIs", styles['H1']))
-        story.append(Spacer(1, 0.2*inch))
-
-        # Create KPI column
-        kpi_story = []
-        kpi_story.append(Paragraph("Leerstand (%)", styles['KpiTitle']))
-        kpi_story.append(Paragraph(f"{st.session_state.leerstand:.2f}%", styles['KpiValue']))
-        kpi_story.append(Spacer(1, 0.2*inch))
-        kpi_story.append(Paragraph("Rendite auf Eigenkapital (%)", styles['KpiTitle']))
-        kpi_story.append(Paragraph(f"{st.session_state.rendite_eigenkapital:.2f}%", styles['KpiValue']))
-        kpi_story.append(Spacer(1, 0.2*inch))
-        kpi_story.append(Paragraph("Durschnittliche Miete pro m2 (CHF)", styles['KpiTitle']))
-        kpi_story.append(Paragraph(f"{st.session_state.miete_pro_m2:.2f}", styles['KpiValue']))
-
-        # Create Summary column
-        summary_story = []
-        summary_story.append(Paragraph(st.session_state.get('generated_blockquote', "..."), styles['Quote']))
-        summary_story.append(Spacer(1, 0.2*inch))
-        summary_story.extend(markdown_to_flowables(st.session_state.generated_summary, styles))
-
-        # Combine into a two-column table
-        summary_table_data = [[summary_story, kpi_story]]
-        summary_table = Table(summary_table_data, colWidths=[doc.width * 0.7, doc.width * 0.3])
-        summary_table.setStyle(TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ]))
-        story.append(summary_table)
-        story.append(Spacer(1, 0.25*inch))
-
-
-        # --- Financial Tables ---
-        ertraege_data = full_financial_data.get('Erträge', {})
-        aufwand_data = full_financial_data.get('Aufwand', {})
-        aktiva_data = full_financial_data.get('Aktiva', {})
-        passiva_data = full_financial_data.get('Passiva', {})
-
-        # Calculate available width for two tables side-by-side
-        available_width = doc.width # This is the content width of the page
-        table_half_width = (available_width - 0.25*inch) / 2 # Subtract some space for gap between tables
-
-        # --- Erfolgsrechnung Section ---
-        story.append(PageBreak())
-        story.append(Paragraph("Erfolgsrechnung", styles['H1']))
-        story.append(Spacer(1, 0.2*inch)) # Added spacer
-
-        # Create individual tables with calculated widths
-        ertraege_table = _create_financial_table(ertraege_data, ['Beschreibung', 'Betrag (CHF)'], table_half_width, styles)
-        aufwand_table = _create_financial_table(aufwand_data, ['Beschreibung', 'Betrag (CHF)'], table_half_width, styles)
-
-        # Create a table to hold the H2 titles
-        h2_titles_data_erfolgsrechnung = [
-            [Paragraph("Erträge", styles['H2']), Paragraph("Aufwand", styles['H2'])]
-        ]
-        h2_titles_table_erfolgsrechnung = Table(h2_titles_data_erfolgsrechnung, colWidths=[table_half_width, table_half_width])
-        h2_titles_table_erfolgsrechnung.setStyle(TableStyle([
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (0,0), 0),
-            ('RIGHTPADDING', (0,0), (0,0), 0),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-            ('TOPPADDING', (0,0), (-1,-1), 0),
-        ]))
-        story.append(h2_titles_table_erfolgsrechnung)
-        story.append(Spacer(1, 0.1*inch)) # Small spacer between H2 titles and tables
-
-        # Create a table to hold the two financial tables side-by-side
-        combined_erfolgsrechnung_data = [[ertraege_table, aufwand_table]]
-        combined_erfolgsrechnung_table = Table(combined_erfolgsrechnung_data, colWidths=[table_half_width, table_half_width])
-        combined_erfolgsrechnung_table.setStyle(TableStyle([ # Corrected variable name
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (0,0), 0),
-            ('RIGHTPADDING', (0,0), (0,0), 0),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-            ('TOPPADDING', (0,0), (-1,-1), 0),
-        ]))
-        story.append(combined_erfolgsrechnung_table) # Corrected variable name
-        story.append(Spacer(1, 0.25*inch))
-
-        # --- Bilanz Section ---
-        story.append(PageBreak())
-        story.append(Paragraph("Bilanz", styles['H1']))
-        story.append(Spacer(1, 0.2*inch)) # Added spacer
-
-        aktiva_table = _create_financial_table(aktiva_data, ['Konto', 'Betrag (CHF)'], table_half_width, styles)
-        passiva_table = _create_financial_table(passiva_data, ['Konto', 'Betrag (CHF)'], table_half_width, styles)
-
-        h2_titles_data_bilanz = [
-            [Paragraph("Aktiva", styles['H2']), Paragraph("Passiva", styles['H2'])]
-        ]
-        h2_titles_table_bilanz = Table(h2_titles_data_bilanz, colWidths=[table_half_width, table_half_width])
-        h2_titles_table_bilanz.setStyle(TableStyle([
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (0,0), 0),
-            ('RIGHTPADDING', (0,0), (0,0), 0),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-            ('TOPPADDING', (0,0), (-1,-1), 0),
-        ]))
-        story.append(h2_titles_table_bilanz)
-        story.append(Spacer(1, 0.1*inch))
-
-        combined_bilanz_data = [[aktiva_table, passiva_table]]
-        combined_bilanz_table = Table(combined_bilanz_data, colWidths=[table_half_width, table_half_width])
-        combined_bilanz_table.setStyle(TableStyle([
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (0,0), 0),
-            ('RIGHTPADDING', (0,0), (0,0), 0),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-            ('TOPPADDING', (0,0), (-1,-1), 0),
-        ]))
-        story.append(combined_bilanz_table)
-        story.append(Spacer(1, 0.25*inch))
-
-        # --- Waterfall Chart ---
-        story.append(PageBreak())
-        story.append(Paragraph("Finanzanalyse", styles['H1']))
-        waterfall_x, waterfall_y, waterfall_measure = _get_waterfall_chart_data(full_financial_data)
-        waterfall_fig = create_waterfall_chart(waterfall_x, waterfall_y, waterfall_measure)
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_chart:
-            chart_filename = tmp_chart.name
-            waterfall_fig.write_image(chart_filename, scale=2)
-        
-        chart_image = Image(chart_filename, width=7*inch, height=4*inch)
-        chart_image.hAlign = 'CENTER'
-        story.append(chart_image)
-        story.append(Spacer(1, 0.25*inch))
-        story.append(Paragraph("Detaillierte Erklärung", styles['H2']))
-        story.extend(markdown_to_flowables(st.session_state.waterfall_explanation, styles))
-
-        # --- Budget Proposal ---
-        story.append(PageBreak())
-        story.append(Paragraph("Budgetvorschlag für das kommende Jahr", styles['H1']))
-        story.append(Spacer(1, 0.2*inch)) # Added spacer
-        story.extend(markdown_to_flowables(st.session_state.generated_budget, styles))
-
-        doc.build(story, onFirstPage=lambda c, d: None, onLaterPages=lambda c, d: _add_page_footer(c, d, logo_path))
-    finally:
-        # Clean up temporary files
-        if hero_image_path and os.path.exists(hero_image_path):
-            os.remove(hero_image_path)
-        if chart_filename and os.path.exists(chart_filename):
-            os.remove(chart_filename)
+            st.metric(
+                "Finanzdaten",
+                f"{lean_size / 1024:.1f} KB",
+                delta=f"{(lean_size - legacy_size) / 1024:.1f} KB gegenüber Tabellenkopien ({legacy_size / 1024:.1f} KB)",
+                delta_color="inverse",
+            )
 
-    buffer.seek(0)
-    return buffer.getvalue()
+    stats = blob_store_stats()
+    st.caption(f"Geteilte Uploads (alle Sitzungen): {stats['blobs']} Dateien, {stats['bytes'] / 1024:.0f} KB von {stats['max_bytes'] / 1024 / 1024:.0f} MB")
 
+def show_job_status(job):
+    """
+    Shows the progress of a background job with a button to cancel it, and the load
+    of the job queue.
+    """
+    stats = job_queue.stats()
+    if job.status == QUEUED:
+        st.progress(0.0, text=f"Wartet auf einen freien Worker ({stats['queued']} in der Warteschlange)...")
+    else:
+        st.progress(job.progress, text=job.message or "Läuft...")
+    if st.button("Abbrechen", key=f"cancel_{job.id}", icon=":material/cancel:"):
+        job.cancel()
+    st.caption(f"Warteschlange: {stats['queued']} · Auslastung: {stats['utilization']:.0%} von {stats['workers']} Workern")
 
-def display_html_report(report_title, image_file, full_financial_data):
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def poll_job(job_id):
     """
-    Displays the HTML report.
+    Polls a background job while it is running. Once it has finished, the whole app
+    reruns so that the caller can pick up the result.
     """
-    # --- Robust Path Construction ---
-    script_dir = os.path.dirname(__file__)
-    template_dir = os.path.abspath(os.path.join(script_dir, 'templates')) # Updated path
+    job = job_queue.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    show_job_status(job)
 
-    dynamic_date_range = "Daten nicht verfügbar"
-    if "Erfolgsrechnung" in full_financial_data and not full_financial_data["Erfolgsrechnung"].empty:
+def _build_pdf(job, hero_image, report_model, profile, archive=False):
+    """
+    Builds the PDF as a background job. With `archive`, the finished report is also
+    stored in the report archive (see report_archive.py).
+    """
+    job.update(0.1, "PDF wird erstellt...")
+    # ReportLab, Plotly and Kaleido are only loaded once the first PDF is requested
+    from pdf_export import pdf_from_reportlab
+    with span("pdf_from_reportlab", profile=profile):
+        pdf = pdf_from_reportlab(hero_image, report_model, profile=profile)
+    if archive:
+        job.update(0.9, "Bericht wird archiviert...")
         try:
-            date_range_value = full_financial_data["Erfolgsrechnung"].iloc[1, 1]
-            if isinstance(date_range_value, str):
-                dynamic_date_range = date_range_value
-        except (IndexError, KeyError):
-            st.warning("Could not extract date range from Erfolgsrechnung. Using default.")
-
-    dynamic_primary_market_area = "Daten nicht verfügbar"
-    if "Erfolgsrechnung" in full_financial_data and not full_financial_data["Erfolgsrechnung"].empty:
+            with span("archive_report"):
+                html = render_report_html(build_preview_context(report_model, hero_image))
+                archive_report(report_model, hero_image, profile, pdf, html)
+        except (sqlite3.Error, OSError):
+            # The PDF is still offered for download
+            logger.exception("Could not archive the report")
+    return pdf
+
+@st.fragment
+def display_pdf_download(hero_image, report_model):
+    """
+    Shows the PDF export below the preview. The PDF is built by a background job when
+    requested and kept in the session until the report or the chosen profile changes,
+    so edits in the editor do not rebuild it. Runs as its own fragment, so choosing a
+    profile does not re-render the preview.
+    """
+    with trace("fragment:pdf_download", session=streamlit_session_id()):
+        _pdf_download(hero_image, report_model)
+
+def _pdf_download(hero_image, report_model):
+    """Body of display_pdf_download, traced as one span."""
+    st.subheader("PDF Report Download")
+    pdf_profile = st.radio(
+        "PDF-Qualität",
+        options=list(PDF_PROFILES),
+        index=list(PDF_PROFILES).index(DEFAULT_PDF_PROFILE),
+        format_func=lambda name: {"screen": "Bildschirm / E-Mail (klein)", "print": "Druck (hohe Auflösung)"}.get(name, name),
+        key="pdf_profile",
+        horizontal=True,
+    )
+    pdf_key = (report_model.fingerprint, hero_image.digest, pdf_profile)
+
+    pdf_job = job_queue.get(st.session_state.get('pdf_job_id'))
+    if pdf_job is not None and pdf_job.done:
+        st.session_state.pdf_job_id = None
+        if pdf_job.status == DONE:
+            st.session_state.pdf_bytes = pdf_job.result
+            st.session_state.pdf_key = st.session_state.pdf_job_key
+        elif pdf_job.status == FAILED:
+            st.error(f"Error generating PDF: {pdf_job.error}")
+        pdf_job = None
+    elif pdf_job is not None and st.session_state.pdf_job_key != pdf_key:
+        # The report changed while its PDF was being built
+        pdf_job.cancel()
+        st.session_state.pdf_job_id = None
+        pdf_job = None
+
+    if st.session_state.get('pdf_key') == pdf_key:
+        st.download_button(
+            label="Download PDF Report",
+            data=st.session_state.pdf_bytes,
+            file_name="management_report.pdf",
+            mime="application/pdf",
+            icon=":material/download:"
+        )
+        return
+
+    if pdf_job is None and st.button("PDF erstellen", icon=":material/picture_as_pdf:"):
         try:
-            primary_market_area_value = full_financial_data["Erfolgsrechnung"].iloc[2, 1]
-            if isinstance(primary_market_area_value, str):
-                dynamic_primary_market_area = primary_market_area_value
-        except (IndexError, KeyError):
-            st.warning("Could not extract primary market area from Erfolgsrechnung. Using default.")
-
-    # --- Waterfall Chart Data Extraction for HTML ---
-    waterfall_x, waterfall_y, waterfall_measure = _get_waterfall_chart_data(full_financial_data)
-
-    waterfall_fig = create_waterfall_chart(waterfall_x, waterfall_y, waterfall_measure)
-    waterfall_html = waterfall_fig.to_html(full_html=False, include_plotlyjs='cdn')
-    
-    logo_path = os.path.join(template_dir, 'LELIA_LOGO_L_W.png')
-    css_path = os.path.join(template_dir, 'tailwind.css')
-
-    logo_base64 = image_to_base64(logo_path)
-    hero_image_base64 = base64.b64encode(image_file.getbuffer()).decode()
-    
-    try:
-        with open(css_path) as f:
-            css_content = f.read()
-    except FileNotFoundError:
-        css_content = ""
-        st.warning("tailwind.css not found.")
-
-    def markdown_to_html(md):
-        return markdown.markdown(md)
-
-    env = Environment(loader=FileSystemLoader(template_dir))
-    env.filters['currency'] = format_currency
-    env.filters['markdown'] = markdown_to_html
-    template = env.get_template('mgmtreporting.html')
-
-    ertraege_data = full_financial_data.get('Erträge', {})
-    aufwand_data = full_financial_data.get('Aufwand', {})
-    aktiva_data = full_financial_data.get('Aktiva', {})
-    passiva_data = full_financial_data.get('Passiva', {})
-
-    report_context = {
-        'report_title': dynamic_primary_market_area,
-        'primary_market_area': '',
-        'date_range': dynamic_date_range,
-        'logo_base64': logo_base64,
-        'hero_image_base64': hero_image_base64,
-        'css_content': css_content,
-        'ertraege': ertraege_data,
-        'aufwand': aufwand_data,
-        'aktiva': aktiva_data,
-        'passiva': passiva_data,
-        'current_year': datetime.now().year,
-        'waterfall_chart_html': waterfall_html,
-        'blockquote': st.session_state.generated_blockquote,
-        'executivesummary': st.session_state.generated_summary,
-        'waterfall_explanation_html': st.session_state.waterfall_explanation,
-        'budget_proposal_html': st.session_state.generated_budget,
-        'leerstand': st.session_state.leerstand,
-        'rendite_eigenkapital': st.session_state.rendite_eigenkapital,
-        'miete_pro_m2': st.session_state.miete_pro_m2,
-    }
-
-    html_content = template.render(report_context)
-    st.components.v1.html(html_content, height=800, scrolling=True)
+            pdf_job = job_queue.submit("PDF", job_function(st.session_state, _build_pdf, "PDF"), hero_image, report_model, pdf_profile, ARCHIVE_ENABLED)
+        except JobQueueFull:
+            st.warning("Der Server ist ausgelastet. Bitte versuchen Sie es in einem Moment erneut.")
+        else:
+            st.session_state.pdf_job_id = pdf_job.id
+            st.session_state.pdf_job_key = pdf_key
+    if pdf_job is not None:
+        poll_job(pdf_job.id)
 
-    with st.sidebar:
-        st.subheader("PDF Report Download")
-        try:
-            pdf_bytes = pdf_from_reportlab(image_file, full_financial_data, dynamic_date_range, dynamic_primary_market_area)
-            st.download_button(
-                label="Download PDF Report",
-                data=pdf_bytes,
-                file_name="management_report.pdf",
-                mime="application/pdf",
-                icon=":material/download:"
-            )
-        except Exception as e:
-            st.error(f"Error generating PDF: {e}")
+def display_performance_panel():
+    """
+    Shows the traces of this session (see tracing.py) as a timeline, with downloads of
+    the traces as JSON lines and of the process-wide stage metrics for Prometheus.
+    """
+    traces = recent_traces(session=streamlit_session_id(), limit=20)
+    with st.expander("Performance"):
+        if not traces:
+            st.caption("Noch keine Messungen in dieser Sitzung.")
+            return
+        labels = {
+            f"{datetime.fromtimestamp(t.started_at):%H:%M:%S} · {t.name} · {t.duration_ms:.0f} ms · {t.id}": t
+            for t in traces
+        }
+        selected = labels[st.selectbox("Ablauf", list(labels), key="performance_trace")]
+        if selected.parent_id:
+            st.caption(f"Gestartet von Trace {selected.parent_id}")
+        st.plotly_chart(create_trace_timeline(selected.spans), width="stretch")
+
+        col1, col2 = st.columns(2)
+        col1.download_button("Traces (JSONL)", traces_to_jsonl(traces), file_name="traces.jsonl", mime="application/x-ndjson", icon=":material/download:")
+        col2.download_button("Metriken (Prometheus)", prometheus_metrics(), file_name="metrics.prom", mime="text/plain", icon=":material/download:")
+
+PROFILE_TARGETS = {RERUN: "Nächster Rerun", JOB: "Nächster Hintergrundjob"}
+
+def display_profiling_panel():
+    """
+    Admin tools (see profiling.py): arms the CPU and memory profiler for the next
+    rerun or background job of this session and offers the captures for download.
+    """
+    with st.expander("Profiling (Admin)"):
+        target = st.radio("Profilieren", list(PROFILE_TARGETS), format_func=PROFILE_TARGETS.get, key="profile_target", horizontal=True)
+        if st.button("Profiler aktivieren", icon=":material/speed:"):
+            st.session_state[ARMED_KEY] = target
+        armed = st.session_state.get(ARMED_KEY)
+        if armed:
+            st.caption(f"Aktiv für: {PROFILE_TARGETS[armed]}. Das Ergebnis erscheint nach dem Lauf hier.")
+
+        for capture in recent_captures():
+            st.markdown(f"**{capture.name}** · {datetime.fromtimestamp(capture.started_at):%H:%M:%S} · {capture.seconds:.2f} s")
+            st.code(capture.function_report, language=None, height=200)
+            col1, col2 = st.columns(2)
+            col1.download_button("pstats", capture.pstats_bytes, file_name=f"profile_{capture.id}.pstats", mime="application/octet-stream", key=f"pstats_{capture.id}", on_click="ignore", icon=":material/download:")
+            col2.download_button("Speicher", capture.allocation_report, file_name=f"allocations_{capture.id}.txt", mime="text/plain", key=f"allocations_{capture.id}", on_click="ignore", icon=":material/download:")
+
+def display_report_archive():
+    """
+    Lists the archived reports by property and year and shows the selected one with
+    its PDF. Opening a report reads it from the archive; nothing is parsed or generated.
+    The archive is shared: it lists the reports of all users.
+    """
+    st.header("Berichtsarchiv")
+    st.caption("Das Archiv ist für alle Benutzer gemeinsam und enthält die Berichte aller Sitzungen.")
+    market_areas, years = archive_facets()
+    if not market_areas:
+        st.info("Das Archiv ist leer. Berichte werden archiviert, sobald ihr PDF erstellt wurde.")
+        return
+
+    col1, col2 = st.columns(2)
+    market_area = col1.selectbox("Liegenschaft", [None] + market_areas, format_func=lambda value: value or "Alle", key="archive_market_area")
+    year = col2.selectbox("Jahr", [None] + years, format_func=lambda value: str(value) if value else "Alle", key="archive_year")
+    entries = search_reports(market_area, year)
+    if not entries:
+        st.caption("Keine archivierten Berichte für diese Auswahl.")
+        return
+
+    table = pd.DataFrame([
+        {
+            "Liegenschaft": entry.market_area,
+            "Zeitraum": entry.date_range,
+            "PDF-Qualität": entry.profile,
+            "Archiviert": datetime.fromtimestamp(entry.archived_at).strftime("%d.%m.%Y %H:%M"),
+        }
+        for entry in entries
+    ])
+    selection = st.dataframe(table, hide_index=True, on_select="rerun", selection_mode="single-row", key="archive_table")
+    rows = selection.selection.rows
+    if not rows:
+        st.caption(f"Archivierte Berichte: {len(entries)}. Wählen Sie einen Bericht aus, um ihn zu öffnen.")
+        return
+
+    archived = load_report(entries[rows[0]].id)
+    if archived is None:
+        st.warning("Der Bericht ist nicht mehr im Archiv.")
+        return
+    entry, html, pdf = archived
+    if pdf is not None:
+        st.download_button(
+            label="Download PDF Report",
+            data=pdf,
+            file_name=f"management_report_{entry.period_start or entry.id}.pdf",
+            mime="application/pdf",
+            key=f"archive_pdf_{entry.id}",
+            on_click="ignore",
+            icon=":material/download:",
+        )
+    else:
+        st.warning("Die PDF-Datei dieses Berichts wurde nicht gefunden.")
+    st.components.v1.html(html, height=800, scrolling=True)
@@ -0,0 +1,17 @@
+from io import BytesIO
+
+from images import prepare_hero_image, PDF_PROFILES
+
+# The background jobs that process the uploads of the sidebar. They live outside of
+# main.py, which renders the app when it is imported, so that the load test
+# (load_test.py) runs the same code as the app.
+
+def parse_workbook(job, data):
+    """Parses an uploaded workbook as a background job."""
+    from data_loader import load_financial_data
+    return load_financial_data(BytesIO(data), progress=job.update)
+
+def prepare_uploaded_image(job, data):
+    """Decodes and resizes an uploaded cover image as a background job."""
+    job.update(0.0, "Bild wird vorbereitet...")
+    return prepare_hero_image(data, PDF_PROFILES)
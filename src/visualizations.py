@@ -1,9 +1,18 @@
-import plotly.graph_objects as go
+import html
+import math
+
+INCREASING_COLOR = "#2E6F40" # ForrestGreen for positive changes
+DECREASING_COLOR = "#DC143C" # Crimson for negative changes
+TOTALS_COLOR = "#3CB371"
+CONNECTOR_COLOR = "rgb(63, 63, 63)"
 
 def create_waterfall_chart(x_labels, y_values, measures, colors=None):
     """
     Creates and returns a Plotly Figure object for a waterfall chart using dynamic data.
     """
+    # Plotly takes a while to import and is only needed for the PDF and PREVIEW_CHART=plotly
+    import plotly.graph_objects as go
+
     if not x_labels or not y_values or not measures:
         # Return an empty figure or a placeholder if no data is provided
         fig = go.Figure()
@@ -21,10 +30,10 @@ def create_waterfall_chart(x_labels, y_values, measures, colors=None):
         y = y_values,
         text = text_labels,
         textposition = "outside",
-        connector = {"line":{"color":"rgb(63, 63, 63)"}},
-        increasing = {"marker":{"color":"#2E6F40"}}, # ForrestGreen for positive changes
-        decreasing = {"marker":{"color":"#DC143C"}}, # Crimson for negative changes
-        totals = {"marker":{"color":"#3CB371"}},     # SteelBlue for total bars
+        connector = {"line":{"color":CONNECTOR_COLOR}},
+        increasing = {"marker":{"color":INCREASING_COLOR}},
+        decreasing = {"marker":{"color":DECREASING_COLOR}},
+        totals = {"marker":{"color":TOTALS_COLOR}},     # SteelBlue for total bars
     ))
 
     fig.update_layout(
@@ -32,3 +41,123 @@ def create_waterfall_chart(x_labels, y_values, measures, colors=None):
     )
 
     return fig
+
+def _nice_step(span, target_ticks=5):
+    """Returns a 1/2/5 x 10^n tick step that splits `span` into about `target_ticks` intervals."""
+    if span <= 0:
+        return 1
+    raw_step = span / target_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for factor in (1, 2, 5, 10):
+        if raw_step <= factor * magnitude:
+            return factor * magnitude
+    return 10 * magnitude
+
+def create_waterfall_svg(x_labels, y_values, measures, width=700, height=400):
+    """
+    Renders the waterfall chart as a small static SVG string with the same colors and
+    bar labels as create_waterfall_chart. Unlike the Plotly figure it needs no
+    JavaScript, so it can be inlined into the preview.
+    """
+    if not x_labels or not y_values or not measures:
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" width="100%" role="img">'
+            f'<text x="{width / 2}" y="{height / 2}" text-anchor="middle" font-size="14" fill="#6b7280">'
+            'Waterfall Chart (No Data Available)</text></svg>'
+        )
+
+    # Compute the start and end of each bar the way Plotly does: "absolute" bars
+    # reset the running total, "relative" bars move it and "total" bars show it.
+    bars = []
+    running_total = 0
+    for label, value, measure in zip(x_labels, y_values, measures):
+        if measure == "absolute":
+            start, end, color = 0, value, TOTALS_COLOR
+            running_total = value
+        elif measure == "total":
+            start, end, color = 0, running_total, TOTALS_COLOR
+        else:
+            start, end = running_total, running_total + value
+            color = INCREASING_COLOR if value >= 0 else DECREASING_COLOR
+            running_total = end
+        bars.append((label, value, start, end, color))
+
+    margin_left, margin_right, margin_top, margin_bottom = 70, 20, 30, 90
+    plot_width = width - margin_left - margin_right
+    plot_height = height - margin_top - margin_bottom
+
+    low = min(0, *(min(start, end) for _, _, start, end, _ in bars))
+    high = max(0, *(max(start, end) for _, _, start, end, _ in bars))
+    step = _nice_step(high - low)
+    low = math.floor(low / step) * step
+    high = math.ceil(high / step) * step
+    if high == low:
+        high = low + step
+
+    def y_pos(value):
+        return margin_top + (high - value) / (high - low) * plot_height
+
+    slot = plot_width / len(bars)
+    bar_width = slot * 0.6
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" width="100%" role="img" '
+        'font-family="sans-serif" font-size="11">'
+    ]
+
+    # Gridlines and y-axis labels
+    tick = low
+    while tick <= high + step / 2:
+        y = y_pos(tick)
+        parts.append(f'<line x1="{margin_left}" x2="{width - margin_right}" y1="{y:.1f}" y2="{y:.1f}" stroke="#e5e7eb"/>')
+        parts.append(f'<text x="{margin_left - 6}" y="{y + 4:.1f}" text-anchor="end" fill="#4b5563">{tick / 1000:,.0f}k</text>')
+        tick += step
+
+    for index, (label, value, start, end, color) in enumerate(bars):
+        x = margin_left + index * slot + (slot - bar_width) / 2
+        top, bottom = y_pos(max(start, end)), y_pos(min(start, end))
+        parts.append(f'<rect x="{x:.1f}" y="{top:.1f}" width="{bar_width:.1f}" height="{max(bottom - top, 1):.1f}" fill="{color}"/>')
+        parts.append(f'<text x="{x + bar_width / 2:.1f}" y="{top - 4:.1f}" text-anchor="middle" fill="#111827">{value / 1000:,.1f}k</text>')
+
+        if index < len(bars) - 1:
+            # Connector to the next bar at the level of the running total
+            y = y_pos(end)
+            parts.append(f'<line x1="{x + bar_width:.1f}" x2="{x + slot:.1f}" y1="{y:.1f}" y2="{y:.1f}" stroke="{CONNECTOR_COLOR}"/>')
+
+        label_x = x + bar_width / 2
+        label_y = height - margin_bottom + 14
+        parts.append(
+            f'<text x="{label_x:.1f}" y="{label_y:.1f}" text-anchor="end" fill="#374151" '
+            f'transform="rotate(-30 {label_x:.1f} {label_y:.1f})">{html.escape(str(label))}</text>'
+        )
+
+    parts.append('</svg>')
+    return ''.join(parts)
+
+def create_trace_timeline(spans):
+    """
+    Creates a Plotly Figure showing the spans of a trace (see tracing.py) as a
+    timeline: one horizontal bar per span, from its start to its end in ms, nested
+    spans indented below their parents.
+    """
+    import plotly.graph_objects as go
+
+    labels = [f"{'  ' * span['depth']}{span['name']}" for span in spans]
+    fig = go.Figure(go.Bar(
+        orientation="h",
+        y=labels,
+        x=[span['duration_ms'] for span in spans],
+        base=[span['start_ms'] for span in spans],
+        marker_color=[DECREASING_COLOR if 'error' in span else TOTALS_COLOR for span in spans],
+        text=[f"{span['duration_ms']:.0f} ms" for span in spans],
+        textposition="outside",
+        hovertemplate="%{y}: %{base:.1f} ms + %{x:.1f} ms<extra></extra>",
+    ))
+    fig.update_layout(
+        showlegend=False,
+        height=max(200, 28 * len(spans) + 80),
+        margin=dict(l=10, r=10, t=10, b=30),
+        xaxis_title="ms",
+        yaxis=dict(autorange="reversed"),
+    )
+    return fig
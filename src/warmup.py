@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+# Set WARMUP=1 to prepare the expensive subsystems in a background thread as soon as
+# the process serves its first page, so the first report runs at steady-state latency.
+WARMUP_ENABLED = os.environ.get("WARMUP", "").lower() in ("1", "true", "yes")
+
+# Step name -> seconds it took, or the exception it raised
+warmup_timings = {}
+
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+def _dummy_report():
+    """Returns a tiny ReportModel and HeroImage that exercise every part of a report."""
+    from PIL import Image as PILImage
+    from data_loader import FinancialData
+    from images import prepare_hero_image, PDF_PROFILES
+    from report_model import build_report_model, DEFAULT_TEXTS, DEFAULT_KPIS
+
+    financial_data = FinancialData(
+        digest="warmup",
+        sheet_names=("Bilanz", "Erfolgsrechnung"),
+        sections={
+            'Erträge': {"Erträge aus Vermietung": 1000.0},
+            'Aufwand': {"Aufwände": 600.0, "Unterhalt": 600.0, "Abschluss Erfolgsrechnung": 400.0},
+            'Aktiva': {"Flüssige Mittel": 1000.0},
+            'Passiva': {"Eigenkapital": 1000.0},
+        },
+        date_range="01.01.2025 - 31.12.2025",
+        primary_market_area="Warmup",
+    )
+    image = BytesIO()
+    PILImage.new("RGB", (64, 36), (128, 128, 128)).save(image, format="PNG")
+    hero_image = prepare_hero_image(image.getvalue(), PDF_PROFILES)
+    # Markdown in the budget, so that the markdown renderer is loaded too
+    texts = {**{key: "Warmup" for key in DEFAULT_TEXTS}, 'budget': "**Warmup**"}
+    return build_report_model(financial_data, texts, DEFAULT_KPIS), hero_image
+
+def _warm_templates():
+    """Compiles the report template and loads the purged stylesheet and the logo."""
+    from html_renderer import get_template, get_css, get_logo_base64
+    get_template()
+    get_css()
+    get_logo_base64()
+
+def _warm_preview():
+    """Renders the HTML preview of the dummy report."""
+    from html_renderer import build_preview_context, render_preview_html
+    report_model, hero_image = _dummy_report()
+    render_preview_html(build_preview_context(report_model, hero_image))
+
+def _warm_pdf():
+    """
+    Builds the PDF of the dummy report: imports ReportLab, builds its stylesheet and
+    renders the waterfall chart through Kaleido/Chromium once.
+    """
+    from images import DEFAULT_PDF_PROFILE
+    from pdf_export import pdf_from_reportlab
+    report_model, hero_image = _dummy_report()
+    pdf_from_reportlab(hero_image, report_model, profile=DEFAULT_PDF_PROFILE)
+
+def _warm_gemini_client():
+    """Imports the Gemini SDK and creates the shared client."""
+    from llm_handler import get_gemini_client
+    # The warmup thread has no page to show an error on; the message is raised instead
+    errors = []
+    if get_gemini_client(on_error=errors.append) is None:
+        raise RuntimeError(errors[0] if errors else "Gemini client could not be created")
+
+WARMUP_STEPS = (
+    ("templates", _warm_templates),
+    ("preview", _warm_preview),
+    ("pdf", _warm_pdf),
+    ("gemini_client", _warm_gemini_client),
+)
+
+def run_warmup():
+    """
+    Runs all warmup steps and records how long each took in `warmup_timings`. A
+    failing step is recorded and does not stop the others.
+    """
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+            warmup_timings[name] = time.perf_counter() - start
+        except Exception as e:
+            warmup_timings[name] = e
+    failed = any(isinstance(result, Exception) for result in warmup_timings.values())
+    logger.log(logging.WARNING if failed else logging.INFO, "Warmup: %s", ", ".join(
+        f"{name} {result:.2f}s" if isinstance(result, float) else f"{name} failed ({result})"
+        for name, result in warmup_timings.items()
+    ))
+    return warmup_timings
+
+def start_warmup():
+    """Starts `run_warmup` in a background thread, once per process."""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=run_warmup, name="warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    run_warmup()
@@ -0,0 +1,10 @@
+from check_import_times import IMPORT_BUDGET_MS, measure_import
+
+def test_main_defers_heavy_libraries():
+    _, _, loaded = measure_import("main")
+    assert loaded == [], f"loaded at import time although deferred: {', '.join(loaded)}"
+
+def test_main_imports_within_budget():
+    total, slowest, _ = measure_import("main")
+    top = ", ".join(f"{name} {ms:.0f} ms" for name, ms in slowest[:5])
+    assert total <= IMPORT_BUDGET_MS, f"import main took {total:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms); slowest: {top}"
@@ -0,0 +1,29 @@
+from io import BytesIO
+
+from data_loader import load_financial_data
+from html_renderer import PREVIEW_MAX_BYTES, TRUNCATED_TABLES, build_preview_context, render_preview_html
+from report_model import DEFAULT_KPIS, DEFAULT_TEXTS, build_report_model
+from synthetic_workbook import generate_workbook
+
+def _preview_context(rows):
+    financial_data = load_financial_data(BytesIO(generate_workbook(rows=rows, seed=rows)))
+    return build_preview_context(build_report_model(financial_data, DEFAULT_TEXTS, DEFAULT_KPIS), None)
+
+def test_small_report_is_previewed_in_full():
+    context = _preview_context(40)
+    html, size, dropped = render_preview_html(context)
+    assert dropped == []
+    assert size <= PREVIEW_MAX_BYTES
+    assert "weitere Zeilen" not in html
+    assert all(key in html for key, _, _ in context['aufwand'])
+
+def test_large_report_keeps_a_shortened_preview():
+    # Over the budget even without the images, as a 2,000-row ledger is
+    context = _preview_context(2000)
+    html, size, dropped = render_preview_html(context)
+    assert html is not None
+    assert size <= PREVIEW_MAX_BYTES
+    assert TRUNCATED_TABLES in dropped
+    assert "weitere Zeilen (vollständig im PDF)" in html
+    # The first rows of every table are still shown
+    assert all(context[name][0][0] in html for name in ('ertraege', 'aufwand', 'aktiva', 'passiva'))